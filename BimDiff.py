@@ -53,11 +53,11 @@ class BIM_Diff:
         # make the main doc the active one before running this script!
         
         # what will be compared: IDs, geometry, materials. Everything else is discarded.
-        
-        MOVE_TOLERANCE = 0.2 # the max allowed move in mm
-        VOL_TOLERANCE = 250 # the max allowed volume diff in mm^3
+        # the comparison itself is done by BimDiffEngine, this command shows and applies it
         
         import FreeCADGui
+        import Part
+        import BimDiffEngine
         from PySide import QtCore,QtGui
         
         documents = FreeCAD.listDocuments()
@@ -72,119 +72,31 @@ class BIM_Diff:
                     otherdoc = list(documents.values())[1]
                 else:
                     otherdoc = list(documents.values())[0]
-            
-                # build lists of BIM objects with IFC ID
-                
-                objswithoutid = [] # let's try to match these later on
-            
-                activedocids = {} # main document, the original freecad one
-                for obj in activedoc.Objects:
-                    if hasattr(obj,"IfcData") and obj.ViewObject.Visibility:
-                        if "IfcUID" in obj.IfcData:
-                            activedocids[obj.IfcData["IfcUID"]] = obj
-                        elif obj.isDerivedFrom("Part::Feature"): # discard BuildingParts
-                            objswithoutid.append(obj)
-            
-                otherdocids = {} # other doc to be merged to the main one
-                for obj in otherdoc.Objects:
-                    if hasattr(obj,"IfcData") and obj.ViewObject.Visibility:
-                        if "IfcUID" in obj.IfcData:
-                            otherdocids[obj.IfcData["IfcUID"]] = obj
-            
-                toselect = [] # objects to select when finished
-                additions = [] # objects added
-                subtractions = [] # objects subtracted
-                modified = [] # objects modified
-                moved = [] # objects moved
-                matchanged = [] # object is same, but material changed
-                matchangedghost = [] # store shapes of objects whose material has changed to print a blue ghost later on
-                renamed = {} # object label changes
-                propertieschanged = {} # objects whose IFC properties are different
-            
-                for id,obj in otherdocids.items():
-                    if id in activedocids:
-                        # this object already exists                
-                        mainobj = activedocids[id]
-                        if obj.Label != mainobj.Label:
-                            # object has a different name
-                            renamed[mainobj.Name] = obj.Label
-                        if obj.IfcProperties and (obj.IfcProperties != mainobj.IfcProperties):
-                            # properties have changed
-                            propertieschanged[id] = obj.IfcProperties
-                        if hasattr(obj,"Shape") and hasattr(mainobj,"Shape"):
-                            v = abs(obj.Shape.Volume - mainobj.Shape.Volume)
-                            if v < VOL_TOLERANCE:
-                                # identical volume
-                                l = (obj.Shape.BoundBox.Center.sub(mainobj.Shape.BoundBox.Center)).Length
-                                if l < MOVE_TOLERANCE:
-                                    # identical position
-                                    if abs(obj.Shape.BoundBox.XMin - mainobj.Shape.BoundBox.XMin) < MOVE_TOLERANCE and \
-                                       abs(obj.Shape.BoundBox.YMin - mainobj.Shape.BoundBox.YMin) < MOVE_TOLERANCE and \
-                                       abs(obj.Shape.BoundBox.YMin - mainobj.Shape.BoundBox.YMin) < MOVE_TOLERANCE:
-                                        # same boundbox
-                                        if hasattr(obj,"Material") and hasattr(mainobj,"Material") and (obj.Material and mainobj.Material and (obj.Material.Label == mainobj.Material.Label)) or (obj.Material == mainobj.Material):
-                                            # same material names
-                                            obj.ViewObject.hide()
-                                        else:
-                                            print("Object",mainobj.Label,"material has changed")
-                                            obj.ViewObject.hide() # we hide these objects since the shape hasn't changed but we keep their shapes
-                                            matchangedghost.append(obj.Shape)
-                                            matchanged.append(obj)
-                                    else:
-                                        print("Object",mainobj.Label,"shape bound box has changed")
-                                        toselect.append(obj)
-                                        modified.append(obj)
-                                else:
-                                    print("Object",mainobj.Label,"position has moved by",l,"mm")
-                                    toselect.append(obj)
-                                    moved.append(obj)
-                            else:
-                                print("Object",mainobj.Label,"shape has changed by",v,"mm^3")
-                                toselect.append(obj)
-                                modified.append(obj)
-                        else:
-                            print("Object",mainobj.Label,"one of the objects has no shape")
-                            toselect.append(obj)
-                    else:
-                        print("Object",obj.Label,"doesn't exist yet in main doc")
-                        toselect.append(obj)
-                        additions.append(obj)
-            
-                for id,obj in activedocids.items():
-                    if not id in otherdocids:
-                        if obj.isDerivedFrom("Part::Feature"): # don't count building parts
-                            print("Object",obj.Label,"doesn't exist anymore in new doc")
-                            subtractions.append(obj)
-                
-                # try to find our objects without ID
-                newids = {}
-                for obj in objswithoutid:
-                    for id,otherobj in otherdocids.items():
-                        if not id in activedocids:
-                            if abs(otherobj.Shape.Volume - obj.Shape.Volume) < VOL_TOLERANCE:
-                                if (otherobj.Shape.BoundBox.Center.sub(obj.Shape.BoundBox.Center)).Length < MOVE_TOLERANCE:
-                                    if abs(obj.Shape.BoundBox.XMin - otherobj.Shape.BoundBox.XMin) < MOVE_TOLERANCE and \
-                                       abs(obj.Shape.BoundBox.YMin - otherobj.Shape.BoundBox.YMin) < MOVE_TOLERANCE and \
-                                       abs(obj.Shape.BoundBox.YMin - otherobj.Shape.BoundBox.YMin) < MOVE_TOLERANCE:
-                                           # shapes are identical. It's the same object!
-                                           newids[obj.Name] = id
-                                           break
-                    else:
-                        print("Object",obj.Label,"has no ID and wasn't found in the new doc")
-                        subtractions.append(obj)
-            
-                matnames = {} # existing materials
-                for obj in activedoc.Objects:
-                    if Draft.getType(obj) == "Material":
-                        matnames[obj.Label] = obj
-            
-                newmats = {} # new materials
-                for obj in otherdoc.Objects:
-                    if Draft.getType(obj) == "Material":
-                        if not obj.Label in matnames:
-                            print("Material",obj.Label,"doesn't exist in main doc")
-                            toselect.append(obj)
-                            newmats[obj.Label] = obj
+
+                result = BimDiffEngine.diffDocuments(activedoc,otherdoc,visible=True)
+                for message in result.getMessages():
+                    print(message)
+
+                # main and other objects by IFC ID, used when applying changes
+                activedocids = dict([(BimDiffEngine.getUID(o),o) for o in BimDiffEngine.getObjects(activedoc,visible=True) if BimDiffEngine.getUID(o)])
+                otherdocids = dict([(BimDiffEngine.getUID(o),o) for o in BimDiffEngine.getObjects(otherdoc,visible=True) if BimDiffEngine.getUID(o)])
+
+                # we hide the objects whose shape hasn't changed, but keep the shapes of those whose material changed
+                for mainobj,obj,value in result.same:
+                    obj.ViewObject.hide()
+
+                additions = [o for m,o,v in result.added] # objects added
+                subtractions = [m for m,o,v in result.removed] # objects subtracted
+                modified = [o for m,o,v in result.modified] # objects modified
+                moved = [o for m,o,v in result.moved] # objects moved
+                matchanged = [o for m,o,v in result.matchanged] # object is same, but material changed
+                matchangedghost = [o.Shape for o in matchanged] # store shapes of objects whose material has changed to print a blue ghost later on
+                renamed = dict([(m.Name,o.Label) for m,o,v in result.renamed]) # object label changes
+                propertieschanged = result.propertieschanged # objects whose IFC properties are different, with the changed keys
+                newids = dict([(m.Name,v) for m,o,v in result.newids])
+                matnames = BimDiffEngine.getMaterials(activedoc) # existing materials
+                newmats = dict([(v,o) for m,o,v in result.newmaterials]) # new materials
+                toselect = modified + moved + [o for m,o,v in result.noshape] + additions + list(newmats.values()) # objects to select when finished
             
                 if newmats:
                     group = otherdoc.addObject("App::DocumentObjectGroup","New_materials")
@@ -294,10 +206,9 @@ class BIM_Diff:
                 if propertieschanged:
                     reply = QtGui.QMessageBox.question(None, "", str(len(propertieschanged))+" "+translate("BIM","objects had their properties changed. Update?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
                     if reply == QtGui.QMessageBox.Yes:
-                        for id,prop in propertieschanged.items():
-                            obj = activedocids[id]
-                            print("Updating properties of ",obj.Label)
-                            obj.IfcProperties = prop
+                        for obj,otherobj,changes in propertieschanged:
+                            print("Updating",len(changes["added"])+len(changes["removed"])+len(changes["changed"]),"properties of",obj.Label)
+                            BimDiffEngine.mergeProperties(obj,otherobj,changes)
         
                 if moved:
                     reply = QtGui.QMessageBox.question(None, "", str(len(moved))+" "+translate("BIM","objects have their location changed. Move them to their new position?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
@@ -330,7 +241,24 @@ class BIM_Diff:
                                 otherobj.ViewObject.Transparency = 60
                             except AttributeError:
                                 print(otherobj.Label,"cannot be colorized")
-        
+                    reply = QtGui.QMessageBox.question(None, "", translate("BIM","Do you wish to compute the exact volumes added to and removed from the modified objects? This can take a while"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
+                    if reply == QtGui.QMessageBox.Yes:
+                        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+                        try:
+                            added,removed = BimDiffEngine.deepDiff(result)
+                        finally:
+                            QtGui.QApplication.restoreOverrideCursor()
+                        for mainobj,otherobj,(a,r) in result.deltas:
+                            print("Object",mainobj.Label,"gained",a,"mm^3 and lost",r,"mm^3")
+                        for shape,name,color in [(added,"Added_volume",(0.0,1.0,0.0)),(removed,"Removed_volume",(1.0,0.0,0.0))]:
+                            if shape:
+                                obj = activedoc.addObject("Part::Feature",name)
+                                obj.Shape = shape
+                                obj.ViewObject.LineWidth = 1
+                                obj.ViewObject.LineColor = color
+                                obj.ViewObject.ShapeColor = color
+                                obj.ViewObject.Transparency = 60
+
                 if subtractions:
                     reply = QtGui.QMessageBox.question(None, "", str(len(subtractions))+" "+translate("BIM","objects don't exist anymore in the new document. Move them to a 'To Delete' group?"), QtGui.QMessageBox.Yes | QtGui.QMessageBox.No, QtGui.QMessageBox.No)
                     if reply == QtGui.QMessageBox.Yes:
@@ -359,5 +287,13 @@ class BIM_Diff:
                             except AttributeError:
                                 print(otherobj.Label,"cannot be colorized")
 
+        elif len(documents) == 1 and FreeCAD.ActiveDocument.FileName and BimDiffEngine.listSnapshots(FreeCAD.ActiveDocument.FileName):
+
+            # compare the document with its last saved snapshot
+            result = BimDiffEngine.diffSnapshot(FreeCAD.ActiveDocument)
+            for message in result.getMessages():
+                print(message)
+            QtGui.QMessageBox.information(None,"",str(len(result))+" "+translate("BIM","changes since the last saved snapshot of this document. See the report view for details."))
+
         else:
             QtGui.QMessageBox.information(None,"",translate("BIM","You need two documents open to run this tool. One which is your main document, and one that contains new objects that you wish to compare against the existing one. Make sure only the objects you wish to compare in both documents are visible."))
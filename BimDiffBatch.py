@@ -0,0 +1,228 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""Headless batch diff. Compares pairs of model revisions, FCStd or IFC
+files, or .json snapshots from a <file>.FCStd.snapshots folder, each pair in
+its own FreeCADCmd process, and writes a JSON report of the changes found by
+BimDiffEngine.
+
+Usage: python BimDiffBatch.py [options] old1.FCStd new1.FCStd old2.ifc new2.ifc ...
+   or: python BimDiffBatch.py [options] --pairs pairs.txt
+
+where pairs.txt has one "old new" pair per line.
+
+This script doesn't need FreeCAD itself, it only drives FreeCADCmd workers.
+FreeCADCmd treats its command line arguments as files to open, so the worker
+gets its job through the BIM_DIFF_* environment variables instead."""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+
+
+WORKER_MAIN = "BIM_DIFF_MAIN" # the old revision
+WORKER_OTHER = "BIM_DIFF_OTHER" # the new revision
+WORKER_OUTPUT = "BIM_DIFF_OUTPUT" # the json file to write the results to
+WORKER_MOVE = "BIM_DIFF_MOVE_TOLERANCE"
+WORKER_VOLUME = "BIM_DIFF_VOL_TOLERANCE"
+WORKER_DEEP = "BIM_DIFF_DEEP" # "1" to compute the exact added and removed volumes of modified objects
+
+
+def openFile(filename):
+
+    "opens a FCStd file, or imports an IFC file in a new document, and returns the document"
+
+    import FreeCAD
+    if filename.lower().endswith(".ifc"):
+        import importIFC
+        doc = FreeCAD.newDocument(os.path.splitext(os.path.basename(filename))[0])
+        importIFC.insert(filename,doc.Name)
+        return doc
+    return FreeCAD.openDocument(filename)
+
+
+def runPair(main,other,movetol=None,voltol=None,deep=False):
+
+    "diffs the given files, inside FreeCAD, and returns a json-serializable dict"
+
+    import FreeCAD
+    import BimDiffEngine
+    if movetol is None:
+        movetol = BimDiffEngine.MOVE_TOLERANCE
+    if voltol is None:
+        voltol = BimDiffEngine.VOL_TOLERANCE
+    t = time.time()
+    if main.lower().endswith(".json") and other.lower().endswith(".json"):
+        # two snapshots written by BimDiffEngine, no document to open
+        report = BimDiffEngine.diffSnapshots(BimDiffEngine.readSnapshot(main),BimDiffEngine.readSnapshot(other),movetol,voltol).toDict()
+        report.update({"main":main,"other":other,"error":None,"wall":time.time() - t})
+        return report
+    docs = []
+    try:
+        docs.append(openFile(main))
+        docs.append(openFile(other))
+        result = BimDiffEngine.diffDocuments(docs[0],docs[1],movetol,voltol)
+        if deep:
+            BimDiffEngine.deepDiff(result)
+        report = result.toDict()
+    finally:
+        for doc in docs:
+            FreeCAD.closeDocument(doc.Name)
+    report["main"] = main
+    report["other"] = other
+    report["error"] = None
+    report["wall"] = time.time() - t
+    return report
+
+
+def worker():
+
+    "the FreeCADCmd side: diffs the pair described by the environment and writes its report"
+
+    main = os.environ[WORKER_MAIN]
+    other = os.environ[WORKER_OTHER]
+    output = os.environ[WORKER_OUTPUT]
+    movetol = float(os.environ[WORKER_MOVE]) if os.environ.get(WORKER_MOVE) else None
+    voltol = float(os.environ[WORKER_VOLUME]) if os.environ.get(WORKER_VOLUME) else None
+    try:
+        report = runPair(main,other,movetol,voltol,os.environ.get(WORKER_DEEP,"") == "1")
+    except Exception as e:
+        report = {"main":main,"other":other,"error":repr(e)}
+    with open(output,"w") as f:
+        json.dump(report,f)
+
+
+def runProcess(main,other,freecadcmd,timeout,movetol=None,voltol=None,deep=False):
+
+    "runs one FreeCADCmd worker on the given pair of files and returns its report"
+
+    import subprocess
+    import tempfile
+    fd,output = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    env = dict(os.environ)
+    env[WORKER_MAIN] = os.path.abspath(main)
+    env[WORKER_OTHER] = os.path.abspath(other)
+    env[WORKER_OUTPUT] = output
+    env[WORKER_MOVE] = "" if movetol is None else str(movetol)
+    env[WORKER_VOLUME] = "" if voltol is None else str(voltol)
+    env[WORKER_DEEP] = "1" if deep else ""
+    t = time.time()
+    report = {"main":main,"other":other,"error":None}
+    try:
+        proc = subprocess.run([freecadcmd,os.path.abspath(__file__)],env=env,timeout=timeout,
+                              stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+        if os.path.getsize(output):
+            with open(output) as f:
+                report = json.load(f)
+        else:
+            report["error"] = "FreeCADCmd exited with code "+str(proc.returncode)+": "+proc.stdout.decode("utf8","replace")[-2000:]
+    except subprocess.TimeoutExpired:
+        report["error"] = "Timeout after "+str(timeout)+"s"
+    except (OSError,ValueError) as e:
+        report["error"] = repr(e)
+    finally:
+        os.remove(output)
+    report["main"] = main
+    report["other"] = other
+    report["wall"] = time.time() - t
+    return report
+
+
+def readPairs(path):
+
+    "returns the (old,new) pairs listed in the given text file, one per line"
+
+    import shlex
+    pairs = []
+    with open(path) as f:
+        for line in f:
+            files = shlex.split(line,comments=True)
+            if len(files) == 2:
+                pairs.append(tuple(files))
+            elif files:
+                raise ValueError("Expected two files per line in "+path+": "+line.strip())
+    return pairs
+
+
+def main(argv=None):
+
+    "the command line entry point: fans the given pairs out to FreeCADCmd workers"
+
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+    parser = argparse.ArgumentParser(description="Compares pairs of FCStd or IFC model revisions")
+    parser.add_argument("files",nargs="*",help="old and new files, in pairs")
+    parser.add_argument("--pairs",help="text file listing one 'old new' pair per line")
+    parser.add_argument("-j","--jobs",type=int,default=os.cpu_count() or 1,help="number of FreeCADCmd processes to run in parallel")
+    parser.add_argument("--freecadcmd",default=os.environ.get("FREECADCMD","FreeCADCmd"),help="path to the FreeCADCmd executable")
+    parser.add_argument("--move-tolerance",type=float,default=None,help="max allowed move in mm")
+    parser.add_argument("--volume-tolerance",type=float,default=None,help="max allowed volume difference in mm^3")
+    parser.add_argument("--deep",action="store_true",help="also compute the exact added and removed volumes of modified objects, on a process pool")
+    parser.add_argument("--timeout",type=float,default=None,help="max seconds per pair")
+    parser.add_argument("--json",help="path of the JSON report to write")
+    parser.add_argument("--fail-on-change",action="store_true",help="exit with code 1 if any pair has changes")
+    args = parser.parse_args(argv)
+    if len(args.files) % 2:
+        parser.error("files must be given in pairs")
+    pairs = list(zip(args.files[::2],args.files[1::2]))
+    if args.pairs:
+        pairs.extend(readPairs(args.pairs))
+    if not pairs:
+        parser.error("no files to compare")
+
+    t = time.time()
+    with ThreadPoolExecutor(max_workers=max(1,args.jobs)) as pool:
+        # each thread only waits on its own FreeCADCmd process
+        reports = list(pool.map(lambda p: runProcess(p[0],p[1],args.freecadcmd,args.timeout,args.move_tolerance,args.volume_tolerance,args.deep),pairs))
+    changed = 0
+    errors = 0
+    for report in reports:
+        if report.get("error"):
+            errors += 1
+            print(report["main"],"->",report["other"],"ERROR",report["error"])
+            continue
+        if report["changes"]:
+            changed += 1
+        counts = ", ".join([str(len(report[c]))+" "+c for c in ("added","removed","moved","modified","matchanged","renamed","propertieschanged") if report.get(c)])
+        print(report["main"],"->",report["other"],counts or "no changes","(%.2fs)" % report.get("duration",0.0))
+    summary = {"pairs":len(reports),"changed":changed,"errors":errors,"duration":time.time()-t}
+    print(summary["pairs"],"pairs,",changed,"changed,",errors,"errors in","%.2f" % summary["duration"],"s")
+    if args.json:
+        with open(args.json,"w") as f:
+            json.dump({"summary":summary,"reports":reports},f,indent=1)
+    if errors:
+        return 2
+    if changed and args.fail_on_change:
+        return 1
+    return 0
+
+
+if os.environ.get(WORKER_MAIN):
+    # we are running inside a FreeCADCmd worker
+    sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+    worker()
+elif __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,854 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""The GUI-free part of BIM_Diff. Compares the BIM objects of two documents,
+a main one and a newer revision, matched by their IFC ID, and returns a
+DiffResult listing what was added, removed, moved, modified, renamed, and
+what had its material or IFC properties changed. Only IDs, geometry,
+materials, labels and IFC properties are compared. Nothing is changed in
+the documents, BIM_Diff applies the changes the user accepts"""
+
+import time
+import FreeCAD
+
+
+MOVE_TOLERANCE = 0.2 # the max allowed move in mm
+VOL_TOLERANCE = 250 # the max allowed volume diff in mm^3
+
+# the kinds of changes, in the order they are reported
+CHANGES = ["added","removed","moved","modified","noshape","matchanged","renamed","propertieschanged","newids","newmaterials"]
+
+
+class DiffResult:
+
+
+    """the differences between two documents. Each kind of change is a list of
+    (main object,other object,value) tuples, where the main object is None
+    for additions, the other object None for removals, and value gives the
+    details: the move distance, the volume difference, the new label..."""
+
+    def __init__(self,maindoc=None,otherdoc=None):
+
+        self.maindoc = maindoc
+        self.otherdoc = otherdoc
+        for change in CHANGES:
+            setattr(self,change,[])
+        self.same = [] # matched objects whose shape is identical, not a change by itself
+        self.deltas = [] # (main object,other object,(added volume,removed volume)) of modified pairs, filled by deepDiff
+        self.compared = 0 # number of objects found in both documents
+        self.duration = 0.0
+
+    def __len__(self):
+
+        return sum([len(getattr(self,change)) for change in CHANGES])
+
+    def getMessages(self):
+
+        "returns a list of human-readable lines describing the changes"
+
+        messages = []
+        for main,other,value in self.renamed:
+            messages.append("Object "+main.Label+" has been renamed to "+other.Label)
+        for main,other,value in self.propertieschanged:
+            changes = ["+"+p["name"] for p in value["added"]] + ["-"+p["name"] for p in value["removed"]]
+            for p in value["changed"]:
+                changes.append(p["name"]+(": "+str(p["old"])+" -> "+str(p["new"]) if p["new"] is not None else ""))
+            messages.append("Object "+main.Label+" properties have changed: "+", ".join(changes))
+        for main,other,value in self.matchanged:
+            messages.append("Object "+main.Label+" material has changed")
+        for main,other,value in self.modified:
+            if value is None:
+                messages.append("Object "+main.Label+" shape bound box has changed")
+            else:
+                messages.append("Object "+main.Label+" shape has changed by "+str(value)+" mm^3")
+        for main,other,value in self.moved:
+            messages.append("Object "+main.Label+" position has moved by "+str(value)+" mm")
+        for main,other,value in self.noshape:
+            messages.append("Object "+main.Label+" one of the objects has no shape")
+        for main,other,value in self.added:
+            messages.append("Object "+other.Label+" doesn't exist yet in main doc")
+        for main,other,value in self.removed:
+            if getUID(main):
+                messages.append("Object "+main.Label+" doesn't exist anymore in new doc")
+            else:
+                messages.append("Object "+main.Label+" has no ID and wasn't found in the new doc")
+        for main,other,value in self.newmaterials:
+            messages.append("Material "+other.Label+" doesn't exist in main doc")
+        return messages
+
+    def toDict(self):
+
+        "returns a json-serializable dict of this result"
+
+        def describe(obj):
+            if obj is None:
+                return None
+            return {"name":obj.Name,"label":obj.Label}
+        d = {"main":self.maindoc.FileName or self.maindoc.Name if self.maindoc else None,
+             "other":self.otherdoc.FileName or self.otherdoc.Name if self.otherdoc else None,
+             "compared":self.compared,
+             "duration":self.duration,
+             "changes":len(self)}
+        for change in CHANGES:
+            entries = []
+            for main,other,value in getattr(self,change):
+                entry = {"uid":getUID(main) or getUID(other),"main":describe(main),"other":describe(other)}
+                if value is not None:
+                    entry["value"] = value
+                entries.append(entry)
+            d[change] = entries
+        if self.deltas:
+            d["deltas"] = [{"uid":getUID(main),"added":value[0],"removed":value[1]} for main,other,value in self.deltas]
+        return d
+
+
+def getUID(obj):
+
+    "returns the IFC ID of the given object, or None"
+
+    if obj is not None and hasattr(obj,"IfcData") and ("IfcUID" in obj.IfcData):
+        return obj.IfcData["IfcUID"]
+    return None
+
+
+def getObjects(doc,visible=False):
+
+    """returns the BIM objects of the given document. If visible is True and
+    the GUI is up, only the visible ones are returned"""
+
+    objs = []
+    for obj in doc.Objects:
+        if hasattr(obj,"IfcData"):
+            if visible and FreeCAD.GuiUp and obj.ViewObject and not obj.ViewObject.Visibility:
+                continue
+            objs.append(obj)
+    return objs
+
+
+def getMaterials(doc):
+
+    "returns a {label: material} dict of the materials of the given document"
+
+    import Draft
+    materials = {}
+    for obj in doc.Objects:
+        if Draft.getType(obj) == "Material":
+            materials[obj.Label] = obj
+    return materials
+
+
+def getMaterialLabel(obj):
+
+    if isinstance(obj,SnapshotObject):
+        return obj.record.get("material")
+    material = getattr(obj,"Material",None)
+    if material:
+        return material.Label
+    return None
+
+
+# geometric fingerprints
+
+# Each object with a shape is summarized once by a row of floats: volume,
+# bound box, bound box center, area, center of mass and the diagonal of its
+# matrix of inertia. Rows are cached by document and object name, with the
+# shape they were computed from, so an unchanged object is never measured
+# twice, and all the matched pairs are compared at once with numpy instead of
+# reading Shape.Volume and Shape.BoundBox pair by pair. A cached row is only
+# used if its shape isSame() as the current one: hash codes alone come from
+# memory addresses, which OCC reuses once a shape is freed, and keeping the
+# shape in the cache keeps its address from being reused. The snapshot
+# observer, started with the first cached row, drops the rows of changed
+# objects and closed documents.
+
+FIELDS = ["Volume","XMin","YMin","ZMin","XMax","YMax","ZMax","CX","CY","CZ","Area","MX","MY","MZ","IXX","IYY","IZZ"]
+VOLUME = 0
+MINS = slice(1,4)
+CENTER = slice(7,10)
+FINGERPRINTS = {} # (Document Name,object Name): (shape,fingerprint tuple)
+
+# the shape comparison statuses, as stored in the arrays returned by compareFingerprints
+STATUSES = ["same","moved","modified","noshape"]
+SAME,MOVED,MODIFIED,NOSHAPE = range(4)
+
+
+def getFingerprint(obj):
+
+    "returns the fingerprint tuple of the shape of the given object, or None if it has no shape"
+
+    if isinstance(obj,SnapshotObject):
+        return obj.record.get("fingerprint")
+    shape = getattr(obj,"Shape",None)
+    if shape is None:
+        return None
+    try:
+        key = (obj.Document.Name,obj.Name)
+    except AttributeError:
+        key = None
+    cached = FINGERPRINTS.get(key)
+    if cached and cached[0].isSame(shape):
+        return cached[1]
+    bb = shape.BoundBox
+    try:
+        com = shape.CenterOfMass
+    except Exception:
+        # only solids and compounds of solids have one
+        com = bb.Center
+    try:
+        m = shape.MatrixOfInertia
+        inertia = (m.A11,m.A22,m.A33)
+    except Exception:
+        inertia = (0.0,0.0,0.0)
+    fingerprint = (shape.Volume,bb.XMin,bb.YMin,bb.ZMin,bb.XMax,bb.YMax,bb.ZMax,
+                   bb.Center.x,bb.Center.y,bb.Center.z,shape.Area,com.x,com.y,com.z) + inertia
+    if key:
+        if OBSERVER is None:
+            observe()
+        FINGERPRINTS[key] = (shape,fingerprint)
+    return fingerprint
+
+
+def forgetFingerprints(docname,objname=None):
+
+    "drops the cached fingerprints of the given document, or of one of its objects"
+
+    if objname is not None:
+        FINGERPRINTS.pop((docname,objname),None)
+        return
+    for key in [k for k in list(FINGERPRINTS.keys()) if k[0] == docname]:
+        FINGERPRINTS.pop(key,None)
+
+
+def getFingerprints(objs):
+
+    """returns (fingerprints,valid), a (n,len(FIELDS)) float array of the
+    fingerprints of the given objects, and a boolean array telling which
+    objects have a shape"""
+
+    import numpy
+    fingerprints = numpy.zeros((len(objs),len(FIELDS)))
+    valid = numpy.zeros(len(objs),dtype=bool)
+    for i,obj in enumerate(objs):
+        fingerprint = getFingerprint(obj)
+        if fingerprint is not None:
+            fingerprints[i] = fingerprint
+            valid[i] = True
+    return fingerprints,valid
+
+
+def compareFingerprints(main,other,movetol=MOVE_TOLERANCE,voltol=VOL_TOLERANCE):
+
+    """compares two (fingerprints,valid) pairs of arrays of the same length,
+    row by row, and returns (statuses,values), where statuses holds indices
+    in STATUSES and values the volume difference of modified rows (nan if
+    only the bound box differs) or the move distance of moved rows"""
+
+    import numpy
+    fmain,vmain = main
+    fother,vother = other
+    dv = numpy.abs(fother[:,VOLUME] - fmain[:,VOLUME])
+    dl = numpy.linalg.norm(fother[:,CENTER] - fmain[:,CENTER],axis=1)
+    dmin = numpy.any(numpy.abs(fother[:,MINS] - fmain[:,MINS]) >= movetol,axis=1)
+    statuses = numpy.full(len(dv),SAME,dtype=numpy.int8)
+    values = numpy.full(len(dv),numpy.nan)
+    # the checks are done from the last to the first to take precedence
+    statuses[dmin] = MODIFIED
+    moved = dl >= movetol
+    statuses[moved] = MOVED
+    values[moved] = dl[moved]
+    modified = dv >= voltol
+    statuses[modified] = MODIFIED
+    values[modified] = dv[modified]
+    statuses[~(vmain & vother)] = NOSHAPE
+    return statuses,values
+
+
+def getPropertyHashes(obj):
+
+    """returns a {key: hash} dict of the IFC properties of the given object,
+    where hash is a short hash of the value, stable across sessions"""
+
+    import hashlib
+    if isinstance(obj,SnapshotObject):
+        return obj.record.get("properties") or {}
+    props = getattr(obj,"IfcProperties",None) or {}
+    return dict([(k,hashlib.md5(v.encode("utf8")).hexdigest()[:16]) for k,v in props.items()])
+
+
+def parseProperty(key,value):
+
+    """returns a {key,name,pset,type,value} dict from an IfcProperties key and
+    value, in any of the formats used by Arch. value can be None if unknown"""
+
+    prop = {"key":key,"name":key,"pset":None,"type":None,"value":value}
+    if ";;" in key: # 0.19 format, name;;pset
+        prop["name"],prop["pset"] = key.split(";;")[:2]
+    if value is None:
+        return prop
+    v = value.split(";;")
+    if len(v) == 3:
+        prop["pset"],prop["type"],prop["value"] = v
+    elif len(v) == 2:
+        prop["type"],prop["value"] = v
+        if not prop["pset"]: # old system
+            prop["pset"] = "Default property set"
+    return prop
+
+
+def diffProperties(mainobj,otherobj):
+
+    """returns the differences between the IFC properties of two objects, as
+    an {added,removed,changed} dict of lists of parsed properties, changed
+    ones having an old and a new value, or None if they are identical or if
+    the other object has no properties. Values are only compared key by key
+    when the whole properties differ"""
+
+    snapshot = isinstance(mainobj,SnapshotObject) or isinstance(otherobj,SnapshotObject)
+    if snapshot:
+        old = getPropertyHashes(mainobj)
+        new = getPropertyHashes(otherobj)
+        oldvalues = {}
+        newvalues = {}
+    else:
+        # on live objects the values themselves are compared, which is faster than hashing them
+        old = oldvalues = getattr(mainobj,"IfcProperties",None) or {}
+        new = newvalues = getattr(otherobj,"IfcProperties",None) or {}
+    if (not new) or (old == new):
+        return None
+    changes = {"added":[],"removed":[],"changed":[]}
+    for key,h in new.items():
+        if not key in old:
+            changes["added"].append(parseProperty(key,newvalues.get(key)))
+        elif old[key] != h:
+            prop = parseProperty(key,newvalues.get(key))
+            prop["new"] = prop.pop("value")
+            prop["old"] = parseProperty(key,oldvalues.get(key))["value"]
+            changes["changed"].append(prop)
+    for key in old:
+        if not key in new:
+            changes["removed"].append(parseProperty(key,oldvalues.get(key)))
+    return changes
+
+
+def mergeProperties(mainobj,otherobj,changes):
+
+    "applies the given changes, from diffProperties, from the other object to the main object"
+
+    props = dict(mainobj.IfcProperties)
+    for prop in changes["removed"]:
+        props.pop(prop["key"],None)
+    for prop in changes["added"] + changes["changed"]:
+        props[prop["key"]] = otherobj.IfcProperties[prop["key"]]
+    mainobj.IfcProperties = props
+
+
+def compareShapes(mainobj,otherobj,movetol=MOVE_TOLERANCE,voltol=VOL_TOLERANCE):
+
+    """compares the shapes of two objects and returns (status,value), where
+    status is "same", "moved" (value is the distance), "modified" (value is
+    the volume difference, or None if only the bound box differs) or
+    "noshape" if one of the objects has no shape"""
+
+    statuses,values = compareFingerprints(getFingerprints([mainobj]),getFingerprints([otherobj]),movetol,voltol)
+    return STATUSES[statuses[0]],toValue(values[0])
+
+
+def toValue(value):
+
+    "returns a numpy value as a python float, or None if it is nan"
+
+    import math
+    value = float(value)
+    return None if math.isnan(value) else value
+
+
+class CenterGrid:
+
+
+    """a uniform grid of points, to find the points close to a given one
+    without testing them all"""
+
+    def __init__(self,points,size):
+
+        import numpy
+        self.points = points
+        self.size = max(size,1e-6)
+        self.cells = {} # (i,j,k): [point indices]
+        keys = numpy.floor(points / self.size).astype(numpy.int64)
+        for i,key in enumerate(keys.tolist()):
+            self.cells.setdefault(tuple(key),[]).append(i)
+
+    def near(self,point,radius):
+
+        "returns the indices of the points closer than radius to the given point"
+
+        import numpy
+        lo = numpy.floor((point - radius) / self.size).astype(numpy.int64).tolist()
+        hi = numpy.floor((point + radius) / self.size).astype(numpy.int64).tolist()
+        found = []
+        for x in range(lo[0],hi[0]+1):
+            for y in range(lo[1],hi[1]+1):
+                for z in range(lo[2],hi[2]+1):
+                    found.extend(self.cells.get((x,y,z),[]))
+        found = numpy.array(found,dtype=numpy.int64)
+        if len(found):
+            found = found[numpy.linalg.norm(self.points[found] - point,axis=1) < radius]
+        return found
+
+
+def diff(mainobjs,otherobjs,movetol=MOVE_TOLERANCE,voltol=VOL_TOLERANCE,result=None):
+
+    """compares two lists of BIM objects and returns a DiffResult. Objects are
+    matched by IFC ID. Main objects without ID are matched by shape against
+    the new objects whose ID isn't used in the main document"""
+
+    import numpy
+    t = time.time()
+    if result is None:
+        result = DiffResult()
+    mainids = {} # main document, the original freecad one
+    noids = [] # let's try to match these later on
+    for obj in mainobjs:
+        uid = getUID(obj)
+        if uid:
+            mainids[uid] = obj
+        elif obj.isDerivedFrom("Part::Feature"): # discard BuildingParts
+            noids.append(obj)
+    otherids = {} # other doc to be merged to the main one
+    for obj in otherobjs:
+        uid = getUID(obj)
+        if uid:
+            otherids[uid] = obj
+
+    pairs = []
+    for uid,obj in otherids.items():
+        mainobj = mainids.get(uid)
+        if mainobj is None:
+            result.added.append((None,obj,None))
+            continue
+        pairs.append((mainobj,obj))
+        if obj.Label != mainobj.Label:
+            result.renamed.append((mainobj,obj,obj.Label))
+        changes = diffProperties(mainobj,obj)
+        if changes:
+            result.propertieschanged.append((mainobj,obj,changes))
+    result.compared = len(pairs)
+
+    # compare the shapes of all the pairs at once
+    statuses,values = compareFingerprints(getFingerprints([p[0] for p in pairs]),
+                                          getFingerprints([p[1] for p in pairs]),
+                                          movetol,voltol)
+    for (mainobj,obj),status,value in zip(pairs,statuses,values):
+        if status == SAME:
+            result.same.append((mainobj,obj,None))
+            if getMaterialLabel(obj) != getMaterialLabel(mainobj):
+                result.matchanged.append((mainobj,obj,getMaterialLabel(obj)))
+        else:
+            getattr(result,STATUSES[status]).append((mainobj,obj,toValue(value)))
+
+    for uid,obj in mainids.items():
+        if not uid in otherids:
+            if obj.isDerivedFrom("Part::Feature"): # don't count building parts
+                result.removed.append((obj,None,None))
+
+    # try to find our objects without ID. Only the candidates whose center is
+    # close enough, found through a grid, have their fingerprints compared
+    candidates = [(uid,obj) for uid,obj in otherids.items() if not uid in mainids and getFingerprint(obj) is not None]
+    fcandidates,vcandidates = getFingerprints([c[1] for c in candidates])
+    grid = CenterGrid(fcandidates[vcandidates][:,CENTER],movetol)
+    rows = numpy.nonzero(vcandidates)[0] # grid index: candidate index
+    fnoids,vnoids = getFingerprints(noids)
+    for i,obj in enumerate(noids):
+        near = rows[grid.near(fnoids[i,CENTER],movetol)] if vnoids[i] else []
+        if len(near):
+            row = (numpy.repeat(fnoids[i:i+1],len(near),axis=0),numpy.repeat(vnoids[i:i+1],len(near)))
+            matches = numpy.nonzero(compareFingerprints(row,(fcandidates[near],vcandidates[near]),movetol,voltol)[0] == SAME)[0]
+        else:
+            matches = []
+        if len(matches):
+            # shapes are identical. It's the same object!
+            uid,otherobj = candidates[near[matches[0]]]
+            result.newids.append((obj,otherobj,uid))
+        else:
+            result.removed.append((obj,None,None))
+
+    result.duration = time.time() - t
+    return result
+
+
+def diffDocuments(maindoc,otherdoc,movetol=MOVE_TOLERANCE,voltol=VOL_TOLERANCE,visible=False):
+
+    """compares two documents and returns a DiffResult. If visible is True, only
+    the visible objects are compared, like the BIM_Diff command does"""
+
+    t = time.time()
+    result = DiffResult(maindoc,otherdoc)
+    diff(getObjects(maindoc,visible),getObjects(otherdoc,visible),movetol,voltol,result)
+    matnames = getMaterials(maindoc)
+    for label,mat in getMaterials(otherdoc).items():
+        if not label in matnames:
+            result.newmaterials.append((None,mat,label))
+    result.duration = time.time() - t
+    return result
+
+
+# deep diff
+
+# The exact geometric difference of modified pairs is computed with two
+# boolean cuts per pair. Booleans are slow and independent from each other,
+# so they run on a process pool, the shapes travelling as BREP strings.
+
+def cutShapes(main,other):
+
+    "returns (added,removed), the parts of other not in main and of main not in other, or None if a cut fails"
+
+    results = []
+    for a,b in [(other,main),(main,other)]:
+        try:
+            cut = a.cut(b)
+        except Exception:
+            cut = None
+        if cut is not None and (cut.isNull() or not cut.Solids):
+            cut = None
+        results.append(cut)
+    return tuple(results)
+
+
+def cutBreps(pairs):
+
+    "pool worker: returns, for each (main,other) pair of BREP strings, the (added,removed) BREP strings, empty if none"
+
+    import BimProcessPool
+    results = []
+    for breps in pairs:
+        main,other = BimProcessPool.readBreps(breps)
+        results.append(tuple([s.exportBrepToString() if s else "" for s in cutShapes(main,other)]))
+    return results
+
+
+def deepDiff(result,parallel=True):
+
+    """computes the exact added and removed solids of the modified pairs of
+    the given DiffResult, fills its deltas, and returns (added,removed), two
+    compounds of all the added and all the removed solids, or None"""
+
+    import Part
+    import BimProcessPool
+    pairs = [(m,o) for m,o,v in result.modified]
+    cuts = None
+    if parallel and (len(pairs) >= BimProcessPool.MIN_ITEMS):
+        breps = BimProcessPool.runPool(cutBreps,[(m.Shape.exportBrepToString(),o.Shape.exportBrepToString()) for m,o in pairs])
+        if breps is not None:
+            cuts = []
+            for added,removed in breps:
+                cuts.append(tuple([BimProcessPool.readBreps([b])[0] if b else None for b in (added,removed)]))
+    if cuts is None:
+        cuts = [cutShapes(m.Shape,o.Shape) for m,o in pairs]
+    result.deltas = []
+    added = []
+    removed = []
+    for (main,other),(a,r) in zip(pairs,cuts):
+        result.deltas.append((main,other,(a.Volume if a else 0.0,r.Volume if r else 0.0)))
+        if a:
+            added.append(a)
+        if r:
+            removed.append(r)
+    return (Part.makeCompound(added) if added else None,Part.makeCompound(removed) if removed else None)
+
+
+# snapshots
+
+# A snapshot records, for each BIM object of a document, what diff() looks
+# at: label, IFC ID, material, a hash of the IFC properties and the shape
+# fingerprint. When enabled by the DiffSnapshots preference, a snapshot is
+# written next to the file each time a document is saved, in a
+# <file>.snapshots folder, so any two revisions can be diffed without
+# opening them. A document observer keeps track of the objects changed
+# since the document was opened or last saved, and only those have their
+# fingerprint computed again. Each snapshot records the size and modification
+# time of the file it was taken from, and previous fingerprints are only
+# reused if they match the file as it was when the document was opened or
+# last saved, as the file might have been saved without a snapshot, for ex.
+# in another session or with snapshots disabled.
+
+OBSERVER = None
+
+
+class SnapshotObject:
+
+
+    "an object recorded in a snapshot, offering what diff() reads from document objects"
+
+    def __init__(self,record):
+
+        self.record = record
+        self.Name = record["name"]
+        self.Label = record["label"]
+        self.IfcData = {"IfcUID":record["uid"]} if record.get("uid") else {}
+
+    def isDerivedFrom(self,typename):
+
+        return (typename == "Part::Feature") and self.record.get("part",False)
+
+
+class Snapshot:
+
+
+    "the recorded state of the BIM objects of a document"
+
+    def __init__(self,records=None,materials=None,created=None,filename=None,stamp=None):
+
+        self.records = records or {} # object Name: record dict
+        self.materials = materials or [] # material labels
+        self.created = created or time.time()
+        self.filename = filename # the FCStd file this snapshot was taken from
+        self.stamp = stamp # [size,mtime] of that file once saved, see getFileStamp
+
+    def getObjects(self):
+
+        return [SnapshotObject(r) for r in self.records.values()]
+
+    def toDict(self):
+
+        return {"version":1,"created":self.created,"filename":self.filename,"stamp":self.stamp,
+                "materials":self.materials,"objects":list(self.records.values())}
+
+
+def makeRecord(obj,fingerprint=False):
+
+    """returns the snapshot record of the given object. If fingerprint is not
+    False, it is used instead of computing the fingerprint of the shape"""
+
+    if fingerprint is False:
+        fingerprint = getFingerprint(obj)
+    return {"name":obj.Name,
+            "label":obj.Label,
+            "uid":getUID(obj),
+            "part":obj.isDerivedFrom("Part::Feature"),
+            "material":getMaterialLabel(obj),
+            "properties":getPropertyHashes(obj),
+            "fingerprint":list(fingerprint) if fingerprint is not None else None}
+
+
+def makeSnapshot(doc,previous=None,changed=None):
+
+    """returns a Snapshot of the given document. If a previous snapshot and the
+    set of names of the objects changed since then are given, the unchanged
+    objects keep their previous fingerprint"""
+
+    records = {}
+    for obj in getObjects(doc):
+        if previous and (changed is not None) and (not obj.Name in changed) and (obj.Name in previous.records):
+            records[obj.Name] = makeRecord(obj,previous.records[obj.Name]["fingerprint"])
+        else:
+            records[obj.Name] = makeRecord(obj)
+    return Snapshot(records,list(getMaterials(doc).keys()),filename=doc.FileName)
+
+
+def getSnapshotFolder(filename):
+
+    return filename + ".snapshots"
+
+
+def listSnapshots(filename):
+
+    "returns the paths of the snapshots of the given file, oldest first"
+
+    import os
+    folder = getSnapshotFolder(filename)
+    if not os.path.isdir(folder):
+        return []
+    return [os.path.join(folder,f) for f in sorted(os.listdir(folder)) if f.endswith(".json")]
+
+
+def readSnapshot(path):
+
+    import json
+    with open(path) as f:
+        d = json.load(f)
+    return Snapshot(dict([(r["name"],r) for r in d["objects"]]),d["materials"],d["created"],d["filename"],d.get("stamp"))
+
+
+def getFileStamp(filename):
+
+    "returns [size,mtime] of the given file, or None if it can't be read"
+
+    import os
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return [st.st_size,st.st_mtime]
+
+
+def writeSnapshot(snapshot,filename,keep=None):
+
+    """writes the given snapshot in the snapshot folder of the given file,
+    and deletes the oldest snapshots above the given count. Returns the path"""
+
+    import os
+    import json
+    if keep is None:
+        keep = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetInt("DiffSnapshotCount",10)
+    folder = getSnapshotFolder(filename)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    name = time.strftime("%Y%m%d-%H%M%S",time.localtime(snapshot.created)) + "-%03d" % int((snapshot.created % 1) * 1000)
+    count = 0
+    path = os.path.join(folder,name+"-00.json")
+    while os.path.exists(path):
+        # several saves in the same millisecond, the counter keeps them sorted
+        count += 1
+        path = os.path.join(folder,name+"-%02d.json" % count)
+    with open(path,"w") as f:
+        json.dump(snapshot.toDict(),f)
+    if keep > 0:
+        for old in listSnapshots(filename)[:-keep]:
+            os.remove(old)
+    return path
+
+
+def diffSnapshots(main,other,movetol=MOVE_TOLERANCE,voltol=VOL_TOLERANCE):
+
+    "compares two Snapshots and returns a DiffResult"
+
+    t = time.time()
+    result = diff(main.getObjects(),other.getObjects(),movetol,voltol)
+    for label in other.materials:
+        if not label in main.materials:
+            result.newmaterials.append((None,SnapshotObject({"name":label,"label":label}),label))
+    result.duration = time.time() - t
+    return result
+
+
+def diffSnapshot(doc,movetol=MOVE_TOLERANCE,voltol=VOL_TOLERANCE):
+
+    """compares the given document against its last snapshot and returns a
+    DiffResult, or None if it has no snapshot. Only the objects changed since
+    the snapshot have their shape measured"""
+
+    snapshots = listSnapshots(doc.FileName) if doc.FileName else []
+    if not snapshots:
+        return None
+    last = readSnapshot(snapshots[-1])
+    changed = OBSERVER.getChanged(doc,last) if OBSERVER else None
+    return diffSnapshots(last,makeSnapshot(doc,last,changed),movetol,voltol)
+
+
+class SnapshotObserver:
+
+
+    """a document observer that tracks the objects changed since a document
+    was opened or saved, writes a snapshot when it is saved, and keeps the
+    fingerprints cache up to date"""
+
+    def __init__(self):
+
+        self.changed = {} # Document Name: set of changed object Names, for documents watched since opened
+        self.last = {} # Document Name: Snapshot written at the last save
+        self.stamps = {} # Document Name: stamp of its file when it was opened or last saved
+
+    def getChanged(self,doc,snapshot):
+
+        """returns the names of the objects changed since the given snapshot
+        was taken, or None if unknown: the snapshot must have been taken from
+        the file as it was when the document was opened or last saved"""
+
+        stamp = self.stamps.get(doc.Name)
+        if (stamp is None) or (snapshot is None) or (snapshot.stamp != stamp):
+            return None
+        return self.changed.get(doc.Name)
+
+    def slotCreatedDocument(self,doc):
+
+        self.changed[doc.Name] = set()
+        self.stamps.pop(doc.Name,None)
+
+    def slotFinishRestoreDocument(self,doc):
+
+        # the objects created while restoring are not changes
+        self.changed[doc.Name] = set()
+        self.stamps[doc.Name] = getFileStamp(doc.FileName) if doc.FileName else None
+
+    def slotDeletedDocument(self,doc):
+
+        self.changed.pop(doc.Name,None)
+        self.last.pop(doc.Name,None)
+        self.stamps.pop(doc.Name,None)
+        forgetFingerprints(doc.Name)
+
+    def slotCreatedObject(self,obj):
+
+        self.slotChangedObject(obj,None)
+
+    def slotDeletedObject(self,obj):
+
+        self.slotChangedObject(obj,None)
+
+    def slotChangedObject(self,obj,prop):
+
+        try:
+            docname = obj.Document.Name
+        except Exception:
+            # the object might be half-deleted already
+            return
+        forgetFingerprints(docname,obj.Name)
+        changed = self.changed.get(docname)
+        if changed is not None:
+            changed.add(obj.Name)
+
+    def slotFinishSaveDocument(self,doc,filename):
+
+        stamp = getFileStamp(filename)
+        try:
+            if not FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetBool("DiffSnapshots",False):
+                return
+            previous = self.last.get(doc.Name)
+            if previous is None:
+                snapshots = listSnapshots(filename)
+                if snapshots:
+                    try:
+                        previous = readSnapshot(snapshots[-1])
+                    except (OSError,IOError,ValueError,KeyError):
+                        previous = None
+            try:
+                snapshot = makeSnapshot(doc,previous,self.getChanged(doc,previous))
+                snapshot.stamp = stamp
+                writeSnapshot(snapshot,filename)
+            except Exception as e:
+                FreeCAD.Console.PrintWarning("BIM: unable to write the diff snapshot of "+filename+": "+str(e)+"\n")
+                return
+            self.last[doc.Name] = snapshot
+        finally:
+            # the saved file is the new reference, with or without a snapshot
+            self.stamps[doc.Name] = stamp
+            self.changed[doc.Name] = set()
+
+
+def observe():
+
+    "starts tracking changed objects and writing snapshots on save"
+
+    global OBSERVER
+    if OBSERVER is None:
+        OBSERVER = SnapshotObserver()
+        FreeCAD.addDocumentObserver(OBSERVER)
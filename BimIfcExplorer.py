@@ -23,6 +23,8 @@
 from __future__ import print_function
 
 import os
+import re
+import time
 import FreeCAD
 from BimTranslateUtils import *
 
@@ -33,6 +35,9 @@ class BIM_IfcExplorer:
     def __init__(self):
 
         self.tree = None
+        self.loader = None
+        self.filename = None
+        self.ifc = None
 
 
     def GetResources(self):
@@ -66,14 +71,15 @@ class BIM_IfcExplorer:
         # setup a brush to paint text in system link color
         self.linkbrush = QtGui.QApplication.palette().link()
 
-        # draw the main tree widget
-        self.tree = QtGui.QTreeWidget()
-        self.tree.setColumnCount(1)
+        # draw the main tree view. Its model is set when a file is opened
+        self.tree = QtGui.QTreeView()
         self.tree.setWordWrap(True)
+        self.tree.setUniformRowHeights(True)
         self.tree.header().setDefaultSectionSize(60)
         self.tree.header().resizeSection(0,180)
         self.tree.header().setStretchLastSection(True)
-        self.tree.headerItem().setText(0, translate("BIM","Objects structure"))
+        self.model = None
+        self.icons = {} # QIcon cache, by icon path
 
         # draw the attributes widget
         self.attributes = QtGui.QTreeWidget()
@@ -104,10 +110,26 @@ class BIM_IfcExplorer:
         self.dialog.resize(720, 540)
         toolbar = QtGui.QToolBar()
 
+        # draw the search box and its results list, hidden when empty
+        self.searchEdit = QtGui.QLineEdit()
+        self.searchEdit.setPlaceholderText(translate("BIM","Search"))
+        self.searchEdit.setToolTip(translate("BIM","Searches names, GlobalIds, tags and property values"))
+        self.searchResults = QtGui.QListWidget()
+        self.searchResults.setUniformItemSizes(True)
+        self.searchResults.hide()
+        self.searchTimer = QtCore.QTimer()
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.timeout.connect(self.search)
+        self.search_index = None
+
         layout = QtGui.QVBoxLayout(self.dialog)
         layout.addWidget(toolbar)
         hlayout = QtGui.QHBoxLayout(self.dialog)
-        hlayout.addWidget(self.tree)
+        tlayout = QtGui.QVBoxLayout()
+        tlayout.addWidget(self.searchEdit)
+        tlayout.addWidget(self.searchResults)
+        tlayout.addWidget(self.tree)
+        hlayout.addLayout(tlayout)
         layout.addLayout(hlayout)
         vlayout = QtGui.QVBoxLayout(self.dialog)
         hlayout.addLayout(vlayout)
@@ -142,80 +164,165 @@ class BIM_IfcExplorer:
         self.meshAction.setIcon(QtGui.QIcon(":/icons/DrawStyleShaded.svg"))
         toolbar.addAction(self.meshAction)
 
+        self.referencesAction = QtGui.QAction(translate("BIM","Referenced by"), None)
+        self.referencesAction.setToolTip(translate("BIM","Shows all the entities referencing the selected entity"))
+        self.referencesAction.triggered.connect(self.showReferences)
+        self.referencesAction.setIcon(QtGui.QIcon(":/icons/edit-select-all.svg"))
+        self.referencesAction.setEnabled(False)
+        toolbar.addAction(self.referencesAction)
+
         # connect signals/slots
-        self.tree.currentItemChanged.connect(self.onSelectTree)
         self.attributes.itemDoubleClicked.connect(self.onDoubleClickTree)
         self.properties.itemDoubleClicked.connect(self.onDoubleClickTree)
+        self.searchEdit.textChanged.connect(self.onSearchChanged)
+        self.searchEdit.returnPressed.connect(self.search)
+        self.searchResults.itemActivated.connect(self.onSearchResult)
+        self.searchResults.itemClicked.connect(self.onSearchResult)
         self.dialog.rejected.connect(self.close)
 
         # center the dialog over FreeCAD window
         mw = FreeCADGui.getMainWindow()
         self.dialog.move(mw.frameGeometry().topLeft() + mw.rect().center() - self.dialog.rect().center())
 
-        # open a file and show the dialog
-        self.open()
+        # show the dialog and open a file
         self.dialog.show()
+        self.open()
 
 
     def open(self):
         
         "opens a file"
         
-        import ifcopenshell
         from PySide import QtCore,QtGui
-        self.filename = None
-        lastfolder = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetString("lastIfcExplorerFolder","")
-        filename = QtGui.QFileDialog.getOpenFileName(None,translate("BIM","Select an IFC file"),lastfolder,translate("BIM","IFC files (*.ifc)"))
-        if filename:
-            self.filename = filename[0]
-            FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").SetString("lastIfcExplorerFolder",os.path.dirname(self.filename))
-
-        if not os.path.exists(self.filename):
+        if self.loader:
+            return
+        filename = QtGui.QFileDialog.getOpenFileName(None,translate("BIM","Select an IFC file"),
+                                                     FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetString("lastIfcExplorerFolder",""),
+                                                     translate("BIM","IFC files (*.ifc)"))
+        if not filename or not filename[0]:
+            return
+        filename = filename[0]
+        FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").SetString("lastIfcExplorerFolder",os.path.dirname(filename))
+        if not os.path.exists(filename):
             FreeCAD.Console.PrintError(translate("BIM","File not found")+"\n")
             return
-        
+
+        # read and parse the file on a worker thread. The current file stays shown until it is done
+        self.loader = IfcLoader(filename)
+        self.progress = QtGui.QProgressDialog(translate("BIM","Reading")+" "+os.path.basename(filename),
+                                              translate("BIM","Cancel"),0,100,self.dialog)
+        self.progress.setWindowTitle(translate("BIM","Opening IFC file"))
+        self.progress.setMinimumDuration(0)
+        self.progress.setWindowModality(QtCore.Qt.WindowModal)
+        self.progress.canceled.connect(self.cancelOpen)
+        self.openAction.setEnabled(False)
+        self.loadTimer = QtCore.QTimer()
+        self.loadTimer.timeout.connect(self.onLoadProgress)
+        self.loader.start()
+        self.loadTimer.start(100)
+
+
+    def onLoadProgress(self):
+
+        "updates the progress dialog while a file loads, and shows the file when it is loaded"
+
+        loader = self.loader
+        if not loader:
+            return
+        elapsed = " (" + "%.0f" % (time.time() - loader.started) + "s)"
+        if loader.parsing:
+            self.progress.setRange(0,0)
+            self.progress.setLabelText(translate("BIM","Parsing")+" "+str(loader.entities)+" "+translate("BIM","entities")+elapsed)
+        else:
+            self.progress.setValue(int(100 * loader.read / max(1,loader.size)))
+            self.progress.setLabelText(translate("BIM","Indexing" if loader.indexing else "Reading")+" "+"%.1f" % (loader.read/1048576.0)+" / "+"%.1f" % (loader.size/1048576.0)+" MB, "
+                                       +str(loader.entities)+" "+translate("BIM","entities")+elapsed)
+        if not loader.isAlive():
+            self.loadTimer.stop()
+            self.loader = None
+            self.openAction.setEnabled(True)
+            self.progress.canceled.disconnect(self.cancelOpen)
+            self.progress.close()
+            if loader.error:
+                FreeCAD.Console.PrintError(translate("BIM","Unable to open")+" "+loader.filename+": "+str(loader.error)+"\n")
+            elif loader.ifc:
+                self.setFile(loader.filename,loader.ifc)
+
+
+    def cancelOpen(self):
+
+        "stops loading a file. The parsing, if started, finishes in the background and is discarded"
+
+        if self.loader:
+            self.loader.cancel()
+            self.loader = None
+            self.loadTimer.stop()
+            self.progress.close()
+            self.openAction.setEnabled(True)
+
+
+    def setFile(self,filename,ifc):
+
+        "shows the given parsed IFC file"
+
+        import BimIfcMesh
+        self.filename = filename
+
         # set window title
         self.dialog.setWindowTitle(translate("BIM","IFC Explorer")+" - "+os.path.basename(self.filename))
 
         # clear everything
-        self.tree.clear()
         self.attributes.clear()
         self.properties.clear()
-        self.done = []
         self.backnav = []
-        self.mesh = None
-        self.products = []
-        self.omeshes = {}
-        self.currentmesh = None
-
-        # read file and order contents
-        self.ifc = ifcopenshell.open(self.filename)
-        root = self.getEntitiesTree()
-
-        # populate tree contents
-        for eid,children in root.items():
-            self.addEntity(eid,children,self.tree)
-        #self.tree.expandAll()
+        self.mesh = None # the mesh object showing all products
+        self.omeshes = BimIfcMesh.loadCache(filename) or {} # product id: (verts,faces) numpy arrays
+        self.ranges = {} # product id: (first face,face count) in the mesh object
+        self.current = None # id of the entity shown in the attributes and properties panes
+        self.relations = IfcRelations(ifc)
+
+        # show the sites. Their contents are only read when expanded
+        if hasattr(self.ifc,"close"):
+            self.ifc.close() # a previous BimIfcIndex
+        self.ifc = ifc
+        self.model = IfcTreeModel(self,[site.id() for site in self.ifc.by_type("IfcSite")])
+        self.tree.setModel(self.model)
+        self.tree.selectionModel().currentChanged.connect(self.onSelectTree)
+        for row in range(self.model.rowCount()):
+            self.tree.expand(self.model.index(row,0))
+
+        # index the file for the search box in the background
+        if self.search_index:
+            self.search_index.cancel()
+        self.search_index = IfcSearchIndex(ifc)
+        self.search_index.start()
+        self.searchEdit.clear()
 
 
     def close(self):
         
         "close the dialog"
         
+        self.cancelOpen()
+        self.searchTimer.stop()
+        if self.search_index:
+            self.search_index.cancel()
+        if self.isLean():
+            self.ifc.close()
         if FreeCAD.ActiveDocument:
             if self.mesh:
                 FreeCAD.ActiveDocument.removeObject(self.mesh.Name)
-            if self.currentmesh:
-                FreeCAD.ActiveDocument.removeObject(self.currentmesh.Name)
 
 
     def back(self):
         
         "selects the previously selected item in the tree"
         
+        from PySide import QtCore,QtGui
         if self.backnav:
-            item = self.backnav.pop()
-            self.tree.setCurrentItem(item)
+            index = self.backnav.pop()
+            if index.isValid():
+                self.tree.setCurrentIndex(QtCore.QModelIndex(index))
 
 
     def insert(self):
@@ -226,17 +333,20 @@ class BIM_IfcExplorer:
         from PySide import QtCore,QtGui
         doc = FreeCAD.ActiveDocument
         if doc and self.filename:
-            item = self.tree.currentItem()
-            if item:
-                eid = item.data(0,QtCore.Qt.UserRole)
+            index = self.tree.currentIndex()
+            if index.isValid():
+                eid = index.data(QtCore.Qt.UserRole)
                 if eid:
                     importIFC.ZOOMOUT = False
-                    try:
-                        importIFC.insert(self.ifc,doc.Name,only=[eid])
-                    except TypeError:
+                    if self.isLean():
                         importIFC.insert(self.filename,doc.Name,only=[eid])
-                    if self.currentmesh:
-                        self.currentmesh.ViewObject.hide()
+                    else:
+                        try:
+                            importIFC.insert(self.ifc,doc.Name,only=[eid])
+                        except TypeError:
+                            importIFC.insert(self.filename,doc.Name,only=[eid])
+                    if self.mesh:
+                        self.highlight([])
 
 
     def toggleMesh(self,checked=False):
@@ -244,9 +354,6 @@ class BIM_IfcExplorer:
         "turns mesh display on/off"
 
         import FreeCADGui
-        import Mesh
-        import ifcopenshell
-        from ifcopenshell import geom
         if not FreeCAD.ActiveDocument:
             doc = FreeCAD.newDocument()
             FreeCAD.setActiveDocument(doc.Name)
@@ -254,174 +361,243 @@ class BIM_IfcExplorer:
             if checked:
                 if self.mesh:
                     self.mesh.ViewObject.show()
+                elif not self.getMesh():
+                    self.meshAction.setChecked(False)
                 else:
-                    try:
-                        import importIFCHelper
-                        s = importIFCHelper.getScaling(self.ifc)
-                    except:
-                        import importIFC
-                        s = importIFC.getScaling(self.ifc)
-                    s *= 1000 # ifcopenshell outputs its meshes in metres
-                    trf = None
-                    if s != 1:
-                        trf = FreeCAD.Matrix()
-                        trf.scale(s,s,s)
-                    basemesh = Mesh.Mesh()
-                    s = geom.settings()
-                    s.set(s.USE_WORLD_COORDS,True)
-                    for product in self.products:
-                        try:
-                            m = geom.create_shape(s,product)
-                            g = m.geometry
-                            v = g.verts
-                            f = g.faces
-                            verts = [FreeCAD.Vector(v[i:i+3]) for i in range(0,len(v),3)]
-                            faces = [tuple(f[i:i+3]) for i in range(0,len(f),3)]
-                            omesh = Mesh.Mesh((verts,faces))
-                            if trf:
-                                omesh.transform(trf)
-                            self.omeshes[product.id()] = omesh
-                            basemesh.addMesh(omesh)
-                        except:
-                            pass
-                    self.mesh = FreeCAD.ActiveDocument.addObject("Mesh::Feature","IFCMesh")
-                    self.mesh.Mesh = basemesh
-                    self.mesh.ViewObject.Transparency = 85
-                    FreeCAD.ActiveDocument.recompute()
                     FreeCADGui.Selection.clearSelection()
                     FreeCADGui.Selection.addSelection(self.mesh)
                     FreeCADGui.SendMsgToActiveView("ViewSelection")
             else:
                 if self.mesh:
                     self.mesh.ViewObject.hide()
-                if self.currentmesh:
-                    self.currentmesh.ViewObject.hide()
 
 
-    def getEntitiesTree(self):
+    def getMesh(self):
+
+        """returns the mesh object showing all products, creating it if needed.
+        All products are merged in one mesh, and self.ranges tells which faces
+        belong to which product"""
+
+        import BimIfcMesh
+        from PySide import QtCore,QtGui
+        if not self.mesh:
+            if not self.omeshes and self.isLean():
+                FreeCAD.Console.PrintWarning(translate("BIM","This file is too big to be tessellated by the explorer")+"\n")
+                return None
+            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+            t = time.time()
+            if not self.omeshes:
+                self.omeshes = BimIfcMesh.getGeometry(self.filename,self.ifc)
+            verts,faces,self.ranges = BimIfcMesh.merge(self.omeshes)
+            mesh = BimIfcMesh.toMesh(verts,faces)
+            if mesh.CountFacets != len(faces):
+                # the faces order can't be trusted, don't highlight wrong faces
+                FreeCAD.Console.PrintWarning(translate("BIM","The IFC mesh has been altered when created, selected objects won't be highlighted")+"\n")
+                self.ranges = {}
+            FreeCAD.Console.PrintLog("IfcExplorer: "+str(len(self.omeshes))+" products, "+str(len(faces))+" faces ready in "+"%.2f" % (time.time()-t)+"s\n")
+            self.mesh = FreeCAD.ActiveDocument.addObject("Mesh::Feature","IFCMesh")
+            self.mesh.Mesh = mesh
+            self.mesh.ViewObject.Transparency = 85
+            FreeCAD.ActiveDocument.recompute()
+            QtGui.QApplication.restoreOverrideCursor()
+        return self.mesh
+
+
+    def isLean(self):
+
+        "returns True if the current file is browsed through a BimIfcIndex instead of being parsed"
 
-        "stacks the entities inside containers"
+        import BimIfcIndex
+        return isinstance(self.ifc,BimIfcIndex.IfcIndex)
 
-        root = {}
 
-        for site in self.ifc.by_type("IfcSite"):
-            root[site.id()] = self.getChildren(site)
+    def isEntity(self,value):
 
-        return root
+        "returns True if the given attribute value is an IFC entity"
+
+        import ifcopenshell
+        import BimIfcIndex
+        return isinstance(value,(ifcopenshell.entity_instance,BimIfcIndex.IndexedEntity))
 
-        #entities =  ifc.by_type("IfcRoot")
-        #entities += ifc.by_type("IfcRepresentation")
-        #entities += ifc.by_type("IfcRepresentationItem")
-        #entities += ifc.by_type("IfcRepresentationMap")
-        #entities += ifc.by_type("IfcPlacement")
-        #entities += ifc.by_type("IfcProperty")
-        #entities += ifc.by_type("IfcPhysicalSimpleQuantity")
-        #entities += ifc.by_type("IfcMaterial")
-        #entities += ifc.by_type("IfcProductRepresentation")
-        #entities = sorted(entities, key=lambda eid: eid.id())
 
+    def highlight(self,ids):
 
-    def getChildren(self,obj,keys=False):
+        """highlights the faces of the given products in the mesh object. This
+        only changes the display, the document is not touched"""
+
+        import numpy
+        vobj = self.mesh.ViewObject
+        try:
+            vobj.clearSelection()
+            ranges = [self.ranges[i] for i in ids if i in self.ranges]
+            if ranges:
+                vobj.setSelection(numpy.concatenate([numpy.arange(start,start+count) for start,count in ranges]).tolist())
+        except AttributeError:
+            # FreeCAD versions older than 0.19 can't select mesh faces from python
+            pass
 
-        "returns a recursive dict of the children of this obj"
 
-        children = {}
-        if obj.is_a("IfcProduct"):
-            self.products.append(obj)
+    def getChildren(self,obj,representations=True):
+
+        "returns the entities shown under this obj in the tree, or only its spatial children if representations is False"
+
+        children = []
         if hasattr(obj,"IsDecomposedBy"): # building structure
             for rel in obj.IsDecomposedBy:
                 if hasattr(rel,"RelatedObjects"):
-                    for child in rel.RelatedObjects:
-                        children[child.id()] = self.getChildren(child)
+                    children.extend(rel.RelatedObjects)
         if hasattr(obj,"ContainsElements"): # objects inside building structure
             for rel in obj.ContainsElements:
                 if hasattr(rel,"RelatedElements"):
-                    for child in rel.RelatedElements:
-                        children[child.id()] = self.getChildren(child)
+                    children.extend(rel.RelatedElements)
+        if not representations:
+            return children
         if hasattr(obj,"Representation"): # Shape representation
             if obj.Representation:
-                children[obj.Representation.id()] = self.getChildren(obj.Representation)
+                children.append(obj.Representation)
         if hasattr(obj,"Representations"):
-            for rep in obj.Representations:
-                children[rep.id()] = self.getChildren(rep)
+            children.extend(obj.Representations)
         if obj.is_a("IfcShapeRepresentation"):
-            for it in obj.Items:
-                children[it.id()] = self.getChildren(it)
-        if keys:
-            def getkeys(d): 
-                ck = list(d.keys())
-                for v in d.values():
-                    ck.extend(getkeys(v))
-                return ck
-            return getkeys(children)
+            children.extend(obj.Items)
         return children
 
 
-    def addEntity(self,eid,children,parent):
+    def hasChildren(self,obj):
 
-        "adds a given entity and its children to the given tree item"
+        "returns True if getChildren(obj) would return anything, without building the list"
+
+        for rel in getattr(obj,"IsDecomposedBy",None) or []:
+            if getattr(rel,"RelatedObjects",None):
+                return True
+        for rel in getattr(obj,"ContainsElements",None) or []:
+            if getattr(rel,"RelatedElements",None):
+                return True
+        if getattr(obj,"Representation",None):
+            return True
+        if getattr(obj,"Representations",None):
+            return True
+        if obj.is_a("IfcShapeRepresentation"):
+            return bool(obj.Items)
+        return False
+
+
+    def getDescendants(self,obj,representations=True):
+
+        "returns the ids of all the entities shown under this obj in the tree, or only of its spatial children"
+
+        ids = []
+        stack = self.getChildren(obj,representations)
+        while stack:
+            child = stack.pop()
+            ids.append(child.id())
+            stack.extend(self.getChildren(child,representations))
+        return ids
 
-        from PySide import QtCore,QtGui
 
-        def get_name(e):
+    def getParent(self,obj):
+
+        "returns the entity under which this obj is shown in the tree, or None"
+
+        for rel in getattr(obj,"Decomposes",None) or []:
+            return rel.RelatingObject
+        for rel in getattr(obj,"ContainedInStructure",None) or []:
+            return rel.RelatingStructure
+        for product in getattr(obj,"ShapeOfProduct",None) or []:
+            return product
+        for rep in getattr(obj,"OfProductRepresentation",None) or []:
+            return rep
+        if obj.is_a("IfcRepresentationItem") and hasattr(self.ifc,"get_inverse"):
+            for inv in self.ifc.get_inverse(obj):
+                if inv.is_a("IfcShapeRepresentation"):
+                    return inv
+        return None
+
+
+    def selectEntity(self,eid):
+
+        "selects the given entity in the tree, expanding its parents. Returns False if it is not in the tree"
+
+        if not self.model:
+            return False
+        path = []
+        roots = set(self.model.root.childids)
+        entity = self.ifc[eid]
+        while entity:
+            path.insert(0,entity.id())
+            if path[0] in roots:
+                # the sites are the top rows, don't climb up to the project
+                break
+            if len(path) > 256:
+                return False # cyclic structure
+            entity = self.getParent(entity)
+        index = self.model.findPath(path)
+        if not index.isValid():
+            return False
+        self.tree.scrollTo(index)
+        self.tree.setCurrentIndex(index)
+        return True
+
+
+    def getLabel(self,entity):
+
+        "returns the text shown in the tree for this entity"
+
+        name = ""
+        if entity.is_a("IfcProduct"):
             try:
-                return " : " + e.get_info()['Name']
+                name = " : " + entity.get_info()['Name']
             except:
-                return ""
+                pass
+        return "#"+self.tostr(entity.id())+" : "+self.tostr(entity.is_a())+name
 
-        if not eid in self.done:
-            entity = self.ifc[eid]
-            item = QtGui.QTreeWidgetItem(parent)
-            #item.setText(0,self.tostr(eid))
-            name = ""
-            if entity.is_a("IfcProduct"):
-                name = get_name(entity)
-                item.setFont(0,self.bold)
-                if isinstance(parent,QtGui.QTreeWidgetItem):
-                    parent.setExpanded(True)
-            item.setText(0,"#"+self.tostr(eid)+" : "+self.tostr(entity.is_a())+name)
-            if entity.is_a() in ["IfcWall","IfcWallStandardCase"]:
-                item.setIcon(0,QtGui.QIcon(":icons/Arch_Wall_Tree.svg"))
-            elif entity.is_a() in ["IfcBuildingElementProxy"]:
-                item.setIcon(0,QtGui.QIcon(":icons/Arch_Component.svg"))
-            elif entity.is_a() in ["IfcColumn","IfcColumnStandardCase","IfcBeam","IfcBeamStandardCase","IfcSlab","IfcFooting","IfcPile","IfcTendon"]:
-                item.setIcon(0,QtGui.QIcon(":icons/Arch_Structure_Tree.svg"))
-            elif entity.is_a() in ["IfcSite"]:
-                item.setIcon(0,QtGui.QIcon(":icons/Arch_Site_Tree.svg"))
-            elif entity.is_a() in ["IfcBuilding"]:
-                item.setIcon(0,QtGui.QIcon(":icons/Arch_Building_Tree.svg"))
-            elif entity.is_a() in ["IfcBuildingStorey"]:
-                item.setIcon(0,QtGui.QIcon(":icons/Arch_Floor_Tree.svg"))
-            elif entity.is_a() in ["IfcWindow","IfcWindowStandardCase","IfcDoor","IfcDoorStandardCase"]:
-                item.setIcon(0,QtGui.QIcon(":icons/Arch_Window_Tree.svg"))
-            elif entity.is_a() in ["IfcRoof"]:
-                item.setIcon(0,QtGui.QIcon(":icons/Arch_Roof_Tree.svg"))
-            elif entity.is_a() in ["IfcExtrudedAreaSolid","IfcClosedShell"]:
-                item.setIcon(0,QtGui.QIcon(":icons/Tree_Part.svg"))
-            elif entity.is_a() in ["IfcFace"]:
-                item.setIcon(0,QtGui.QIcon(":icons/Draft_SwitchMode.svg"))
-            elif entity.is_a() in ["IfcArbitraryClosedProfileDef","IfcPolyloop"]:
-                item.setIcon(0,QtGui.QIcon(":icons/Draft_Draft.svg"))
-            elif entity.is_a() in ["IfcPropertySingleValue","IfcQuantityArea","IfcQuantityVolume"]:
-                item.setIcon(0,QtGui.QIcon(":icons/Tree_Annotation.svg"))
-            elif entity.is_a() in ["IfcMaterial"]:
-                item.setIcon(0,QtGui.QIcon(":icons/Arch_Material.svg"))
-            elif entity.is_a() in ["IfcReinforcingBar"]:
-                item.setIcon(0,QtGui.QIcon(":icons/Arch_Rebar.svg"))
-            elif entity.is_a("IfcProduct"):
-                item.setIcon(0,QtGui.QIcon(":icons/Arch_Component.svg"))
-            self.tree.setFirstItemColumnSpanned(item,True)
-            item.setData(0,QtCore.Qt.UserRole,eid)
-            for childid,grandchildren in children.items():
-                self.addEntity(childid,grandchildren,item)
-            self.done.append(eid)
+
+    def getIcon(self,entity):
+
+        "returns the icon shown in the tree for this entity, or None"
+
+        from PySide import QtCore,QtGui
+        icon = None
+        if entity.is_a() in ["IfcWall","IfcWallStandardCase"]:
+            icon = ":icons/Arch_Wall_Tree.svg"
+        elif entity.is_a() in ["IfcBuildingElementProxy"]:
+            icon = ":icons/Arch_Component.svg"
+        elif entity.is_a() in ["IfcColumn","IfcColumnStandardCase","IfcBeam","IfcBeamStandardCase","IfcSlab","IfcFooting","IfcPile","IfcTendon"]:
+            icon = ":icons/Arch_Structure_Tree.svg"
+        elif entity.is_a() in ["IfcSite"]:
+            icon = ":icons/Arch_Site_Tree.svg"
+        elif entity.is_a() in ["IfcBuilding"]:
+            icon = ":icons/Arch_Building_Tree.svg"
+        elif entity.is_a() in ["IfcBuildingStorey"]:
+            icon = ":icons/Arch_Floor_Tree.svg"
+        elif entity.is_a() in ["IfcWindow","IfcWindowStandardCase","IfcDoor","IfcDoorStandardCase"]:
+            icon = ":icons/Arch_Window_Tree.svg"
+        elif entity.is_a() in ["IfcRoof"]:
+            icon = ":icons/Arch_Roof_Tree.svg"
+        elif entity.is_a() in ["IfcExtrudedAreaSolid","IfcClosedShell"]:
+            icon = ":icons/Tree_Part.svg"
+        elif entity.is_a() in ["IfcFace"]:
+            icon = ":icons/Draft_SwitchMode.svg"
+        elif entity.is_a() in ["IfcArbitraryClosedProfileDef","IfcPolyloop"]:
+            icon = ":icons/Draft_Draft.svg"
+        elif entity.is_a() in ["IfcPropertySingleValue","IfcQuantityArea","IfcQuantityVolume"]:
+            icon = ":icons/Tree_Annotation.svg"
+        elif entity.is_a() in ["IfcMaterial"]:
+            icon = ":icons/Arch_Material.svg"
+        elif entity.is_a() in ["IfcReinforcingBar"]:
+            icon = ":icons/Arch_Rebar.svg"
+        elif entity.is_a("IfcProduct"):
+            icon = ":icons/Arch_Component.svg"
+        if not icon:
+            return None
+        if not icon in self.icons:
+            self.icons[icon] = QtGui.QIcon(icon)
+        return self.icons[icon]
 
 
     def addAttributes(self,eid,parent):
 
         "adds the attributes of the given IFC entity under the given QTreeWidgetITem"
 
-        import ifcopenshell
         from PySide import QtCore,QtGui
         
         entity = self.ifc[eid]
@@ -441,7 +617,7 @@ class BIM_IfcExplorer:
                 else:
                     if argname not in ["Id", "GlobalId"]:
                         colored = False
-                        if isinstance(argvalue,ifcopenshell.entity_instance):
+                        if self.isEntity(argvalue):
                             if argvalue.id() == 0:
                                 t = self.tostr(argvalue)
                             else:
@@ -464,7 +640,7 @@ class BIM_IfcExplorer:
                             j = 0
                             for argitem in argvalue:
                                 colored = False
-                                if isinstance(argitem,ifcopenshell.entity_instance):
+                                if self.isEntity(argitem):
                                     if argitem.id() == 0:
                                         t = self.tostr(argitem)
                                     else:
@@ -493,20 +669,59 @@ class BIM_IfcExplorer:
         "adds properties of a given entity to the given QTReeWidgetItem"
 
         from PySide import QtCore,QtGui
-        entity = self.ifc[eid]
-        if hasattr(entity,"IsDefinedBy"):
-            for rel in entity.IsDefinedBy:
-                if hasattr(rel,"RelatingPropertyDefinition"):
-                    if rel.RelatingPropertyDefinition:
-                        item = QtGui.QTreeWidgetItem(parent)
-                        item.setText(0,"PropertySet: "+self.tostr(rel.RelatingPropertyDefinition.Name))
-                        item.setFont(0,self.bold)
-                        self.properties.setFirstItemColumnSpanned(item,True)
-                        if hasattr(rel.RelatingPropertyDefinition,"HasProperties"):
-                            for prop in rel.RelatingPropertyDefinition.HasProperties:
-                                subitem = QtGui.QTreeWidgetItem(item)
-                                subitem.setText(0,"Property")
-                                self.addAttributes(prop.id(),subitem)
+        for pid in self.relations.get("properties",eid):
+            pset = self.ifc[pid]
+            item = QtGui.QTreeWidgetItem(parent)
+            if pset.is_a("IfcElementQuantity"):
+                item.setText(0,"Quantities: "+self.tostr(pset.Name))
+                props = pset.Quantities
+            else:
+                item.setText(0,"PropertySet: "+self.tostr(pset.Name))
+                props = getattr(pset,"HasProperties",None) or []
+            item.setFont(0,self.bold)
+            self.properties.setFirstItemColumnSpanned(item,True)
+            for prop in props:
+                subitem = QtGui.QTreeWidgetItem(item)
+                subitem.setText(0,"Property")
+                self.addAttributes(prop.id(),subitem)
+        for label,relation in [("Material","materials"),("Contained in","structure")]:
+            for rid in self.relations.get(relation,eid):
+                item = QtGui.QTreeWidgetItem(parent)
+                item.setText(0,label)
+                item.setFont(0,self.bold)
+                self.addLink(item,self.ifc[rid])
+
+
+    def addLink(self,item,entity):
+
+        "shows the given entity as a link in the value column of the given QTreeWidgetItem"
+
+        name = getattr(entity,"Name",None)
+        item.setText(1,"#"+self.tostr(entity.id())+": "+self.tostr(entity.is_a())+(" "+self.tostr(name) if name else ""))
+        item.setForeground(1,self.linkbrush)
+        item.setFont(1,self.linkfont)
+
+
+    def showReferences(self):
+
+        "adds all the entities referencing the shown entity to the properties pane"
+
+        from PySide import QtCore,QtGui
+        if self.current is None:
+            return
+        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        try:
+            refs = self.relations.getReferences(self.current)
+        finally:
+            QtGui.QApplication.restoreOverrideCursor()
+        item = QtGui.QTreeWidgetItem(self.properties)
+        item.setText(0,translate("BIM","Referenced by")+" ("+str(len(refs))+")")
+        item.setFont(0,self.bold)
+        self.properties.setFirstItemColumnSpanned(item,True)
+        for rid in refs:
+            self.addLink(QtGui.QTreeWidgetItem(item),self.ifc[rid])
+        item.setExpanded(True)
+        self.properties.scrollToItem(item)
 
 
     def tostr(self,text):
@@ -526,46 +741,90 @@ class BIM_IfcExplorer:
                 return str(text)
 
 
-    def onSelectTree(self,item,previous):
+    def onSelectTree(self,current,previous):
         
         "displays attributes and properties of a tree item"
 
         from PySide import QtCore,QtGui
-        self.backnav.append(previous)
-        eid = item.data(0,QtCore.Qt.UserRole)
+        if not current.isValid():
+            return
+        self.backnav.append(QtCore.QPersistentModelIndex(previous))
+        eid = current.data(QtCore.Qt.UserRole)
+        self.showEntity(eid)
+        entity = self.ifc[eid]
+        if entity.is_a("IfcProduct") and FreeCAD.ActiveDocument:
+            self.shapeAction.setEnabled(True)
+        else:
+            self.shapeAction.setEnabled(False)
+        if self.omeshes and FreeCAD.ActiveDocument:
+            self.getMesh()
+            if not self.meshAction.isChecked():
+                self.meshAction.setChecked(True)
+                self.mesh.ViewObject.show()
+            self.highlight([eid]+self.getDescendants(entity,representations=False))
+
+
+    def showEntity(self,eid):
+
+        "displays the attributes and properties of the given entity"
+
+        self.current = eid
         self.attributes.clear()
         self.addAttributes(eid,self.attributes)
         self.attributes.expandAll()
         self.properties.clear()
         self.addProperties(eid,self.properties)
         self.properties.expandAll()
-        entity = self.ifc[eid]
-        if entity.is_a("IfcProduct") and FreeCAD.ActiveDocument:
-            self.shapeAction.setEnabled(True)
-        else:
-            self.shapeAction.setEnabled(False)
-        if eid in self.omeshes:
-            omesh = self.omeshes[eid]
-        else:
-            omesh = None
-        children = self.getChildren(entity,keys=True)
-        for k in children:
-            if k in self.omeshes:
-                kmesh = self.omeshes[k]
-                if omesh:
-                    omesh.addMesh(kmesh)
-                else:
-                    omesh = kmesh
-        if omesh:
-            if not self.currentmesh:
-                self.currentmesh = FreeCAD.ActiveDocument.addObject("Mesh::Feature","IFCObjectMesh")
-                self.currentmesh.ViewObject.ShapeColor = (0.4,0.4,1.0)
-            self.currentmesh.Mesh = omesh
-            self.currentmesh.ViewObject.show()
-            FreeCAD.ActiveDocument.recompute()
-        else:
-            if self.currentmesh:
-                self.currentmesh.ViewObject.hide()
+        self.referencesAction.setEnabled(True)
+
+
+    def onSearchChanged(self,text):
+
+        "searches once the user stops typing"
+
+        self.searchTimer.start(150)
+
+
+    def search(self):
+
+        "shows the entities matching the text of the search box"
+
+        from PySide import QtCore,QtGui
+        self.searchTimer.stop()
+        self.searchResults.clear()
+        text = self.searchEdit.text()
+        if not text or not self.search_index:
+            self.searchResults.hide()
+            return
+        t = time.time()
+        ids,total = self.search_index.search(text)
+        for eid in ids:
+            entity = self.ifc[eid]
+            item = QtGui.QListWidgetItem(self.getLabel(entity))
+            icon = self.getIcon(entity)
+            if icon:
+                item.setIcon(icon)
+            item.setData(QtCore.Qt.UserRole,eid)
+            self.searchResults.addItem(item)
+        if total > len(ids):
+            self.searchResults.addItem(translate("BIM","%d more results, refine the search") % (total-len(ids)))
+        elif not ids:
+            self.searchResults.addItem(translate("BIM","No results"))
+        if self.search_index.isAlive():
+            self.searchResults.addItem(translate("BIM","Still indexing (%d%%), more results may come") % self.search_index.getProgress())
+        self.searchResults.show()
+        FreeCAD.Console.PrintLog("IfcExplorer: "+str(total)+" results for '"+text+"' in "+"%.3f" % (time.time()-t)+"s\n")
+
+
+    def onSearchResult(self,item):
+
+        "selects the clicked search result in the tree"
+
+        from PySide import QtCore,QtGui
+        eid = item.data(QtCore.Qt.UserRole)
+        if eid:
+            if not self.selectEntity(eid):
+                self.showEntity(eid)
 
 
     def onDoubleClickTree(self,item,column):
@@ -578,7 +837,487 @@ class BIM_IfcExplorer:
             txt = item.text(column)
             if txt.startswith("#"):
                 eid = txt[1:].split(":")[0]
-                target = self.tree.findItems("#"+eid+" :",QtCore.Qt.MatchStartsWith|QtCore.Qt.MatchRecursive,0)
-                if target:
-                    self.tree.scrollToItem(target[0])
-                    self.tree.setCurrentItem(target[0])
+                try:
+                    if not self.selectEntity(int(eid)):
+                        # not in the tree, for ex. a relation or a property set
+                        self.showEntity(int(eid))
+                except (ValueError,RuntimeError):
+                    pass
+
+
+
+class IfcRelations:
+
+
+    """a lazy index of the relations shown in the explorer panes. Each kind of
+    relation is read once for the whole file, the first time it is needed,
+    so looking up an entity afterwards is a dict access"""
+
+    RELATIONS = {
+        # name: (relation type, related attribute, relating attribute)
+        "properties": ("IfcRelDefinesByProperties","RelatedObjects","RelatingPropertyDefinition"),
+        "materials": ("IfcRelAssociatesMaterial","RelatedObjects","RelatingMaterial"),
+        "structure": ("IfcRelContainedInSpatialStructure","RelatedElements","RelatingStructure"),
+    }
+
+    def __init__(self,ifc):
+
+        self.ifc = ifc
+        self.maps = {} # relation name: {related id: [relating ids]}
+        self.references = {} # id: [ids of the entities referencing it]
+
+    def get(self,relation,eid):
+
+        "returns the ids of the entities related to the given entity by the given relation"
+
+        if not relation in self.maps:
+            reltype,related,relating = self.RELATIONS[relation]
+            mapping = {}
+            for rel in self.ifc.by_type(reltype):
+                target = getattr(rel,relating,None)
+                if target is None:
+                    continue
+                for obj in getattr(rel,related,None) or []:
+                    mapping.setdefault(obj.id(),[]).append(target.id())
+            self.maps[relation] = mapping
+        return self.maps[relation].get(eid,[])
+
+    def getReferences(self,eid):
+
+        "returns the ids of all the entities referencing the given entity"
+
+        if not eid in self.references:
+            self.references[eid] = sorted(set([e.id() for e in self.ifc.get_inverse(self.ifc[eid])]))
+        return self.references[eid]
+
+
+
+class IfcSearchIndex:
+
+
+    """an inverted index of the words found in the names, identifiers and
+    property values of the objects of an IFC file. It is built on a worker
+    thread, and can be searched while it is being built"""
+
+    ATTRIBUTES = ["Name","GlobalId","Tag","Description","LongName","ObjectType","PredefinedType"]
+
+    def __init__(self,ifc):
+
+        import threading
+        self.ifc = ifc
+        self.words = {} # word: [entity ids]
+        self.keys = [] # sorted words, for prefix searches
+        self.sorted = False # False if self.keys is outdated
+        self.lastsort = 0
+        self.lock = threading.Lock()
+        self.total = 0
+        self.done = 0
+        self.cancelled = False
+        self.thread = None
+
+    def start(self):
+
+        import threading
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def cancel(self):
+
+        self.cancelled = True
+
+    def isAlive(self):
+
+        return bool(self.thread) and self.thread.is_alive()
+
+    def getProgress(self):
+
+        return int(100 * self.done / max(1,self.total))
+
+    def run(self):
+
+        import BimIfcIndex
+        t = time.time()
+        try:
+            if isinstance(self.ifc,BimIfcIndex.IfcIndex):
+                if not self.runLean():
+                    return
+                FreeCAD.Console.PrintLog("IfcExplorer: "+str(len(self.words))+" words indexed in "+"%.2f" % (time.time()-t)+"s\n")
+                return
+            objs = self.ifc.by_type("IfcObjectDefinition")
+            rels = self.ifc.by_type("IfcRelDefinesByProperties")
+            self.total = len(objs) + len(rels)
+            # attributes first, they give most results
+            for obj in objs:
+                if self.cancelled:
+                    return
+                texts = []
+                for attr in self.ATTRIBUTES:
+                    value = getattr(obj,attr,None)
+                    if value:
+                        texts.append(value)
+                self.add([obj.id()],texts)
+                self.done += 1
+            for rel in rels:
+                if self.cancelled:
+                    return
+                pset = rel.RelatingPropertyDefinition
+                texts = []
+                for prop in getattr(pset,"HasProperties",None) or []:
+                    value = getattr(prop,"NominalValue",None)
+                    value = getattr(value,"wrappedValue",value) # ifcopenshell wraps typed values
+                    if value is not None:
+                        texts.append(value)
+                if texts:
+                    self.add([o.id() for o in rel.RelatedObjects or []],texts)
+                self.done += 1
+        except Exception as e:
+            FreeCAD.Console.PrintWarning("IfcExplorer: search indexing failed: "+str(e)+"\n")
+            return
+        FreeCAD.Console.PrintLog("IfcExplorer: "+str(len(self.words))+" words indexed in "+"%.2f" % (time.time()-t)+"s\n")
+
+    def runLean(self):
+
+        """indexes a BimIfcIndex from its id, type and offset arrays. Rows are
+        parsed one by one, without creating entities nor filling the values
+        cache of the index, and only the strings of the indexed attributes are
+        kept. Returns False if cancelled"""
+
+        import BimIfcIndex
+        ifc = self.ifc
+        parser = BimIfcIndex.Parser(ifc.data)
+        positions = {} # (type code, attribute name): position in the values, or None
+
+        def getValue(row,values,name):
+            code = int(ifc.types[row])
+            if not (code,name) in positions:
+                positions[(code,name)] = ifc.getAttributeIndex(ifc.typenames[code],name)
+            i = positions[(code,name)]
+            if (i is None) or (i >= len(values)):
+                return None
+            return values[i]
+
+        def isText(value):
+            return (value is not None) and (value != "") and not isinstance(value,(BimIfcIndex.Reference,list))
+
+        def parse(ref):
+            row = ifc.getRow(ref.eid) if isinstance(ref,BimIfcIndex.Reference) else None
+            if row is None:
+                return None,[]
+            return row,parser.parse(int(ifc.offsets[row]))
+
+        objs = ifc.getRows("IfcObjectDefinition")
+        rels = ifc.getRows("IfcRelDefinesByProperties")
+        self.total = len(objs) + len(rels)
+        for row in objs:
+            if self.cancelled:
+                return False
+            values = parser.parse(int(ifc.offsets[row]))
+            texts = [v for v in [getValue(row,values,attr) for attr in self.ATTRIBUTES] if isText(v)]
+            self.add([int(ifc.ids[row])],texts)
+            self.done += 1
+        for row in rels:
+            if self.cancelled:
+                return False
+            values = parser.parse(int(ifc.offsets[row]))
+            related = getValue(row,values,"RelatedObjects")
+            psetrow,psetvalues = parse(getValue(row,values,"RelatingPropertyDefinition"))
+            texts = []
+            if psetrow is not None:
+                props = getValue(psetrow,psetvalues,"HasProperties")
+                for prop in props if isinstance(props,list) else []:
+                    proprow,propvalues = parse(prop)
+                    if proprow is not None:
+                        value = getValue(proprow,propvalues,"NominalValue")
+                        if isText(value):
+                            texts.append(value)
+            if texts and isinstance(related,list):
+                self.add([r.eid for r in related if isinstance(r,BimIfcIndex.Reference)],texts)
+            self.done += 1
+        return True
+
+    def tokenize(self,text):
+
+        "returns the lower-case words of the given text"
+
+        import six
+        if not isinstance(text,six.string_types):
+            text = str(text)
+        return re.findall(r"[\w$]+",text.lower())
+
+    def add(self,ids,texts):
+
+        words = set()
+        for text in texts:
+            words.update(self.tokenize(text))
+        with self.lock:
+            for word in words:
+                if word in self.words:
+                    self.words[word].extend(ids)
+                else:
+                    self.words[word] = list(ids)
+                    self.sorted = False
+
+    def search(self,text,limit=200):
+
+        """returns (ids,total), the ids of the first entities having words starting
+        with all the words of the given text, and the total number of matches"""
+
+        import bisect
+        result = None
+        with self.lock:
+            # while indexing, words are re-sorted once per second at most
+            if not self.sorted and ((not self.isAlive()) or (time.time() - self.lastsort > 1)):
+                self.keys = sorted(self.words)
+                self.sorted = True
+                self.lastsort = time.time()
+            for word in self.tokenize(text):
+                ids = set()
+                if len(word) < 2:
+                    ids.update(self.words.get(word,[]))
+                else:
+                    i = bisect.bisect_left(self.keys,word)
+                    while (i < len(self.keys)) and self.keys[i].startswith(word):
+                        ids.update(self.words[self.keys[i]])
+                        i += 1
+                result = ids if result is None else result & ids
+                if not result:
+                    break
+        if not result:
+            return [],0
+        return sorted(result)[:limit],len(result)
+
+
+
+class IfcLoader:
+
+
+    """reads and parses an IFC file on a worker thread. The file is first read
+    once in chunks, which gives the progress, the entities count and the
+    content hash, and brings it in the system cache, then parsed by
+    ifcopenshell. Files bigger than the IfcExplorerLeanSize preference, in
+    MB, are not parsed but indexed by BimIfcIndex, which uses a fraction of
+    the memory"""
+
+    def __init__(self,filename):
+
+        self.filename = filename
+        self.size = os.path.getsize(filename)
+        self.read = 0 # bytes read so far
+        self.entities = 0 # entities found so far
+        self.parsing = False # True once the file is being parsed by ifcopenshell
+        self.indexing = False # True once the file is being indexed by BimIfcIndex
+        leansize = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetInt("IfcExplorerLeanSize",300)
+        self.lean = bool(leansize) and (self.size > leansize * 1048576)
+        self.cancelled = False
+        self.ifc = None # the parsed file, once done
+        self.error = None
+        self.started = time.time()
+        self.thread = None
+
+    def start(self):
+
+        import threading
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True # a cancelled parse must not keep FreeCAD from quitting
+        self.thread.start()
+
+    def run(self):
+
+        import hashlib
+        import ifcopenshell
+        import BimIfcMesh
+        try:
+            stat = os.stat(self.filename)
+            h = hashlib.sha1() # the content hash identifies the file in the mesh cache
+            with open(self.filename,"rb") as f:
+                tail = b""
+                while not self.cancelled:
+                    chunk = f.read(4194304)
+                    if not chunk:
+                        break
+                    self.read += len(chunk)
+                    h.update(chunk)
+                    # entity instances start a line with #, the tail handles lines cut between chunks
+                    self.entities += (tail+chunk[:1]).count(b"\n#") + chunk.count(b"\n#")
+                    tail = chunk[-1:]
+            if self.cancelled:
+                return
+            BimIfcMesh.FILEHASHES[(os.path.abspath(self.filename),stat.st_size,stat.st_mtime)] = h.hexdigest()
+            if self.lean:
+                import BimIfcIndex
+                self.read = 0
+                self.entities = 0
+                self.indexing = True
+                index = BimIfcIndex.IfcIndex(self.filename)
+                if index.build(self.onIndexProgress):
+                    self.ifc = index
+                return
+            self.parsing = True
+            ifc = ifcopenshell.open(self.filename)
+            if not self.cancelled:
+                self.ifc = ifc
+        except Exception as e:
+            self.error = e
+
+    def onIndexProgress(self,read,entities):
+
+        self.read = read
+        self.entities = entities
+        return not self.cancelled
+
+    def cancel(self):
+
+        self.cancelled = True
+
+    def isAlive(self):
+
+        return bool(self.thread) and self.thread.is_alive()
+
+
+if FreeCAD.GuiUp:
+
+    from PySide import QtCore,QtGui
+
+    class IfcTreeNode:
+
+        "a node of the explorer tree. Its children are only looked for when it gets expanded"
+
+        def __init__(self,eid,parent=None,row=0):
+
+            self.eid = eid
+            self.parent = parent
+            self.row = row
+            self.children = None # list of IfcTreeNodes, None until fetched
+            self.childids = None # list of entity ids, None until looked for
+            self.haschildren = None # True if it has children, None until looked for
+
+
+    class IfcTreeModel(QtCore.QAbstractItemModel):
+
+        """a model showing the spatial structure of an IFC file, where the
+        decomposition and containment of an entity are only resolved when
+        its node is expanded, so the cost of showing the tree doesn't depend
+        on the size of the file"""
+
+        def __init__(self,explorer,roots):
+
+            QtCore.QAbstractItemModel.__init__(self)
+            self.explorer = explorer
+            self.root = IfcTreeNode(None)
+            self.root.childids = roots
+            self.root.children = [IfcTreeNode(eid,self.root,i) for i,eid in enumerate(roots)]
+
+        def getNode(self,index):
+
+            if index.isValid():
+                return index.internalPointer()
+            return self.root
+
+        def getChildIds(self,node):
+
+            if node.childids is None:
+                node.childids = [c.id() for c in self.explorer.getChildren(self.explorer.ifc[node.eid])]
+            return node.childids
+
+        def index(self,row,column,parent=QtCore.QModelIndex()):
+
+            node = self.getNode(parent)
+            if node.children and (0 <= row < len(node.children)) and (column == 0):
+                return self.createIndex(row,column,node.children[row])
+            return QtCore.QModelIndex()
+
+        def parent(self,index):
+
+            if not index.isValid():
+                return QtCore.QModelIndex()
+            node = index.internalPointer().parent
+            if (node is None) or (node is self.root):
+                return QtCore.QModelIndex()
+            return self.createIndex(node.row,0,node)
+
+        def rowCount(self,parent=QtCore.QModelIndex()):
+
+            node = self.getNode(parent)
+            if node.children is None:
+                return 0
+            return len(node.children)
+
+        def columnCount(self,parent=QtCore.QModelIndex()):
+
+            return 1
+
+        def hasChildren(self,parent=QtCore.QModelIndex()):
+
+            # called for every visible row, so children are only listed on expand
+            node = self.getNode(parent)
+            if node.childids is not None:
+                return bool(node.childids)
+            if node.haschildren is None:
+                node.haschildren = self.explorer.hasChildren(self.explorer.ifc[node.eid])
+            return node.haschildren
+
+        def canFetchMore(self,parent):
+
+            node = self.getNode(parent)
+            return (node.children is None) and self.hasChildren(parent)
+
+        def fetchMore(self,parent):
+
+            node = self.getNode(parent)
+            ids = self.getChildIds(node)
+            if not ids:
+                node.children = []
+                return
+            self.beginInsertRows(parent,0,len(ids)-1)
+            node.children = [IfcTreeNode(eid,node,i) for i,eid in enumerate(ids)]
+            self.endInsertRows()
+
+        def headerData(self,section,orientation,role=QtCore.Qt.DisplayRole):
+
+            if (orientation == QtCore.Qt.Horizontal) and (role == QtCore.Qt.DisplayRole):
+                return translate("BIM","Objects structure")
+            return None
+
+        def data(self,index,role=QtCore.Qt.DisplayRole):
+
+            if not index.isValid():
+                return None
+            node = index.internalPointer()
+            if role == QtCore.Qt.UserRole:
+                return node.eid
+            if role == QtCore.Qt.DisplayRole:
+                return self.explorer.getLabel(self.explorer.ifc[node.eid])
+            elif role == QtCore.Qt.DecorationRole:
+                return self.explorer.getIcon(self.explorer.ifc[node.eid])
+            elif role == QtCore.Qt.FontRole:
+                if self.explorer.ifc[node.eid].is_a("IfcProduct"):
+                    return self.explorer.bold
+            return None
+
+        def findPath(self,path):
+
+            """returns the index of the last entity of a path of entity ids, fetching
+            nodes as needed. The path starts at its first entity shown as a top row"""
+
+            roots = set(self.root.childids)
+            for i,eid in enumerate(path):
+                if eid in roots:
+                    path = path[i:]
+                    break
+            else:
+                return QtCore.QModelIndex()
+            index = QtCore.QModelIndex()
+            for eid in path:
+                node = self.getNode(index)
+                if node.children is None:
+                    if not self.canFetchMore(index):
+                        return QtCore.QModelIndex()
+                    self.fetchMore(index)
+                for child in node.children:
+                    if child.eid == eid:
+                        index = self.createIndex(child.row,0,child)
+                        break
+                else:
+                    return QtCore.QModelIndex()
+            return index
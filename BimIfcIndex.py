@@ -0,0 +1,448 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""A memory-lean, read-only access to big IFC files. The file is memory-
+mapped and scanned once to build a compact index of entity id, type and
+byte offset. Attributes are only parsed when an entity is looked at, and
+inverse attributes are resolved by parsing the relations that can point
+to them, once per kind of relation. The IfcIndex and IndexedEntity classes
+offer the subset of the ifcopenshell file and entity_instance API that the
+IFC explorer uses"""
+
+import os
+import re
+import FreeCAD
+
+
+# string literals are matched too, and skipped, so no entity is found inside
+# them. Escaped quotes ('') just give two consecutive strings
+ENTITY = re.compile(br"'[^']*'|#(\d+)\s*=\s*([A-Za-z0-9_]+)\s*\(")
+SCHEMA = re.compile(br"FILE_SCHEMA\s*\(\s*\(\s*'([A-Za-z0-9_]+)'")
+
+
+class IfcIndex:
+
+
+    "an index of the entities of an IFC file, mimicking a read-only ifcopenshell file"
+
+    def __init__(self,filename):
+
+        self.filename = filename
+        self.file = None
+        self.data = None # the memory-mapped file
+        self.ids = None # sorted numpy array of entity ids
+        self.offsets = None # numpy array of the offset of the opening parenthesis of each entity
+        self.types = None # numpy array of indices in self.typenames, for each entity
+        self.typenames = [] # upper-case type names as found in the file
+        self.schemaname = "IFC2X3"
+        self.schema = None
+        self.declarations = {} # upper-case type name: schema declaration
+        self.ancestors = {} # upper-case type name: set of lower-case names of the type and its supertypes
+        self.inverses = {} # (referencing type, attribute name): {referenced id: [referencing ids]}
+        self.values = {} # entity id: parsed attribute values, for recently looked at entities
+        self.start = 0 # offset of the DATA section
+        self.positions = None # (sorted offsets,rows), to find the entity at a given offset
+
+    def build(self,callback=None):
+
+        """scans the file and builds the index. callback(bytes scanned, entities
+        found) is called regularly, and the scan stops if it returns False.
+        Returns True if the scan completed"""
+
+        import mmap
+        import array
+        import numpy
+        self.file = open(self.filename,"rb")
+        self.data = mmap.mmap(self.file.fileno(),0,access=mmap.ACCESS_READ)
+        m = SCHEMA.search(self.data,0,min(len(self.data),65536))
+        if m:
+            self.schemaname = m.group(1).decode("ascii").upper()
+        self.loadSchema()
+        start = self.start = max(0,self.data.find(b"DATA;"))
+        ids = array.array("I")
+        offsets = array.array("Q")
+        types = array.array("H")
+        codes = {}
+        for m in ENTITY.finditer(self.data,start):
+            if m.group(1) is None:
+                continue
+            ids.append(int(m.group(1)))
+            offsets.append(m.end()-1)
+            typename = m.group(2).upper()
+            code = codes.get(typename)
+            if code is None:
+                code = codes[typename] = len(self.typenames)
+                self.typenames.append(typename.decode("ascii"))
+            types.append(code)
+            if callback and not (len(ids) % 65536):
+                if not callback(m.end(),len(ids)):
+                    self.close()
+                    return False
+        self.ids = numpy.frombuffer(ids,dtype=numpy.uint32)
+        self.offsets = numpy.frombuffer(offsets,dtype=numpy.uint64)
+        self.types = numpy.frombuffer(types,dtype=numpy.uint16)
+        if len(self.ids) and numpy.any(self.ids[1:] < self.ids[:-1]):
+            order = numpy.argsort(self.ids,kind="stable")
+            self.ids = self.ids[order]
+            self.offsets = self.offsets[order]
+            self.types = self.types[order]
+        if callback:
+            callback(len(self.data),len(self.ids))
+        return True
+
+    def close(self):
+
+        if self.data:
+            self.data.close()
+            self.data = None
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def loadSchema(self):
+
+        "gets the entity declarations from the ifcopenshell schema"
+
+        try:
+            import ifcopenshell
+            self.schema = ifcopenshell.ifcopenshell_wrapper.schema_by_name(self.schemaname)
+        except Exception:
+            FreeCAD.Console.PrintWarning("BimIfcIndex: schema "+self.schemaname+" unavailable, attribute names are unknown\n")
+            return
+        for decl in self.schema.declarations():
+            self.declarations[decl.name().upper()] = decl
+
+    def getDeclaration(self,typename):
+
+        return self.declarations.get(typename.upper())
+
+    def getAncestors(self,typename):
+
+        "returns the set of lower-case names of the given type and all its supertypes"
+
+        if not typename in self.ancestors:
+            names = set([typename.lower()])
+            decl = self.getDeclaration(typename)
+            while decl is not None:
+                names.add(decl.name().lower())
+                decl = decl.supertype() if hasattr(decl,"supertype") else None
+            self.ancestors[typename] = names
+        return self.ancestors[typename]
+
+    def getTypeName(self,typename):
+
+        "returns the type name as written in the schema, for ex. IfcWall instead of IFCWALL"
+
+        decl = self.getDeclaration(typename)
+        if decl is not None:
+            return decl.name()
+        return typename
+
+    def getRow(self,eid):
+
+        import numpy
+        row = int(numpy.searchsorted(self.ids,eid))
+        if (row < len(self.ids)) and (self.ids[row] == eid):
+            return row
+        return None
+
+    def __getitem__(self,eid):
+
+        row = self.getRow(eid)
+        if row is None:
+            raise RuntimeError("Instance #"+str(eid)+" not found")
+        return IndexedEntity(self,eid,self.typenames[self.types[row]])
+
+    def __len__(self):
+
+        return len(self.ids)
+
+    def getRows(self,typename):
+
+        "returns the rows of the entities of the given type or of its subtypes, as a numpy array"
+
+        import numpy
+        codes = [i for i,t in enumerate(self.typenames) if typename.lower() in self.getAncestors(t)]
+        if not codes:
+            return numpy.zeros(0,dtype=numpy.intp)
+        return numpy.nonzero(numpy.isin(self.types,codes))[0]
+
+    def getAttributeIndex(self,typename,name):
+
+        "returns the position of the given attribute in the values of the given type, or None"
+
+        decl = self.getDeclaration(typename)
+        if decl is not None:
+            for i,a in enumerate(decl.all_attributes()):
+                if a.name() == name:
+                    return i
+        return None
+
+    def by_type(self,typename):
+
+        "returns all the entities of the given type or of its subtypes"
+
+        return [IndexedEntity(self,int(self.ids[r]),self.typenames[self.types[r]]) for r in self.getRows(typename)]
+
+    def getValues(self,eid):
+
+        "returns the parsed attribute values of the given entity"
+
+        values = self.values.get(eid)
+        if values is None:
+            row = self.getRow(eid)
+            if row is None:
+                raise RuntimeError("Instance #"+str(eid)+" not found")
+            values = Parser(self.data).parse(int(self.offsets[row]))
+            if len(self.values) > 65536:
+                self.values = {}
+            self.values[eid] = values
+        return values
+
+    def getInverse(self,typename,attribute,eid):
+
+        """returns the ids of the entities of the given type whose given attribute
+        references the given id. The whole relation is indexed the first time"""
+
+        key = (typename.lower(),attribute)
+        if not key in self.inverses:
+            inverse = {}
+            for entity in self.by_type(typename):
+                names = entity.getAttributeNames()
+                if not attribute in names:
+                    continue
+                value = self.getValues(entity.eid)[names.index(attribute)]
+                refs = value if isinstance(value,(list,tuple)) else [value]
+                for ref in refs:
+                    if isinstance(ref,Reference):
+                        inverse.setdefault(ref.eid,[]).append(entity.eid)
+            self.inverses[key] = inverse
+        return self.inverses[key].get(eid,[])
+
+
+    def get_inverse(self,entity):
+
+        """returns the entities referencing the given entity. The whole file is
+        searched for the reference, but no entity is parsed"""
+
+        import numpy
+        if self.positions is None:
+            rows = numpy.argsort(self.offsets,kind="stable")
+            self.positions = (self.offsets[rows],rows)
+        offsets,rows = self.positions
+        pattern = re.compile(br"#"+str(entity.id()).encode("ascii")+br"(?![0-9])(?!\s*=)")
+        found = set()
+        for m in pattern.finditer(self.data,self.start):
+            i = int(numpy.searchsorted(offsets,m.start(),side="right")) - 1
+            if i >= 0:
+                found.add(int(rows[i]))
+        return [IndexedEntity(self,int(self.ids[r]),self.typenames[self.types[r]]) for r in sorted(found)]
+
+
+class IndexedEntity:
+
+
+    "an entity of an IfcIndex, mimicking a read-only ifcopenshell entity_instance"
+
+    def __init__(self,index,eid,typename):
+
+        self.index = index
+        self.eid = eid
+        self.typename = typename # upper-case, as found in the file
+
+    def __eq__(self,other):
+
+        return isinstance(other,IndexedEntity) and (other.eid == self.eid) and (other.index is self.index)
+
+    def __hash__(self):
+
+        return hash(self.eid)
+
+    def __repr__(self):
+
+        return "#"+str(self.eid)+"="+self.is_a()+"(...)"
+
+    def id(self):
+
+        return self.eid
+
+    def is_a(self,typename=None):
+
+        if typename is None:
+            return self.index.getTypeName(self.typename)
+        return typename.lower() in self.index.getAncestors(self.typename)
+
+    def getAttributeNames(self):
+
+        decl = self.index.getDeclaration(self.typename)
+        if decl is None:
+            return ["Attribute"+str(i) for i in range(len(self.index.getValues(self.eid)))]
+        return [a.name() for a in decl.all_attributes()]
+
+    def attribute_name(self,i):
+
+        names = self.getAttributeNames()
+        if i >= len(names):
+            raise RuntimeError("Attribute index out of range")
+        return names[i]
+
+    def get_info(self):
+
+        info = {"id":self.eid,"type":self.is_a()}
+        for name,value in zip(self.getAttributeNames(),self.index.getValues(self.eid)):
+            info[name] = self.resolve(value)
+        return info
+
+    def resolve(self,value):
+
+        "turns the references in a parsed value into IndexedEntities"
+
+        if isinstance(value,Reference):
+            return self.index[value.eid]
+        elif isinstance(value,list):
+            return tuple([self.resolve(v) for v in value])
+        return value
+
+    def __getattr__(self,name):
+
+        if name.startswith("__"):
+            raise AttributeError(name)
+        names = self.getAttributeNames()
+        if name in names:
+            values = self.index.getValues(self.eid)
+            i = names.index(name)
+            return self.resolve(values[i]) if i < len(values) else None
+        decl = self.index.getDeclaration(self.typename)
+        if decl is not None:
+            for inverse in decl.all_inverse_attributes():
+                if inverse.name() == name:
+                    ids = self.index.getInverse(inverse.entity_reference().name(),inverse.attribute_reference().name(),self.eid)
+                    return tuple([self.index[i] for i in ids])
+        raise AttributeError(name)
+
+
+class Reference:
+
+
+    "a reference to another entity, in parsed attribute values"
+
+    def __init__(self,eid):
+
+        self.eid = eid
+
+
+class Parser:
+
+
+    """parses the attribute values of one STEP entity instance. Lists become
+    python lists, references become References, enumerations strings, and
+    typed values like IFCLABEL('a') their value"""
+
+    def __init__(self,data):
+
+        self.data = data
+
+    def parse(self,pos):
+
+        "parses the argument list starting at the given offset, which must hold an opening parenthesis"
+
+        values,pos = self.parseList(pos)
+        return values
+
+    def parseList(self,pos):
+
+        data = self.data
+        values = []
+        pos += 1
+        while True:
+            c = data[pos:pos+1]
+            if c in (b" ",b"\r",b"\n",b"\t",b","):
+                pos += 1
+            elif c == b")":
+                return values,pos+1
+            elif c == b"(":
+                value,pos = self.parseList(pos)
+                values.append(value)
+            elif c == b"'":
+                value,pos = self.parseString(pos)
+                values.append(value)
+            elif c == b"#":
+                end = pos+1
+                while data[end:end+1].isdigit():
+                    end += 1
+                values.append(Reference(int(data[pos+1:end])))
+                pos = end
+            elif c in (b"$",b"*"):
+                values.append(None)
+                pos += 1
+            elif c == b".":
+                end = data.find(b".",pos+1)
+                value = data[pos+1:end].decode("ascii")
+                values.append({"T":True,"F":False}.get(value,value))
+                pos = end+1
+            elif c.isalpha():
+                # typed value, like IFCLABEL('a')
+                end = data.find(b"(",pos)
+                value,pos = self.parseList(end)
+                values.append(value[0] if len(value) == 1 else value)
+            elif c == b"":
+                raise ValueError("Unexpected end of file")
+            else:
+                end = pos
+                while not data[end:end+1] in (b",",b")",b" ",b""):
+                    end += 1
+                text = data[pos:end].decode("ascii")
+                try:
+                    values.append(int(text))
+                except ValueError:
+                    values.append(float(text))
+                pos = end
+
+    def parseString(self,pos):
+
+        data = self.data
+        end = pos+1
+        while True:
+            end = data.find(b"'",end)
+            if end < 0:
+                raise ValueError("Unexpected end of file")
+            if data[end+1:end+2] == b"'":
+                end += 2 # escaped quote
+            else:
+                break
+        return decodeString(data[pos+1:end].replace(b"''",b"'")),end+1
+
+
+def decodeString(raw):
+
+    r"returns a STEP string as unicode, decoding the \X\, \X2\ and \X4\ escapes"
+
+    text = raw.decode("latin-1")
+    if not "\\" in text:
+        return text
+    def x2(m):
+        h = m.group(2)
+        size = 4 if m.group(1) == "2" else 8
+        return "".join([chr(int(h[i:i+size],16)) for i in range(0,len(h),size)])
+    text = re.sub(r"\\X([24])\\([0-9A-Fa-f]+)\\X0\\",x2,text)
+    text = re.sub(r"\\X\\([0-9A-Fa-f]{2})",lambda m: chr(int(m.group(1),16)),text)
+    return text.replace("\\\\","\\")
@@ -0,0 +1,376 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""Tessellation of IFC products into numpy vertex and face buffers, and
+conversion of these buffers into FreeCAD meshes without going through
+python lists of vectors"""
+
+import os
+import FreeCAD
+
+
+def getSettings():
+
+    "returns the ifcopenshell geometry settings used to tessellate products"
+
+    from ifcopenshell import geom
+    settings = geom.settings()
+    settings.set(settings.USE_WORLD_COORDS,True)
+    return settings
+
+
+def getScale(ifc):
+
+    "returns the factor to apply to ifcopenshell meshes, which are in metres, to get millimetres"
+
+    try:
+        import importIFCHelper
+        s = importIFCHelper.getScaling(ifc)
+    except:
+        import importIFC
+        s = importIFC.getScaling(ifc)
+    return s * 1000
+
+
+def tessellate(ifc,products=None,threads=None):
+
+    """returns a {product id: (verts,faces)} dict of the given products, or of
+    all products of the file, where verts is a (n,3) float64 array in
+    millimetres and faces a (m,3) int32 array. The geometry iterator of
+    ifcopenshell spreads the work over the given number of threads, all
+    processor cores by default"""
+
+    import multiprocessing
+    from ifcopenshell import geom
+    if not threads:
+        threads = multiprocessing.cpu_count()
+    scale = getScale(ifc)
+    settings = getSettings()
+    geometry = {}
+    try:
+        if products is None:
+            iterator = geom.iterator(settings,ifc,threads)
+        else:
+            iterator = geom.iterator(settings,ifc,threads,include=products)
+    except (AttributeError,TypeError):
+        # old ifcopenshell without iterator, or without include filter
+        iterator = None
+    if iterator and iterator.initialize():
+        while True:
+            shape = iterator.get()
+            geometry[shape.id] = toArrays(shape.geometry,scale)
+            if not iterator.next():
+                break
+    elif iterator is None:
+        # serial fallback
+        if products is None:
+            products = ifc.by_type("IfcProduct")
+        for product in products:
+            if product.is_a("IfcOpeningElement") or not getattr(product,"Representation",None):
+                continue
+            try:
+                shape = geom.create_shape(settings,product)
+            except:
+                continue
+            geometry[product.id()] = toArrays(shape.geometry,scale)
+    return geometry
+
+
+def toArrays(geometry,scale=1):
+
+    "returns (verts,faces) numpy arrays from an ifcopenshell triangulation"
+
+    import numpy
+    verts = numpy.array(geometry.verts,dtype=numpy.float64).reshape(-1,3)
+    if scale != 1:
+        verts *= scale
+    faces = numpy.array(geometry.faces,dtype=numpy.int32).reshape(-1,3)
+    return verts,faces
+
+
+def merge(geometry,ids=None):
+
+    """merges the (verts,faces) arrays of the given ids of a geometry dict, all
+    if None, and returns (verts,faces,ranges) where ranges is a {id: (first
+    face,face count)} dict locating each product in the merged faces"""
+
+    import numpy
+    if ids is None:
+        ids = list(geometry.keys())
+    ids = [i for i in ids if i in geometry]
+    verts = []
+    faces = []
+    ranges = {}
+    vcount = 0
+    fcount = 0
+    for i in ids:
+        v,f = geometry[i]
+        verts.append(v)
+        faces.append(f + vcount)
+        ranges[i] = (fcount,len(f))
+        vcount += len(v)
+        fcount += len(f)
+    if not ids:
+        return numpy.zeros((0,3),dtype=numpy.float64),numpy.zeros((0,3),dtype=numpy.int32),ranges
+    return numpy.concatenate(verts),numpy.concatenate(faces),ranges
+
+
+def toSTL(verts,faces):
+
+    "returns the given verts and faces arrays as binary STL data"
+
+    import struct
+    import numpy
+    triangles = verts[faces]
+    normals = numpy.cross(triangles[:,1] - triangles[:,0],triangles[:,2] - triangles[:,0])
+    lengths = numpy.linalg.norm(normals,axis=1)
+    lengths[lengths == 0] = 1
+    normals /= lengths[:,None]
+    data = numpy.zeros(len(faces),dtype=numpy.dtype([("normal","<f4",(3,)),("points","<f4",(3,3)),("attr","<u2")]))
+    data["normal"] = normals
+    data["points"] = triangles
+    return b"\0" * 80 + struct.pack("<I",len(faces)) + data.tobytes()
+
+
+def toMesh(verts,faces):
+
+    """returns a Mesh.Mesh built from the given verts and faces arrays. The
+    arrays are handed over as binary STL, which keeps the face order"""
+
+    import io
+    import Mesh
+    mesh = Mesh.Mesh()
+    if not len(faces):
+        return mesh
+    data = toSTL(verts,faces)
+    try:
+        mesh.read(Stream=io.BytesIO(data),Format="STL")
+    except TypeError:
+        # older FreeCAD versions can only read meshes from files
+        import tempfile
+        fd,path = tempfile.mkstemp(suffix=".stl")
+        try:
+            with os.fdopen(fd,"wb") as f:
+                f.write(data)
+            mesh.read(path)
+        finally:
+            os.remove(path)
+    return mesh
+
+
+# disk cache
+
+# Tessellated products are cached on disk, one folder per IFC file content
+# and geometry settings, containing all vertices and all faces in two .npy
+# arrays, that are memory-mapped when read, and an index giving the range of
+# each product, by GlobalId, in these arrays. The least recently used
+# folders are deleted when the cache grows over its size limit.
+
+CACHE_VERSION = 1 # change this when the tessellation or the cache format change
+TEMPPREFIX = ".tmp-" # prefix of the folders being written, never pruned while young
+FILEHASHES = {} # (path,size,mtime): content hash, so big files are hashed only once per session
+
+
+def getCacheFolder():
+
+    "returns the folder where tessellations are cached"
+
+    folder = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetString("IfcMeshCacheFolder","")
+    if not folder:
+        folder = os.path.join(FreeCAD.getUserAppDataDir(),"BIM","MeshCache")
+    return folder
+
+
+def getCacheLimit():
+
+    "returns the maximum size of the cache, in bytes"
+
+    return FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetInt("IfcMeshCacheSize",512) * 1048576
+
+
+def getFileHash(filename):
+
+    "returns a hash of the contents of the given file"
+
+    import hashlib
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename),stat.st_size,stat.st_mtime)
+    if not key in FILEHASHES:
+        h = hashlib.sha1()
+        with open(filename,"rb") as f:
+            while True:
+                chunk = f.read(4194304)
+                if not chunk:
+                    break
+                h.update(chunk)
+        FILEHASHES[key] = h.hexdigest()
+    return FILEHASHES[key]
+
+
+def getCachePath(filename):
+
+    "returns the cache folder of the given IFC file"
+
+    return os.path.join(getCacheFolder(),getFileHash(filename)+"-v"+str(CACHE_VERSION)+"-world")
+
+
+def loadCache(filename):
+
+    """returns a {product id: (verts,faces)} dict of the given IFC file from the
+    cache, or None if it is not cached. The arrays are memory-mapped views"""
+
+    import json
+    import numpy
+    path = getCachePath(filename)
+    if not os.path.exists(os.path.join(path,"index.json")):
+        return None
+    try:
+        with open(os.path.join(path,"index.json")) as f:
+            index = json.load(f)
+        verts = numpy.load(os.path.join(path,"verts.npy"),mmap_mode="r")
+        faces = numpy.load(os.path.join(path,"faces.npy"),mmap_mode="r")
+    except (OSError,IOError,ValueError) as e:
+        FreeCAD.Console.PrintWarning("BIM: unable to read mesh cache "+path+": "+str(e)+"\n")
+        return None
+    os.utime(path,None) # mark as recently used
+    geometry = {}
+    for guid,(eid,vstart,vcount,fstart,fcount) in index.items():
+        geometry[eid] = (verts[vstart:vstart+vcount],faces[fstart:fstart+fcount])
+    return geometry
+
+
+def storeCache(filename,ifc,geometry):
+
+    "stores the given {product id: (verts,faces)} dict of the given IFC file in the cache"
+
+    import json
+    import shutil
+    import tempfile
+    import numpy
+    path = getCachePath(filename)
+    if os.path.exists(path):
+        return
+    folder = getCacheFolder()
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    index = {}
+    verts = []
+    faces = []
+    vcount = 0
+    fcount = 0
+    for eid,(v,f) in geometry.items():
+        index[ifc[eid].GlobalId] = (eid,vcount,len(v),fcount,len(f))
+        verts.append(v)
+        faces.append(f)
+        vcount += len(v)
+        fcount += len(f)
+    # write in a temporary folder first, so a half-written cache is never read
+    tmp = tempfile.mkdtemp(prefix=TEMPPREFIX,dir=folder)
+    try:
+        numpy.save(os.path.join(tmp,"verts.npy"),numpy.concatenate(verts) if verts else numpy.zeros((0,3)))
+        numpy.save(os.path.join(tmp,"faces.npy"),numpy.concatenate(faces) if faces else numpy.zeros((0,3),dtype=numpy.int32))
+        with open(os.path.join(tmp,"index.json"),"w") as f:
+            json.dump(index,f)
+        os.rename(tmp,path)
+    except OSError as e:
+        FreeCAD.Console.PrintWarning("BIM: unable to write mesh cache "+path+": "+str(e)+"\n")
+        shutil.rmtree(tmp,ignore_errors=True)
+        return
+    pruneCache()
+
+
+def pruneCache(limit=None):
+
+    "deletes the least recently used cache folders until the cache is smaller than the given size in bytes"
+
+    import shutil
+    import time
+    folder = getCacheFolder()
+    if limit is None:
+        limit = getCacheLimit()
+    if not os.path.exists(folder):
+        return
+    entries = []
+    total = 0
+    for name in os.listdir(folder):
+        path = os.path.join(folder,name)
+        if name.startswith(TEMPPREFIX):
+            # being written by storeCache, or left over by a crash a day ago or more
+            if time.time() - os.path.getmtime(path) > 86400:
+                shutil.rmtree(path,ignore_errors=True)
+            continue
+        if os.path.isdir(path):
+            size = sum([os.path.getsize(os.path.join(path,f)) for f in os.listdir(path)])
+            entries.append((os.path.getmtime(path),size,path))
+            total += size
+    for mtime,size,path in sorted(entries):
+        if total <= limit:
+            break
+        shutil.rmtree(path,ignore_errors=True)
+        total -= size
+
+
+def getGeometry(filename,ifc=None):
+
+    """returns a {product id: (verts,faces)} dict of all the products of the
+    given IFC file, from the cache if possible, otherwise tessellated and
+    cached. ifc is the already opened file, if any"""
+
+    geometry = loadCache(filename)
+    if geometry is None:
+        if ifc is None:
+            import ifcopenshell
+            ifc = ifcopenshell.open(filename)
+        geometry = tessellate(ifc)
+        storeCache(filename,ifc,geometry)
+    return geometry
+
+
+class GeometryLoader:
+
+
+    "gets the geometry of an IFC file with getGeometry, on a worker thread"
+
+    def __init__(self,filename):
+
+        self.filename = filename
+        self.geometry = None # the {product id: (verts,faces)} dict, once loaded
+        self.error = None
+        self.thread = None
+
+    def start(self):
+
+        import threading
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def isAlive(self):
+
+        return bool(self.thread) and self.thread.is_alive()
+
+    def run(self):
+
+        try:
+            self.geometry = getGeometry(self.filename)
+        except Exception as e:
+            self.error = e
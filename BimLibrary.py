@@ -27,7 +27,9 @@ from __future__ import print_function
 
 
 import os
+import time
 import FreeCAD
+import BimLibraryIndex
 from BimTranslateUtils import *
 
 FILTERS = ["*.fcstd","*.FCStd","*.FCSTD","*.stp","*.STP","*.step","*.STEP", "*.brp", "*.BRP", "*.brep", "*.BREP", "*.ifc", "*.IFC", "*.sat", "*.SAT"]
@@ -119,6 +121,25 @@ class BIM_Library_TaskPanel:
         self.form.tree.setRootIndex(self.dirmodel.index(self.librarypath))
         self.form.searchBox.textChanged.connect(self.onSearch)
 
+        # the local library is indexed and searched on worker threads
+        self.scanner = None
+        self.rescan = False
+        self.searcher = None
+        self.searchSerial = None
+        self.searchTimer = QtCore.QTimer()
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.timeout.connect(self.search)
+        self.resultTimer = QtCore.QTimer()
+        self.resultTimer.timeout.connect(self.onSearchResults)
+        self.scanTimer = QtCore.QTimer()
+        self.scanTimer.timeout.connect(self.onScanProgress)
+        self.scanLibrary()
+
+        # IFC files not in the mesh cache are tessellated on a worker thread for previews
+        self.previewLoader = None
+        self.previewTimer = QtCore.QTimer()
+        self.previewTimer.timeout.connect(self.onPreviewLoaded)
+
         # setup UI
         self.form.buttonBimObject.setIcon(QtGui.QIcon(os.path.join(os.path.dirname(__file__),"icons","bimobject.png")))
         self.form.buttonBimObject.clicked.connect(self.onBimObject)
@@ -183,6 +204,24 @@ class BIM_Library_TaskPanel:
                     FreeCAD.setActiveDocument(self.previewDocName)
                     Part.show(Part.read(self.path))
                     FreeCADGui.SendMsgToActiveView("ViewFit")
+                elif self.path.lower().endswith(".ifc"):
+                    # tessellated meshes are cached, so previewing the same file again is instant
+                    import BimIfcMesh
+                    self.previewDocName = "Viewer"
+                    FreeCAD.newDocument(self.previewDocName)
+                    FreeCAD.setActiveDocument(self.previewDocName)
+                    self.previewLoader = None
+                    geometry = BimIfcMesh.loadCache(self.path)
+                    if (geometry is None) and not self.linked:
+                        # not cached yet, tessellate on a worker thread, onPreviewLoaded shows it
+                        self.previewLoader = BimIfcMesh.GeometryLoader(self.path)
+                        self.previewLoader.start()
+                        self.previewTimer.start(200)
+                    else:
+                        # a linked file is saved right after, it needs its contents now
+                        if geometry is None:
+                            geometry = BimIfcMesh.getGeometry(self.path)
+                        self.showIfcPreview(geometry)
                 elif self.path.lower().endswith(".fcstd"):
                     openedDoc = FreeCAD.openDocument(self.path)
                     FreeCADGui.SendMsgToActiveView("ViewFit")
@@ -212,6 +251,35 @@ class BIM_Library_TaskPanel:
         self.form.framePreview.clear()
         return self.previewDocName, self.previousIndex, self.linked
 
+    def showIfcPreview(self,geometry):
+
+        "adds the given IFC geometry as a mesh to the preview document"
+
+        import FreeCADGui
+        import BimIfcMesh
+        if not self.previewDocName in FreeCAD.listDocuments():
+            return
+        doc = FreeCAD.getDocument(self.previewDocName)
+        verts,faces,ranges = BimIfcMesh.merge(geometry)
+        doc.addObject("Mesh::Feature","Mesh").Mesh = BimIfcMesh.toMesh(verts,faces)
+        doc.recompute()
+        if FreeCAD.ActiveDocument == doc:
+            FreeCADGui.SendMsgToActiveView("ViewFit")
+
+    def onPreviewLoaded(self):
+
+        if self.previewLoader and self.previewLoader.isAlive():
+            return
+        self.previewTimer.stop()
+        loader = self.previewLoader
+        self.previewLoader = None
+        if not loader:
+            return
+        if loader.error:
+            FreeCAD.Console.PrintError(translate("BIM","Could not preview")+" "+loader.filename+": "+str(loader.error)+"\n")
+        else:
+            self.showIfcPreview(loader.geometry)
+
     def linkfile(self, index):
         import FreeCAD, FreeCADGui
         # check if the main document is open
@@ -271,42 +339,110 @@ class BIM_Library_TaskPanel:
                 if self.stlCB.isChecked() and self.linked == False:
                     STLfilename = fileName + ".stl"
                     Mesh.export(toexport,STLfilename)
+            self.scanLibrary()
         return self.fileDialog[0]
 
     def onSearch(self,text):
 
         if text:
-            self.setSearchModel(text)
+            # search once the user stops typing
+            self.searchTimer.start(250)
         else:
+            self.searchTimer.stop()
             self.setFileModel()
 
+    def search(self):
+
+        self.setSearchModel(self.form.searchBox.text())
+
     def setSearchModel(self,text):
 
-        import PartGui
-        from PySide import QtGui
         self.form.tree.setModel(self.filemodel)
         self.filemodel.clear()
+        if not self.searcher:
+            self.searcher = BimLibraryIndex.LibrarySearcher(self.getIndex().path)
+            self.searcher.start()
         if self.form.checkOnline.isChecked():
-            res = self.getOfflineLib(structured = True)
+            source = BimLibraryIndex.ONLINE
         else:
-            res = os.walk(self.librarypath)
-        for dp,dn,fn in res:
-            for f in fn:
-                if text.lower() in f.lower():
-                    if not os.path.isdir(os.path.join(dp,f)):
-                        it = QtGui.QStandardItem(f)
-                        it.setToolTip(os.path.join(dp,f))
-                        self.filemodel.appendRow(it)
-                        if f.endswith('.fcstd'):
-                            it.setIcon(QtGui.QIcon(':icons/freecad-doc.png'))
-                        elif f.endswith('.ifc'):
-                            it.setIcon(QtGui.QIcon(os.path.join(os.path.dirname(__file__),"icons","IFC.svg")))
-                        else:
-                            it.setIcon(QtGui.QIcon(':icons/Tree_Part.svg'))
+            source = self.librarypath
+        self.searchSerial = self.searcher.search(text,source)
+        self.resultTimer.start(20)
         self.modelmode = 0
 
+    def onSearchResults(self):
+
+        """adds the results of the last search to the model, once they are ready"""
+
+        import PartGui
+        from PySide import QtGui
+        if self.searchSerial is None:
+            self.resultTimer.stop()
+            return
+        result = self.searcher.getResult()
+        if not result or (result[0] != self.searchSerial):
+            if not self.searcher.thread.is_alive():
+                self.resultTimer.stop()
+                self.searchSerial = None
+            return
+        self.resultTimer.stop()
+        self.searchSerial = None
+        if self.searcher.error:
+            FreeCAD.Console.PrintError(translate("BIM","Could not search the library")+": "+str(self.searcher.error)+"\n")
+            self.searcher.error = None
+        online = self.form.checkOnline.isChecked()
+        items = []
+        for path,name,ftype,size in result[1]:
+            it = QtGui.QStandardItem(name)
+            if online:
+                it.setToolTip(":github/"+path)
+            else:
+                it.setToolTip(os.path.join(self.librarypath,*path.split("/")))
+            if ftype == "fcstd":
+                it.setIcon(QtGui.QIcon(':icons/freecad-doc.png'))
+            elif ftype == "ifc":
+                it.setIcon(QtGui.QIcon(os.path.join(os.path.dirname(__file__),"icons","IFC.svg")))
+            else:
+                it.setIcon(QtGui.QIcon(':icons/Tree_Part.svg'))
+            items.append(it)
+        if items:
+            self.filemodel.invisibleRootItem().appendRows(items)
+
+    def scanLibrary(self):
+
+        """updates the index of the local library folder, on a worker thread.
+        Only the folders modified since the last scan are listed again"""
+
+        if not self.librarypath or not os.path.isdir(self.librarypath):
+            return
+        if self.scanner and self.scanner.isAlive():
+            # the running scan may have passed the modified folders already
+            self.rescan = True
+            return
+        self.rescan = False
+        types = sorted(set([f[2:].lower() for f in FILTERS]))
+        self.scanner = BimLibraryIndex.LibraryScanner(self.getIndex().path,self.librarypath,self.librarypath,types)
+        self.scanner.start()
+        self.scanTimer.start(500)
+
+    def onScanProgress(self):
+
+        if self.scanner.isAlive():
+            return
+        self.scanTimer.stop()
+        if self.scanner.error:
+            FreeCAD.Console.PrintError(translate("BIM","Could not index the library")+": "+str(self.scanner.error)+"\n")
+        else:
+            FreeCAD.Console.PrintLog("BIM Library: Indexed "+str(self.scanner.folders)+" folders, "+str(self.scanner.changed)+" files changed in "+"%.2f" % (time.time()-self.scanner.started)+"s\n")
+        if self.rescan:
+            self.scanLibrary()
+        elif self.scanner.changed and (self.modelmode == 0) and self.form.searchBox.text() and not self.form.checkOnline.isChecked():
+            # refresh the results found while the index was incomplete
+            self.search()
+
     def setFileModel(self):
 
+        self.searchSerial = None
         #self.form.tree.clear()
         self.form.tree.setModel(self.dirmodel)
         self.dirmodel.setRootPath(self.librarypath)
@@ -340,43 +476,29 @@ class BIM_Library_TaskPanel:
                 else:
                     it.setIcon(QtGui.QIcon(':icons/Tree_Part.svg'))
 
+        self.searchSerial = None
         self.form.tree.setModel(self.filemodel)
         self.filemodel.clear()
         d = self.getOfflineLib()
         addItems(self.filemodel,d,":github")
         self.modelmode = 0
 
-    def getOfflineLib(self,structured=False):
+    def getIndex(self):
 
-        def addDir(d,root):
+        """returns the library index, opening it if needed"""
 
-            fn = []
-            dn = []
-            dp = []
-            for k,v in d.items():
-                if isinstance(v,dict):
-                    fn2,dn2,dp2 = addDir(v,root+"/"+k)
-                    fn.extend(fn2)
-                    dn.extend(dn2)
-                    dp.extend(dp2)
-                else:
-                    fn += k
-                    dn += root
-                    dp += root+"/"+k
-            return dp,dn,fn
+        if not getattr(self,"index",None):
+            self.index = BimLibraryIndex.LibraryIndex(os.path.join(TEMPLIBPATH,"LibraryIndex.sqlite"))
+        return self.index
+
+    def getOfflineLib(self):
+
+        """returns the cached online library as a nested dict"""
 
-        templibfile = os.path.join(TEMPLIBPATH,"OfflineLibrary.py")
-        if not os.path.exists(templibfile):
+        if not self.getIndex().count(BimLibraryIndex.ONLINE):
             FreeCAD.Console.PrintError(translate("BIM","No structure in cache. Please refresh.")+"\n")
             return {}
-        import sys
-        sys.path.append(TEMPLIBPATH)
-        import OfflineLibrary
-        d = OfflineLibrary.library
-        if structured:
-            return addDir(d,":github")
-        else:
-            return d
+        return self.getIndex().getTree(BimLibraryIndex.ONLINE)
 
 
     def urlencode(self,text):
@@ -445,6 +567,18 @@ class BIM_Library_TaskPanel:
         import FreeCADGui
         if hasattr(self,"box") and self.box:
             self.box.off()
+        self.searchTimer.stop()
+        self.resultTimer.stop()
+        self.scanTimer.stop()
+        self.previewTimer.stop()
+        self.previewLoader = None
+        if self.searcher:
+            self.searcher.stop()
+        if self.scanner:
+            self.scanner.cancel()
+        if getattr(self,"index",None):
+            self.index.close()
+            self.index = None
         FreeCADGui.Control.closeDialog()
         FreeCAD.ActiveDocument.recompute()
 
@@ -645,9 +779,10 @@ class BIM_Library_TaskPanel:
 
     def getOnlineContentsAPI(self,url):
 
-        """same as getOnlineContents but uses github API (faster)"""
+        """same as getOnlineContents but uses github API (faster). Returns a
+        list of (path,size,mtime) entries"""
 
-        result = {}
+        result = []
         import requests
         import json
         count = 0
@@ -658,27 +793,15 @@ class BIM_Library_TaskPanel:
                 print("WARNING: The fetched content exceeds maximum Github allowance and is truncated")
             t = j['tree']
             for f in t:
-                path = f['path'].split("/")
                 if f['type'] == 'tree':
-                    name = None
+                    continue
+                for ft in FILTERS:
+                    if f['path'].endswith(ft[1:]):
+                        break
                 else:
-                    name = path[-1]
-                    path = path[:-1]
-                host = result
-                for fp in path:
-                    if fp in host:
-                        host = host[fp]
-                    else:
-                        host[fp] = {}
-                        host = host[fp]
-                if name:
-                    for ft in FILTERS:
-                        if name.endswith(ft[1:]):
-                            break
-                    else:
-                        continue
-                    host[name] = name
-                    count += 1
+                    continue
+                result.append((f['path'],f.get('size',0),0))
+                count += 1
         else:
             FreeCAD.Console.PrintError(translate("BIM","Could not fetch library contents")+"\n")
         #print("result:",result)
@@ -722,15 +845,26 @@ class BIM_Library_TaskPanel:
 
         def writeOfflineLib():
 
+            def getEntries(d,path):
+
+                for k,v in d.items():
+                    if isinstance(v,dict):
+                        for e in getEntries(v,path+k+"/"):
+                            yield e
+                    else:
+                        yield (path+k,0,0)
+
             if USE_API:
-                rootfiles = self.getOnlineContentsAPI(LIBRARYURL)
+                entries = self.getOnlineContentsAPI(LIBRARYURL)
             else:
-                rootfiles = self.getOnlineContentsWEB(LIBRARYURL)
-            if rootfiles:
+                entries = list(getEntries(self.getOnlineContentsWEB(LIBRARYURL),""))
+            if entries:
+                self.getIndex().replace(BimLibraryIndex.ONLINE,entries)
+                # remove the cache written by older versions
                 templibfile = os.path.join(TEMPLIBPATH,"OfflineLibrary.py")
-                tf = open(templibfile,"w")
-                tf.write("library="+str(rootfiles))
-                tf.close()
+                if os.path.exists(templibfile):
+                    os.remove(templibfile)
+            self.setOnlineModel()
 
         from PySide import QtCore,QtGui
         reply = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetBool("LibraryWarning",False)
@@ -745,7 +879,8 @@ class BIM_Library_TaskPanel:
             QtCore.QTimer.singleShot(1,writeOfflineLib)
             self.form.setEnabled(True)
             QtGui.QApplication.restoreOverrideCursor()
-        self.setOnlineModel()
+        else:
+            self.setOnlineModel()
 
     def onCheckFCStdOnly(self,state):
 
@@ -0,0 +1,430 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""An on-disk SQLite full-text index of the files of the BIM library. Each
+file is stored with its path, type, size and tags, the tags being the words
+of its folders and of its name, and searches are ranked, name matches
+first. Files of different sources, for ex. the online FreeCAD-library or a
+local library folder, are kept apart by a source name.
+
+Local folders are rescanned incrementally: a folder whose modification time
+didn't change since the last scan is not listed again. Scans and searches
+run on worker threads, each with its own connection to the database"""
+
+import os
+import re
+import time
+import FreeCAD
+
+
+SCHEMA_VERSION = 1
+ONLINE = "github" # source name of the online FreeCAD-library
+
+
+def getIndexPath():
+
+    "returns the path of the library index database"
+
+    return os.path.join(FreeCAD.getUserAppDataDir(),"BIM","OfflineLibrary","LibraryIndex.sqlite")
+
+
+def getTags(path):
+
+    """returns the lower-case words of the folders and the name of the given
+    file path, camel-case and underscore-separated words being split"""
+
+    words = []
+    for part in re.split(r"[/\\]",os.path.splitext(path)[0]):
+        part = re.sub(r"([a-z0-9])([A-Z])",r"\1 \2",part) # WoodenDoor -> Wooden Door
+        words.extend(re.findall(r"[^\W_]+",part.lower()))
+    return " ".join(words)
+
+
+def getType(path):
+
+    "returns the lower-case file type (extension without dot) of the given path"
+
+    return os.path.splitext(path)[1][1:].lower()
+
+
+class LibraryIndex:
+
+
+    "a full-text index of library files, stored in a SQLite database"
+
+    def __init__(self,path=None):
+
+        import sqlite3
+        self.path = path or getIndexPath()
+        folder = os.path.dirname(self.path)
+        if folder and not os.path.exists(folder):
+            os.makedirs(folder)
+        # connections are used by one thread at a time, but not always the one that created them
+        self.db = sqlite3.connect(self.path,check_same_thread=False)
+        self.fts = 5
+        self.setup()
+
+    def setup(self):
+
+        "creates the tables if needed, and finds which FTS version is used"
+
+        import sqlite3
+        c = self.db.cursor()
+        c.execute("PRAGMA journal_mode=WAL") # searches can read while a scan writes
+        c.execute("CREATE TABLE IF NOT EXISTS info (key TEXT PRIMARY KEY, value TEXT)")
+        row = c.execute("SELECT value FROM info WHERE key='version'").fetchone()
+        if row and int(row[0]) != SCHEMA_VERSION:
+            c.execute("DROP TABLE IF EXISTS files")
+            c.execute("DROP TABLE IF EXISTS search")
+            c.execute("DROP TABLE IF EXISTS folders") # else the next scan would skip unchanged folders
+        row = c.execute("SELECT sql FROM sqlite_master WHERE name='search'").fetchone()
+        if row:
+            self.fts = 5 if "fts5" in row[0].lower() else 4
+        else:
+            try:
+                c.execute("CREATE VIRTUAL TABLE search USING fts5(name,tags,path)")
+            except sqlite3.OperationalError:
+                # sqlite built without fts5
+                c.execute("CREATE VIRTUAL TABLE search USING fts4(name,tags,path)")
+                self.fts = 4
+        c.execute("""CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, source TEXT, path TEXT,
+                     name TEXT, type TEXT, size INTEGER, mtime REAL, UNIQUE(source,path))""")
+        c.execute("""CREATE TABLE IF NOT EXISTS folders (source TEXT, path TEXT, mtime REAL,
+                     subfolders TEXT, PRIMARY KEY(source,path))""")
+        c.execute("INSERT OR REPLACE INTO info VALUES ('version',?)",(str(SCHEMA_VERSION),))
+        self.db.commit()
+
+    def close(self):
+
+        self.db.close()
+
+    def count(self,source):
+
+        return self.db.execute("SELECT count(*) FROM files WHERE source=?",(source,)).fetchone()[0]
+
+    def clear(self,source):
+
+        "removes all the files of the given source"
+
+        with self.db:
+            self.db.execute("DELETE FROM search WHERE rowid IN (SELECT id FROM files WHERE source=?)",(source,))
+            self.db.execute("DELETE FROM files WHERE source=?",(source,))
+            self.db.execute("DELETE FROM folders WHERE source=?",(source,))
+
+    def add(self,source,entries):
+
+        """adds or updates the given (path,size,mtime) entries of the given source,
+        in one transaction. Paths use forward slashes"""
+
+        with self.db:
+            for path,size,mtime in entries:
+                name = path.split("/")[-1]
+                row = self.db.execute("SELECT id FROM files WHERE source=? AND path=?",(source,path)).fetchone()
+                if row:
+                    self.db.execute("UPDATE files SET size=?,mtime=? WHERE id=?",(size,mtime,row[0]))
+                    continue
+                rowid = self.db.execute("INSERT INTO files (source,path,name,type,size,mtime) VALUES (?,?,?,?,?,?)",
+                                        (source,path,name,getType(name),size,mtime)).lastrowid
+                self.db.execute("INSERT INTO search (rowid,name,tags,path) VALUES (?,?,?,?)",
+                                (rowid,name,getTags(path),path))
+
+    def remove(self,source,paths):
+
+        "removes the given paths of the given source, in one transaction"
+
+        with self.db:
+            for path in paths:
+                row = self.db.execute("SELECT id FROM files WHERE source=? AND path=?",(source,path)).fetchone()
+                if row:
+                    self.db.execute("DELETE FROM search WHERE rowid=?",(row[0],))
+                    self.db.execute("DELETE FROM files WHERE id=?",(row[0],))
+
+    def replace(self,source,entries):
+
+        "replaces all the files of the given source by the given (path,size,mtime) entries"
+
+        self.clear(source)
+        self.add(source,entries)
+
+    def getFiles(self,source):
+
+        "returns a {path: (size,mtime)} dict of the files of the given source"
+
+        return dict([(p,(s,m)) for p,s,m in self.db.execute("SELECT path,size,mtime FROM files WHERE source=?",(source,))])
+
+    def search(self,text,source,types=None,limit=1000):
+
+        """returns the (path,name,type,size) of the files of the given source
+        having words starting with each word of the given text, best matches
+        first. types is an optional list of file types to restrict to"""
+
+        words = re.findall(r"[^\W_]+",text.lower())
+        if not words:
+            return []
+        if self.fts == 5:
+            query = " ".join(['"'+w+'"*' for w in words])
+        else:
+            query = " ".join(['"'+w+'*"' for w in words]) # fts4 only reads the star inside the quotes
+        sql = "SELECT files.path,files.name,files.type,files.size FROM search JOIN files ON files.id=search.rowid WHERE search MATCH ? AND files.source=?"
+        args = [query,source]
+        if types:
+            sql += " AND files.type IN ("+",".join(["?"]*len(types))+")"
+            args.extend(types)
+        if self.fts == 5:
+            sql += " ORDER BY bm25(search,10.0,5.0,1.0)" # name matches rank first
+        else:
+            sql += " ORDER BY length(files.name)"
+        sql += " LIMIT ?"
+        args.append(limit)
+        return self.db.execute(sql,args).fetchall()
+
+    def getTree(self,source):
+
+        """returns the files of the given source as nested dicts, folders being
+        {name: dict} items and files {name: name} items"""
+
+        tree = {}
+        for (path,) in self.db.execute("SELECT path FROM files WHERE source=? ORDER BY path",(source,)):
+            parts = path.split("/")
+            host = tree
+            for part in parts[:-1]:
+                host = host.setdefault(part,{})
+            host[parts[-1]] = parts[-1]
+        return tree
+
+    def scan(self,source,root,types=None,callback=None):
+
+        """updates the given source with the files found in the root folder and
+        its subfolders. types is an optional list of file types to index.
+        Only the folders modified since the last scan are listed. callback(folders
+        scanned, files changed) is called regularly, and the scan stops if it
+        returns False. Returns True if the scan completed"""
+
+        folders = {}
+        for path,mtime,subfolders in self.db.execute("SELECT path,mtime,subfolders FROM folders WHERE source=?",(source,)):
+            folders[path] = (mtime,[f for f in subfolders.split("\n") if f])
+        contents = {} # folder: {path: (size,mtime)} of the indexed files
+        for path,info in self.getFiles(source).items():
+            contents.setdefault(path.rpartition("/")[0],{})[path] = info
+        seen = set()
+        stack = [""]
+        count = 0
+        changed = 0
+        added = []
+        removed = []
+        updated = []
+        while stack:
+            folder = stack.pop()
+            try:
+                mtime = os.stat(os.path.join(root,folder)).st_mtime
+            except OSError:
+                continue
+            seen.add(folder)
+            count += 1
+            known = folders.get(folder)
+            if known and known[0] == mtime:
+                # adding, removing or renaming a file changes the folder mtime
+                stack.extend(known[1])
+                continue
+            subfolders = []
+            found = {}
+            try:
+                for entry in os.scandir(os.path.join(root,folder)):
+                    if entry.name.startswith("."):
+                        continue
+                    path = folder+"/"+entry.name if folder else entry.name
+                    if entry.is_dir():
+                        subfolders.append(path)
+                    elif (not types) or (getType(entry.name) in types):
+                        st = entry.stat()
+                        found[path] = (st.st_size,st.st_mtime)
+            except OSError:
+                continue
+            stack.extend(subfolders)
+            old = contents.get(folder,{})
+            removed.extend([p for p in old if p not in found])
+            added.extend([(p,v[0],v[1]) for p,v in found.items() if old.get(p) != v])
+            updated.append((source,folder,mtime,"\n".join(subfolders)))
+            if len(added)+len(removed) > 1000 or len(updated) > 100:
+                changed += self.commitScan(source,added,removed,updated)
+                if callback and not callback(count,changed):
+                    return False
+        if callback and not callback(count,changed):
+            return False
+        # folders not found anymore
+        for folder in folders:
+            if folder not in seen:
+                removed.extend(contents.get(folder,{}).keys())
+        with self.db:
+            self.db.executemany("DELETE FROM folders WHERE source=? AND path=?",[(source,f) for f in folders if f not in seen])
+        changed += self.commitScan(source,added,removed,updated)
+        if callback:
+            callback(count,changed)
+        return True
+
+    def commitScan(self,source,added,removed,updated):
+
+        "writes and empties the given scan lists, returns the number of changed files"
+
+        changed = len(added)+len(removed)
+        self.remove(source,removed)
+        self.add(source,added)
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO folders VALUES (?,?,?,?)",updated)
+        del added[:]
+        del removed[:]
+        del updated[:]
+        return changed
+
+
+class LibraryScanner:
+
+
+    "scans a library folder into the index, on a worker thread"
+
+    def __init__(self,path,source,root,types=None):
+
+        self.path = path
+        self.source = source
+        self.root = root
+        self.types = types
+        self.folders = 0 # folders scanned so far
+        self.changed = 0 # files added, removed or modified so far
+        self.cancelled = False
+        self.error = None
+        self.started = time.time()
+        self.thread = None
+
+    def start(self):
+
+        import threading
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def cancel(self):
+
+        self.cancelled = True
+
+    def isAlive(self):
+
+        return bool(self.thread) and self.thread.is_alive()
+
+    def onProgress(self,folders,changed):
+
+        self.folders = folders
+        self.changed = changed
+        return not self.cancelled
+
+    def run(self):
+
+        try:
+            index = LibraryIndex(self.path)
+            try:
+                index.scan(self.source,self.root,self.types,self.onProgress)
+            finally:
+                index.close()
+        except Exception as e:
+            self.error = e
+
+
+class LibrarySearcher:
+
+
+    """runs searches in the index on a worker thread. Only the last requested
+    search is run, older pending ones are dropped"""
+
+    def __init__(self,path):
+
+        import threading
+        self.path = path
+        self.condition = threading.Condition()
+        self.serial = 0 # number of the last requested search
+        self.request = None # (serial,text,source,types,limit) of the pending search
+        self.result = None # (serial,rows) of the last finished search
+        self.stopped = False
+        self.error = None
+        self.thread = None
+
+    def start(self):
+
+        import threading
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+
+    def search(self,text,source,types=None,limit=1000):
+
+        "requests a search and returns its serial number"
+
+        with self.condition:
+            self.serial += 1
+            self.request = (self.serial,text,source,types,limit)
+            self.result = None
+            self.condition.notify()
+            return self.serial
+
+    def getResult(self):
+
+        "returns the (serial,rows) of the last requested search if it is done, or None"
+
+        with self.condition:
+            result = self.result
+            self.result = None
+            return result
+
+    def run(self):
+
+        import sqlite3
+        index = None
+        try:
+            index = LibraryIndex(self.path)
+        except (sqlite3.Error,OSError) as e:
+            # keep answering with empty results, so the caller can report the error
+            self.error = e
+        try:
+            while True:
+                with self.condition:
+                    while not (self.request or self.stopped):
+                        self.condition.wait()
+                    if self.stopped:
+                        return
+                    serial,text,source,types,limit = self.request
+                    self.request = None
+                rows = []
+                if index:
+                    try:
+                        rows = index.search(text,source,types,limit)
+                    except sqlite3.Error as e:
+                        self.error = e
+                with self.condition:
+                    if serial == self.serial:
+                        self.result = (serial,rows)
+        finally:
+            if index:
+                index.close()
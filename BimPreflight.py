@@ -24,30 +24,15 @@
 
 
 import os
+import time
 import FreeCAD
 from BimTranslateUtils import *
-import importlib
-import inspect
-
-
-tests = ["testAll",
-         "testIFC4",
-         "testHierarchy",
-         "testSites",
-         "testBuildings",
-         "testStoreys",
-         "testUndefined",
-         "testSolid",
-         "testQuantities",
-         "testCommonPsets",
-         "testPsets",
-         "testMaterials",
-         "testStandards",
-         "testExtrusions",
-         "testStandardCases",
-         "testTinyLines",
-         "testRectangleProfileDef",
-        ]
+import BimPreflightEngine
+
+
+tests = ["testAll"] + BimPreflightEngine.TESTS
+
+PAGESIZE = 1000 # number of culprits shown per page of the results dialog
 
 class BIM_Preflight:
 
@@ -71,14 +56,32 @@ class BIM_Preflight_TaskPanel:
 
     def __init__(self):
 
-        import sys
         import FreeCADGui
         from PySide import QtCore,QtGui
-        self.results = {} # to store the result message
+        self.results = {} # to store the PreflightResult of failed tests
         self.culprits = {} # to store objects to highlight
+        self.customLabels = {} # to store the description labels of custom tests
+        self.status = {} # to store the test state: True (passed), False (failed) or None
+        self.timings = {} # to store the duration of the last run of each test
+        self.snapshot = None # to store the objects snapshot shared by the running tests
+        self.worker = None # to store the thread running the tests
+        self.reading = None # to store the tests to run once the snapshot is read
+        self.closing = False # True if the panel was closed while the worker was still running
+        self.progress = None # to store the PreflightProgress of the running tests
+        self.pending = [] # to store the results given by the worker and not yet shown
+        self.foreground = [] # to store the custom tests that must run on the GUI thread
+        self.cache = BimPreflightEngine.PreflightCache() # to store per-object results between runs
+        self.cache.observe()
         self.rform = None # to store the results dialog
         self.form = FreeCADGui.PySideUic.loadUi(os.path.join(os.path.dirname(__file__),"dialogPreflight.ui"))
         self.form.setWindowIcon(QtGui.QIcon(os.path.join(os.path.dirname(__file__),"icons","BIM_Preflight.svg")))
+        self.form.checkParallel.setChecked(BimPreflightEngine.isParallel())
+        self.form.checkParallel.toggled.connect(self.onCheckParallel)
+        self.form.progressBar.hide()
+        self.form.buttonCancel.hide()
+        self.form.buttonCancel.clicked.connect(self.cancel)
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.onProgress)
         for test in tests:
             getattr(self.form,test).setIcon(QtGui.QIcon(":/icons/button_right.svg"))
             getattr(self.form,test).setToolTip(translate("BIM","Press to perform the test"))
@@ -89,41 +92,31 @@ class BIM_Preflight_TaskPanel:
 
         # setup custom tests
         self.customTests = {}
-        customModulePath = os.path.join(FreeCAD.getUserAppDataDir(),"BIM","Preflight")
-        if os.path.exists(customModulePath):
-            customModules = [m[:-3] for m in os.listdir(customModulePath) if m.endswith(".py")]
-            if customModules:
-                sys.path.append(customModulePath)
-                for customModule in customModules:
-                    mod = importlib.import_module(customModule)
-                    if not "Preflight" in mod.__file__:
-                        # prevent from using other modules with same name
-                        FreeCAD.Console.PrintLog("Preflight: loaded wrong module - skipping: "+customModule+" "+str(mod)+"\n")
-                        continue
-                    FreeCAD.Console.PrintLog("Preflight: found custom module: "+customModule+" "+str(mod)+"\n")
-                    functions = [o[0] for o in inspect.getmembers(mod) if inspect.isfunction(o[1])]
-                    if functions:
-                        box = QtGui.QGroupBox(customModule)
-                        lay = QtGui.QGridLayout(box)
-                        self.form.layout().addWidget(box)
-                        for funcname in functions:
-                            FreeCAD.Console.PrintLog("Preflight: found custom test: "+funcname+"\n")
-                            func = getattr(mod,funcname)
-                            descr = func.__doc__
-                            if not descr:
-                                descr = "Undefined"
-                            lab = QtGui.QLabel(descr)
-                            lab.setWordWrap(True)
-                            but = QtGui.QPushButton()
-                            butname = "Custom_"+customModule+"_"+funcname
-                            but.setObjectName(butname)
-                            setattr(self.form,butname,but)
-                            self.reset(butname)
-                            row = lay.rowCount()
-                            lay.addWidget(lab,row,0)
-                            lay.addWidget(but,row,1)
-                            but.clicked.connect(lambda: self.testCustom(butname))
-                            self.customTests[butname] = func
+        for customModule,plugins in BimPreflightEngine.loadPlugins():
+            box = QtGui.QGroupBox(customModule)
+            lay = QtGui.QGridLayout(box)
+            self.form.layout().addWidget(box)
+            for plugin in plugins:
+                lab = QtGui.QLabel(plugin.description)
+                lab.setWordWrap(True)
+                but = QtGui.QPushButton()
+                butname = plugin.name
+                but.setObjectName(butname)
+                setattr(self.form,butname,but)
+                self.customLabels[butname] = lab
+                self.reset(butname)
+                row = lay.rowCount()
+                lay.addWidget(lab,row,0)
+                lay.addWidget(but,row,1)
+                but.clicked.connect(lambda checked=False,name=butname: self.testCustom(name))
+                self.customTests[butname] = plugin
+
+    def onCheckParallel(self,state):
+
+        "if the parallel checkbox is clicked"
+
+        FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").SetBool("PreflightParallel",state)
+
 
     def getStandardButtons(self):
 
@@ -136,6 +129,15 @@ class BIM_Preflight_TaskPanel:
         import FreeCADGui
         from PySide import QtCore,QtGui
         QtGui.QApplication.restoreOverrideCursor()
+        if self.worker:
+            # don't wait for the worker here, onProgress cleans up once it has stopped
+            self.progress.cancel()
+            self.closing = True
+        else:
+            self.timer.stop()
+            self.reading = None
+            self.snapshot = None
+            self.cache.stop()
         FreeCADGui.Control.closeDialog()
         FreeCAD.ActiveDocument.recompute()
 
@@ -145,8 +147,9 @@ class BIM_Preflight_TaskPanel:
         "sets the button as passed"
 
         from PySide import QtCore,QtGui
+        self.status[test] = True
         getattr(self.form,test).setIcon(QtGui.QIcon(":/icons/button_valid.svg"))
-        getattr(self.form,test).setText(translate("BIM","Passed"))
+        getattr(self.form,test).setText(translate("BIM","Passed")+self.getDuration(test))
         getattr(self.form,test).setToolTip(translate("BIM","This test has succeeded."))
 
 
@@ -155,8 +158,9 @@ class BIM_Preflight_TaskPanel:
         "sets the button as failed"
 
         from PySide import QtCore,QtGui
+        self.status[test] = False
         getattr(self.form,test).setIcon(QtGui.QIcon(":/icons/process-stop.svg"))
-        getattr(self.form,test).setText("Failed")
+        getattr(self.form,test).setText("Failed"+self.getDuration(test))
         getattr(self.form,test).setToolTip(translate("BIM","This test has failed. Press the button to know more"))
 
 
@@ -165,18 +169,38 @@ class BIM_Preflight_TaskPanel:
         "reset the button"
 
         from PySide import QtCore,QtGui
+        self.status[test] = None
         getattr(self.form,test).setIcon(QtGui.QIcon(":/icons/button_right.svg"))
         getattr(self.form,test).setText(translate("BIM","Test"))
         getattr(self.form,test).setToolTip(translate("BIM","Press to perform the test"))
 
 
+    def getDuration(self,test):
+
+        "returns the duration of the last run of the given test as a string"
+
+        if test in self.timings:
+            return " (" + "%.2f" % self.timings.pop(test) + "s)"
+        return ""
+
+
+    def isFailed(self,test):
+
+        "returns True if the given test has been run and has failed"
+
+        return self.status.get(test,None) == False
+
+
     def show(self,test):
 
         "shows test results"
 
         import FreeCADGui
+        from PySide import QtCore,QtGui
         if (test in self.results) and self.results[test]:
-            if (test in self.culprits) and self.culprits[test]:
+            result = self.results[test]
+            if (test in self.culprits) and self.culprits[test] and (len(self.culprits[test]) <= PAGESIZE):
+                # selecting thousands of objects would freeze the GUI, use the list instead
                 FreeCADGui.Selection.clearSelection()
                 for c in self.culprits[test]:
                     FreeCADGui.Selection.addSelection(c)
@@ -185,22 +209,82 @@ class BIM_Preflight_TaskPanel:
                 # center the dialog over FreeCAD window
                 mw = FreeCADGui.getMainWindow()
                 self.rform.move(mw.frameGeometry().topLeft() + mw.rect().center() - self.rform.rect().center())
+                self.rmodel = PreflightResultsModel()
+                self.rform.listCulprits.setModel(self.rmodel)
+                self.rform.listCulprits.selectionModel().selectionChanged.connect(self.onSelectCulprits)
+                self.rform.filterEdit.textChanged.connect(self.onFilterCulprits)
+                self.rform.buttonPrevious.clicked.connect(lambda: self.setPage(self.rmodel.page-1))
+                self.rform.buttonNext.clicked.connect(lambda: self.setPage(self.rmodel.page+1))
                 self.rform.buttonReport.clicked.connect(self.toReport)
+                self.rform.buttonExport.clicked.connect(self.exportReport)
                 self.rform.buttonOK.clicked.connect(self.closeReport)
-            self.rform.textBrowser.setText(self.results[test])
-            label = test.replace("test","label")
-            self.rform.label.setText(getattr(self.form,label).text())
+            text = self.getToolTip(test) + result.message
+            if result.footer:
+                text += "\n" + result.footer
+            if result.profile:
+                text += "\n\n" + result.profile
+            self.rform.textBrowser.setText(text)
+            self.rform.label.setText(self.getLabel(test).text())
             self.rform.test = test
+            self.rform.filterEdit.blockSignals(True)
+            self.rform.filterEdit.setText("")
+            self.rform.filterEdit.blockSignals(False)
+            self.rmodel.setResult(result)
+            self.setPage(0)
             self.rform.show()
 
 
+    def setPage(self,page):
+
+        "shows the given page of the culprits list"
+
+        self.rmodel.setPage(page)
+        self.rform.labelPage.setText(translate("BIM","Page")+" "+str(self.rmodel.page+1)+" / "+str(self.rmodel.pages())
+                                     +" ("+str(len(self.rmodel.filtered))+" "+translate("BIM","objects")+")")
+        self.rform.buttonPrevious.setEnabled(self.rmodel.page > 0)
+        self.rform.buttonNext.setEnabled(self.rmodel.page < self.rmodel.pages()-1)
+
+
+    def onFilterCulprits(self,text):
+
+        "if the filter text of the results dialog changes"
+
+        self.rmodel.setFilter(text)
+        self.setPage(0)
+
+
+    def onSelectCulprits(self,selected=None,deselected=None):
+
+        "selects in the model the objects selected in the culprits list"
+
+        import FreeCADGui
+        FreeCADGui.Selection.clearSelection()
+        for index in self.rform.listCulprits.selectionModel().selectedRows():
+            FreeCADGui.Selection.addSelection(self.rmodel.getObject(index))
+
+
     def toReport(self):
 
         "copies the resulting text to the report view"
 
         if self.rform and hasattr(self.rform,"test") and self.rform.test:
             if self.results[self.rform.test]:
-                FreeCAD.Console.PrintMessage(self.results[self.rform.test]+"\n")
+                self.results[self.rform.test].write(ReportView(),self.getToolTip(self.rform.test))
+
+
+    def exportReport(self):
+
+        "writes the resulting text to a file, one culprit per line"
+
+        from PySide import QtCore,QtGui
+        if self.rform and hasattr(self.rform,"test") and self.rform.test:
+            if self.results[self.rform.test]:
+                path = QtGui.QFileDialog.getSaveFileName(self.rform,translate("BIM","Export results"),
+                                                         self.rform.test+".txt",translate("BIM","Text files (*.txt)"))[0]
+                if path:
+                    import io
+                    with io.open(path,"w",encoding="utf8") as f:
+                        self.results[self.rform.test].write(f,self.getToolTip(self.rform.test))
 
 
     def closeReport(self):
@@ -215,8 +299,6 @@ class BIM_Preflight_TaskPanel:
         "selects target objects"
 
         import FreeCADGui
-        import Draft
-        import Arch
         objs = []
         if self.form.getAll.isChecked():
             objs = FreeCAD.ActiveDocument.Objects
@@ -225,14 +307,35 @@ class BIM_Preflight_TaskPanel:
         else:
             objs = FreeCADGui.Selection.getSelection()
         # clean objects list of unwanted types
-        objs = Draft.get_group_contents(objs,walls=True,addgroups=True)
-        objs = [obj for obj in objs if not obj.isDerivedFrom("Part::Part2DObject")]
-        objs = [obj for obj in objs if not obj.isDerivedFrom("App::Annotation")]
-        objs = [obj for obj in objs if (hasattr(obj,"Shape") and obj.Shape and not (obj.Shape.Edges and (not obj.Shape.Faces)))]
-        objs = Arch.pruneIncluded(objs)
-        objs = [obj for obj in objs if not obj.isDerivedFrom("App::DocumentObjectGroup")]
-        objs = [obj for obj in objs if Draft.getType(obj) not in ["DraftText","Material","MaterialContainer","WorkingPlaneProxy"]]
-        return objs
+        return BimPreflightEngine.getObjects(objs)
+
+
+    def getSnapshot(self):
+
+        "returns the objects snapshot of the current run, or a new one, not read yet"
+
+        if self.snapshot is not None:
+            return self.snapshot
+        return BimPreflightEngine.PreflightSnapshot(self.getObjects(),self.cache,self.form.checkParallel.isChecked(),read=False)
+
+
+    def clearSnapshot(self,arg=None):
+
+        "discards the snapshot shared by a testAll run"
+
+        self.snapshot = None
+        FreeCAD.Console.PrintLog("Preflight: "+str(self.cache.hits)+" cached results reused, "+str(self.cache.misses)+" computed\n")
+        self.cache.hits = 0
+        self.cache.misses = 0
+
+
+    def getLabel(self,test):
+
+        "returns the description label of the given test"
+
+        if test in self.customLabels:
+            return self.customLabels[test]
+        return getattr(self.form,test.replace("test","label"))
 
 
     def getToolTip(self,test):
@@ -240,8 +343,7 @@ class BIM_Preflight_TaskPanel:
         "gets the toolTip text from the ui file"
 
         import re
-        label = test.replace("test","label")
-        tooltip = getattr(self.form,label).toolTip()
+        tooltip = self.getLabel(test).toolTip()
         tooltip = tooltip.replace("</p>","</p>\n\n")
         tooltip = re.sub("<.*?>","",tooltip) # strip html tags
         return tooltip
@@ -252,669 +354,423 @@ class BIM_Preflight_TaskPanel:
         "runs all tests"
 
         import FreeCADGui
-        from PySide import QtCore,QtGui
-        from DraftGui import todo
-        for test in tests:
-            if test != "testAll":
-                QtGui.QApplication.processEvents()
-                self.reset(test)
-                if hasattr(self,test):
-                    todo.delay(getattr(self,test),None)
-        for customTest in self.customTests.keys():
-            todo.delay(self.testCustom,customTest)
+        self.startRun([t for t in tests if t != "testAll"]+list(self.customTests.keys()))
         FreeCADGui.BIMPreflightDone = True
 
 
-    def testIFC4(self):
+    def runTest(self,test):
 
-        "tests for IFC4 support"
+        "runs the given standard test in the background, or shows its results if it has failed"
 
-        test = "testIFC4"
-        if getattr(self.form,test).text() == "Failed":
+        if self.isFailed(test):
             self.show(test)
         else:
+            self.startRun([test])
+
+
+    def startRun(self,testlist):
+
+        """runs the given tests on a worker thread. Everything the tests read
+        from the document is first read into the snapshot here, on the GUI
+        thread, a few objects at a time, so the worker never touches document
+        objects while the document stays editable, and the results are applied
+        here as they come. Custom tests are user code that may read any object,
+        they run here once the worker is done"""
+
+        if self.worker or (self.reading is not None):
+            return
+        background = [t for t in testlist if not t in self.customTests]
+        self.foreground = [t for t in testlist if t in self.customTests]
+        for test in testlist:
             self.reset(test)
             self.results[test] = None
-            self.culprits[test] = None
-            msg = None
-            try:
-                import ifcopenshell
-            except ImportError:
-                msg = translate("BIM","ifcopenshell is not installed on your system or not available to FreeCAD. This library is responsible for IFC support in FreeCAD, and therefore IFC support is currently disabled. Check https://www.freecadweb.org/wiki/Extra_python_modules#IfcOpenShell to obtain more information.")+" "
-                self.failed(test)
-            else:
-                if hasattr(ifcopenshell,"schema_identifier") and ifcopenshell.schema_identifier.startswith("IFC4"):
-                    self.passed(test)
-                elif hasattr(ifcopenshell, "version") and (float(ifcopenshell.version[:3]) >= 0.6):
-                    self.passed(test)
-                else:
-                    msg = self.getToolTip(test)
-                    msg += translate("BIM","The version of ifcopenshell installed on your system will produce files with this schema version:")+"\n\n"
-                    if hasattr(ifcopenshell,"schema_identifier"):
-                        msg += ifcopenshell.schema_identifier + "\n\n"
-                    else:
-                        msg += "Unable to retrieve schemas information from ifcopenshell\n\n"
-                    self.failed(test)
-            self.results[test] = msg
+            self.culprits[test] = []
+        if [t for t in background if not t in BimPreflightEngine.NOSNAPSHOT] or [t for t in self.foreground if not self.customTests[t].legacy]:
+            self.snapshot = self.getSnapshot()
+            self.snapshot.prefetch(background)
+        self.progress = BimPreflightEngine.PreflightProgress(len(background))
+        self.pending = []
+        self.reading = background
+        self.setRunning(True)
+        self.timer.start(0)
+
+
+    def readSnapshot(self):
+
+        """reads the next objects into the snapshot, for a tenth of a second so
+        the GUI stays responsive, then starts the worker once all are read"""
+
+        import threading
+        t = time.time()
+        done = self.snapshot is None
+        try:
+            while (not done) and (not self.progress.cancelled) and (time.time() - t < 0.1):
+                done = self.snapshot.read(50)
+        except Exception as e:
+            FreeCAD.Console.PrintError("Preflight: unable to read the objects: "+repr(e)+"\n")
+            self.progress.cancel()
+        if self.progress.cancelled:
+            self.reading = None
+            self.finishRun()
+            return
+        if not done:
+            self.form.progressBar.setMaximum(max(1,len(self.snapshot.objs)))
+            self.form.progressBar.setValue(self.snapshot.count)
+            self.form.progressBar.setFormat(str(self.snapshot.count)+" / "+str(len(self.snapshot.objs))+" "+translate("BIM","objects read"))
+            return
+        background = self.reading
+        self.reading = None
+        self.worker = threading.Thread(target=self.work,args=(background,self.snapshot,self.progress))
+        self.worker.start()
+        self.timer.start(100)
+
+
+    def work(self,testlist,snapshot,progress):
+
+        """runs the given standard tests. This runs on the worker thread, and
+        must not touch the GUI, nor the document: only the prefetched snapshot"""
+
+        if snapshot is not None:
+            snapshot.progress = progress
+        try:
+            if snapshot is not None:
+                snapshot.prepare(progress)
+            for test in testlist:
+                if progress.cancelled:
+                    break
+                progress.current = test
+                result = BimPreflightEngine.runTest(test,None if test in BimPreflightEngine.NOSNAPSHOT else snapshot)
+                self.pending.append(result)
+                progress.done += 1
+        except BimPreflightEngine.PreflightCancelled:
+            pass
+        except Exception as e:
+            FreeCAD.Console.PrintError("Preflight: "+str(progress.current)+" failed to run: "+repr(e)+"\n")
+        finally:
+            if snapshot is not None:
+                snapshot.progress = None
+            progress.current = None
+
+
+    def onProgress(self):
+
+        "shows the results given by the worker so far, and updates the progress bar"
+
+        if self.reading is not None:
+            self.readSnapshot()
+            return
+        alive = self.worker.is_alive() # checked first, so no result given after the check gets lost
+        if self.closing:
+            # the panel is closed, only wait for the worker to stop
+            if not alive:
+                self.timer.stop()
+                self.worker = None
+                self.pending = []
+                self.snapshot = None
+                self.cache.stop()
+            return
+        while self.pending:
+            self.apply(self.pending.pop(0))
+        p = self.progress
+        self.form.progressBar.setMaximum(max(1,p.tests))
+        self.form.progressBar.setValue(p.done)
+        self.form.progressBar.setFormat(str(p.done)+" / "+str(p.tests)+" "+translate("BIM","tests")+", "+str(p.scanned)+" "+translate("BIM","objects scanned"))
+        if not alive:
+            self.finishRun()
+
+
+    def finishRun(self):
+
+        "cleans up after the worker has finished, and runs the old-style custom tests"
+
+        self.timer.stop()
+        self.worker = None
+        self.setRunning(False)
+        if self.progress.cancelled:
+            FreeCAD.Console.PrintMessage(translate("BIM","Preflight tests cancelled")+"\n")
+        else:
+            for test in self.foreground:
+                self.runForeground(test)
+        self.foreground = []
+        self.clearSnapshot()
+
+
+    def cancel(self):
+
+        "stops the running tests"
+
+        if self.progress:
+            self.progress.cancel()
+
+
+    def setRunning(self,running):
+
+        "shows the progress bar and disables the test buttons while tests run"
+
+        self.form.progressBar.setValue(0)
+        self.form.progressBar.setVisible(running)
+        self.form.buttonCancel.setVisible(running)
+        for test in tests+list(self.customTests.keys()):
+            getattr(self.form,test).setEnabled(not running)
+
+
+    def apply(self,result):
+
+        "shows the given PreflightResult on its button"
+
+        test = result.test
+        self.timings[test] = result.duration
+        self.culprits[test] = result.culprits
+        if result.passed:
+            self.passed(test)
+        else:
+            if test == "testTinyLines":
+                self.showTinyLines(result)
+            self.results[test] = result
+            self.failed(test)
+        if test in self.customTests:
+            self.showTiming(result)
+
+
+    def showTinyLines(self,result):
+
+        "adds an object showing the tiny lines found, and explains it in the result"
+
+        import Part
+        obj = FreeCAD.ActiveDocument.addObject("Part::Feature","TinyLinesResult")
+        obj.Shape = Part.makeCompound(result.edges)
+        obj.ViewObject.LineWidth = 5
+        self.culprits[result.test] = [obj]
+        msg = "\n"+translate("BIM","An additional object, called \"TinyLinesResult\" has been added to this model, and selected. It contains all the tiny lines found, so you can inspect them and fix the needed objects. Be sure to delete the TinyLinesResult object when you are done!")+"\n\n"
+        msg += translate("BIM","Tip: The results are best viewed in Wireframe mode (menu Views -> Draw Style -> Wireframe)")
+        result.footer += msg
+
+
+    def testIFC4(self):
+
+        "tests for IFC4 support"
+
+        self.runTest("testIFC4")
 
 
     def testHierarchy(self):
 
         "tests for project hierarchy support"
 
-        import FreeCADGui
-        import Draft
-        from PySide import QtCore,QtGui
-        test = "testHierarchy"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = []
-            msg = None
-            sites = False
-            buildings = False
-            storeys = False
-            for obj in self.getObjects():
-                if (Draft.getType(obj) == "Site") or (hasattr(obj,"IfcRole") and (obj.IfcRole == "Site")) or (hasattr(obj,"IfcType") and (obj.IfcType == "Site")):
-                    sites = True
-                elif (Draft.getType(obj) == "Building") or (hasattr(obj,"IfcRole") and (obj.IfcRole == "Building")) or (hasattr(obj,"IfcType") and (obj.IfcType == "Building")):
-                    buildings = True
-                elif (hasattr(obj,"IfcRole") and (obj.IfcRole == "Building Storey")) or (hasattr(obj,"IfcType") and (obj.IfcType == "Building Storey")):
-                    storeys = True
-            if (not sites) or (not buildings)  or (not storeys):
-                msg = self.getToolTip(test)
-                msg += translate("BIM","The following types were not found in the project:")+"\n"
-                if not sites:
-                    msg += "\nSite"
-                if not buildings:
-                    msg += "\nBuilding"
-                if not storeys:
-                    msg += "\nBuilding Storey"
-            if msg:
-                self.failed(test)
-            else:
-                self.passed(test)
-            self.results[test] = msg
-            QtGui.QApplication.restoreOverrideCursor()
+        self.runTest("testHierarchy")
 
 
     def testSites(self):
 
         "tests for Sites support"
 
-        import FreeCADGui
-        import Draft
-        from PySide import QtCore,QtGui
-        test = "testSites"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = []
-            msg = None
-            for obj in self.getObjects():
-                if (Draft.getType(obj) == "Building") or (hasattr(obj,"IfcRole") and (obj.IfcRole == "Building")) or (hasattr(obj,"IfcType") and (obj.IfcType == "Building")):
-                    ok = False
-                    for parent in obj.InList:
-                        if (Draft.getType(parent) == "Site") or (hasattr(parent,"IfcRole") and (parent.IfcRole == "Site")) or (hasattr(parent,"IfcType") and (parent.IfcType == "Site")):
-                            if hasattr(parent,"Group") and parent.Group:
-                                if obj in parent.Group:
-                                    ok = True
-                                    break
-                    if not ok:
-                        self.culprits[test].append(obj)
-                        if not msg:
-                            msg = self.getToolTip(test)
-                            msg += translate("BIM","The following Building objects have been found to not be included in any Site. You can resolve the situation by creating a Site object, if none is present in your model, and drag and drop the Building objects into it in the tree view:")+"\n\n"
-                        msg += obj.Label +"\n"
-            if msg:
-                self.failed(test)
-            else:
-                self.passed(test)
-            self.results[test] = msg
-            QtGui.QApplication.restoreOverrideCursor()
+        self.runTest("testSites")
 
 
     def testBuildings(self):
 
         "tests for Buildings support"
 
-        from PySide import QtCore,QtGui
-        test = "testBuildings"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = []
-            msg = None
-            for obj in self.getObjects():
-                if (hasattr(obj,"IfcRole") and (obj.IfcRole == "Building Storey")) or (hasattr(obj,"IfcType") and (obj.IfcType == "Building Storey")):
-                    ok = False
-                    for parent in obj.InList:
-                        if (hasattr(parent,"IfcRole") and (parent.IfcRole == "Building")) or (hasattr(parent,"IfcType") and (parent.IfcType == "Building")):
-                            if hasattr(parent,"Group") and parent.Group:
-                                if obj in parent.Group:
-                                    ok = True
-                                    break
-                    if not ok:
-                        self.culprits[test].append(obj)
-                        if not msg:
-                            msg = self.getToolTip(test)
-                            msg += translate("BIM","The following Building Storey (BuildingParts with their IFC role set as \"Building Storey\") objects have been found to not be included in any Building. You can resolve the situation by creating a Building object, if none is present in your model, and drag and drop the Building Storey objects into it in the tree view:")+"\n\n"
-                        msg += obj.Label +"\n"
-            if msg:
-                self.failed(test)
-            else:
-                self.passed(test)
-            self.results[test] = msg
-            QtGui.QApplication.restoreOverrideCursor()
+        self.runTest("testBuildings")
 
 
     def testStoreys(self):
 
         "tests for Building Storey support"
 
-        from PySide import QtCore,QtGui
-        test = "testStoreys"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = []
-            msg = None
-            for obj in self.getObjects():
-                if (hasattr(obj,"IfcRole") and (not obj.IfcRole in ["Building","Building Storey","Site"])) or (hasattr(obj,"IfcType") and (not obj.IfcType in ["Building","Building Storey","Site"])):
-                    ok = False
-                    for parent in obj.InListRecursive:
-                        # just check if any of the ancestors is a Building Storey for now. Don't check any further...
-                        if (hasattr(parent,"IfcRole") and (parent.IfcRole == "Building Storey")) or (hasattr(parent,"IfcType") and (parent.IfcType == "Building Storey")):
-                            ok = True
-                            break
-                    if not ok:
-                        self.culprits[test].append(obj)
-                        if not msg:
-                            msg = self.getToolTip(test)
-                            msg += translate("BIM","The following BIM objects have been found to not be included in any Building Storey (BuildingParts with their IFC role set as \"Building Storey\"). You can resolve the situation by creating a Building Storey object, if none is present in your model, and drag and drop these objects into it in the tree view:")+"\n\n"
-                        msg += obj.Label +"\n"
-            if msg:
-                self.failed(test)
-            else:
-                self.passed(test)
-            self.results[test] = msg
-            QtGui.QApplication.restoreOverrideCursor()
+        self.runTest("testStoreys")
 
 
     def testUndefined(self):
 
         "tests for undefined BIM objects"
 
-        from PySide import QtCore,QtGui
-        test = "testUndefined"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = []
-            undefined = []
-            notbim = []
-            msg = None
-
-            for obj in self.getObjects():
-                if hasattr(obj,"IfcType"):
-                    if (obj.IfcType == "Undefined"):
-                        self.culprits[test].append(obj)
-                        undefined.append(obj)
-                elif hasattr(obj,"IfcRole"):
-                    if (obj.IfcRole == "Undefined"):
-                        self.culprits[test].append(obj)
-                        undefined.append(obj)
-                else:
-                    self.culprits[test].append(obj)
-                    notbim.append(obj)
-            if undefined or notbim:
-                msg = self.getToolTip(test)
-                if undefined:
-                    msg += translate("BIM","The following BIM objects have the \"Undefined\" type:")+"\n\n"
-                    for o in undefined:
-                        msg += o.Label + "\n"
-                if notbim:
-                    msg += translate("BIM","The following objects are not BIM objects:")+"\n\n"
-                    for o in notbim:
-                        msg += o.Label + "\n"
-                        msg += translate("BIM","You can turn these objects into BIM objects by using the Utils -> Make Component tool.")
-            if msg:
-                self.failed(test)
-            else:
-                self.passed(test)
-            self.results[test] = msg
-            QtGui.QApplication.restoreOverrideCursor()
+        self.runTest("testUndefined")
 
 
     def testSolid(self):
 
         "tests for invalid/non-solid BIM objects"
 
-        from PySide import QtCore,QtGui
-        test = "testSolid"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = []
-            msg = None
-
-            for obj in self.getObjects():
-                if obj.isDerivedFrom("Part::Feature"):
-                    if (not obj.Shape.isNull()) and ((not obj.Shape.isValid()) or (not obj.Shape.Solids)):
-                        self.culprits[test].append(obj)
-            if self.culprits[test]:
-                msg = self.getToolTip(test)
-                msg += translate("BIM","The following BIM objects have an invalid or non-solid geometry:")+"\n\n"
-                for o in self.culprits[test]:
-                    msg += o.Label + "\n"
-            if msg:
-                self.failed(test)
-            else:
-                self.passed(test)
-            self.results[test] = msg
-            QtGui.QApplication.restoreOverrideCursor()
+        self.runTest("testSolid")
 
 
     def testQuantities(self):
 
         "tests for explicit quantities export"
 
-        from PySide import QtCore,QtGui
-        test = "testQuantities"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = []
-            msg = None
-
-            for obj in self.getObjects():
-                if hasattr(obj,"IfcAttributes") and (Draft.getType(obj) != "BuildingPart"):
-                    for prop in ["Length","Width","Height"]:
-                        if prop in obj.PropertiesList:
-                            if (not "Export"+prop in obj.IfcAttributes) or (obj.IfcAttributes["Export"+prop] == "False"):
-                                self.culprits[test].append(obj)
-                                break
-            if self.culprits[test]:
-                msg = self.getToolTip(test)
-                msg += translate("BIM","The objects below have Length, Width or Height properties, but these properties won't be explicitly exported to IFC. This is not necessarily an issue, unless you specifically want these quantities to be exported:")+"\n\n"
-                for o in self.culprits[test]:
-                    msg += o.Label + "\n"
-                msg += "\n"+translate("BIM","To enable exporting of these quantities, use the IFC quantities manager tool located under menu Manage -> Manage IFC Quantities...")
-            if msg:
-                self.failed(test)
-            else:
-                self.passed(test)
-            self.results[test] = msg
-            QtGui.QApplication.restoreOverrideCursor()
+        self.runTest("testQuantities")
 
 
     def testCommonPsets(self):
 
         "tests for common property sets"
 
-        from PySide import QtCore,QtGui
-        import csv
-        test = "testCommonPsets"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = []
-            msg = None
-            psets = []
-            psetspath = os.path.join(FreeCAD.getResourceDir(),"Mod","Arch","Presets","pset_definitions.csv")
-            if os.path.exists(psetspath):
-                with open(psetspath, "r") as csvfile:
-                    reader = csv.reader(csvfile, delimiter=';')
-                    for row in reader:
-                        if "Common" in row[0]:
-                            psets.append(row[0][5:-6])
-            psets = [''.join(map(lambda x: x if x.islower() else " "+x, p)) for p in psets]
-            psets = [pset.strip() for pset in psets]
-            #print(psets)
-
-            for obj in self.getObjects():
-                ok = True
-                if hasattr(obj,"IfcProperties") and isinstance(obj.IfcProperties,dict):
-                    r = None
-                    if hasattr(obj,"IfcType"):
-                        r = obj.IfcType
-                    if hasattr(obj,"IfcRole"):
-                        r = obj.IfcRole
-                    if r and (r in psets):
-                        ok = False
-                        if "Pset_"+r.replace(" ","")+"Common" in ','.join(obj.IfcProperties.values()):
-                            ok = True
-                if not ok:
-                    self.culprits[test].append(obj)
-
-            if self.culprits[test]:
-                msg = self.getToolTip(test)
-                msg += translate("BIM","The objects below have a defined IFC type but do not have the associated common property set:")+"\n\n"
-                for o in self.culprits[test]:
-                    msg += o.Label + "\n"
-                msg += "\n"+translate("BIM","To add common property sets to these objects, use the IFC properties manager tool located under menu Manage -> Manage IFC Properties...")
-            if msg:
-                self.failed(test)
-            else:
-                self.passed(test)
-            self.results[test] = msg
-            QtGui.QApplication.restoreOverrideCursor()
+        self.runTest("testCommonPsets")
 
 
     def testPsets(self):
 
         "tests for property sets integrity"
 
-        from PySide import QtCore,QtGui
-        import csv
-        test = "testPsets"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = []
-            msg = None
-            psets = {}
-            psetspath = os.path.join(FreeCAD.getResourceDir(),"Mod","Arch","Presets","pset_definitions.csv")
-            if os.path.exists(psetspath):
-                with open(psetspath, "r") as csvfile:
-                    reader = csv.reader(csvfile, delimiter=';')
-                    for row in reader:
-                        if "Common" in row[0]:
-                            psets[row[0]] = row[1:]
- 
-            for obj in self.getObjects():
-                ok = True
-                if hasattr(obj,"IfcProperties") and isinstance(obj.IfcProperties,dict):
-                    r = None
-                    if hasattr(obj,"IfcType"):
-                        r = obj.IfcType
-                    elif hasattr(obj,"IfcRole"):
-                        r = obj.IfcRole
-                    if r and (r != "Undefined"):
-                        found = None
-                        for pset in psets.keys():
-                            for val in obj.IfcProperties.values():
-                                if pset in val:
-                                    found = pset
-                                    break
-                        if found:
-                            for i in range(int(len(psets[found])/2)):
-                                p = psets[found][i*2]
-                                t = psets[found][i*2+1]
-                                #print("testing for ",p,t,found," in ",obj.IfcProperties)
-                                if p in obj.IfcProperties:
-                                    if (not found in obj.IfcProperties[p]) or (not t in obj.IfcProperties[p]):
-                                        ok = False
-                                else:
-                                    ok = False
-                if not ok:
-                    self.culprits[test].append(obj)
-
-            if self.culprits[test]:
-                msg = self.getToolTip(test)
-                msg += translate("BIM","The objects below have a common property set but that property set doesn't contain all the needed properties:")+"\n\n"
-                for o in self.culprits[test]:
-                    msg += o.Label + "\n"
-                msg += "\n"+translate("BIM","Verify which properties a certain property set must contain on http://www.buildingsmart-tech.org/ifc/IFC4/Add2/html/annex/annex-b/alphabeticalorder_psets.htm")+"\n\n"
-                msg += translate("BIM","To fix the property sets of these objects, use the IFC properties manager tool located under menu Manage -> Manage IFC Properties...")
-            if msg:
-                self.failed(test)
-            else:
-                self.passed(test)
-            self.results[test] = msg
-            QtGui.QApplication.restoreOverrideCursor()
+        self.runTest("testPsets")
 
 
     def testMaterials(self):
 
         "tests for materials in BIM objects"
 
-        from PySide import QtCore,QtGui
-        test = "testMaterials"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = []
-            msg = None
-            for obj in self.getObjects():
-                if "Material" in obj.PropertiesList:
-                    if not obj.Material:
-                        self.culprits[test].append(obj)
-            if self.culprits[test]:
-                msg = self.getToolTip(test)
-                msg += translate("BIM","The following BIM objects have no material attributed:")+"\n\n"
-                for o in self.culprits[test]:
-                    msg += o.Label + "\n"
-            if msg:
-                self.failed(test)
-            else:
-                self.passed(test)
-            self.results[test] = msg
-            QtGui.QApplication.restoreOverrideCursor()
+        self.runTest("testMaterials")
 
 
     def testStandards(self):
 
         "tests for standards in BIM objects"
 
-        from PySide import QtCore,QtGui
-        test = "testStandards"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = []
-            msg = None
-            for obj in self.getObjects():
-                if "StandardCode" in obj.PropertiesList:
-                    if not obj.StandardCode:
-                        self.culprits[test].append(obj)
-                if "Material" in obj.PropertiesList:
-                    if obj.Material:
-                        if "StandardCode" in obj.Material.PropertiesList:
-                            if not obj.Material.StandardCode:
-                                self.culprits[test].append(obj.Material)
-            if self.culprits[test]:
-                msg = self.getToolTip(test)
-                msg += translate("BIM","The following BIM objects have no defined standard code:")+"\n\n"
-                for o in self.culprits[test]:
-                    msg += o.Label + "\n"
-            if msg:
-                self.failed(test)
-            else:
-                self.passed(test)
-            self.results[test] = msg
-            QtGui.QApplication.restoreOverrideCursor()
+        self.runTest("testStandards")
 
 
     def testExtrusions(self):
 
         "tests is all objects are extrusions"
 
-        from PySide import QtCore,QtGui
-        import Draft
-        test = "testExtrusions"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = []
-            msg = None
-            for obj in self.getObjects():
-                if hasattr(obj,"Proxy"):
-                    if hasattr(obj,"IfcAttributes") and ("FlagForceBrep" in obj.IfcAttributes.keys()) and (obj.IfcAttributes["FlagForceBrep"] == "True"):
-                        self.culprits[test].append(obj)
-                    elif hasattr(obj.Proxy,"getExtrusionData") and not obj.Proxy.getExtrusionData(obj):
-                        self.culprits[test].append(obj)
-                    elif Draft.getType(obj) == "BuildingPart":
-                        pass
-                elif obj.isDerivedFrom("Part::Extrusion"):
-                    pass
-                elif obj.isDerivedFrom("App::DocumentObjectGroup"):
-                    pass
-                elif obj.isDerivedFrom("App::MaterialObject"):
-                    pass
-                else:
-                    self.culprits[test].append(obj)
-            if self.culprits[test]:
-                msg = self.getToolTip(test)
-                msg += translate("BIM","The following BIM objects are not extrusions:")+"\n\n"
-                for o in self.culprits[test]:
-                    msg += o.Label + "\n"
-            if msg:
-                self.failed(test)
-            else:
-                self.passed(test)
-            self.results[test] = msg
-            QtGui.QApplication.restoreOverrideCursor()
+        self.runTest("testExtrusions")
 
 
     def testStandardCases(self):
 
         "tests for structs and wall standard cases"
 
-        import Draft
-        from PySide import QtCore,QtGui
-        test = "testStandardCases"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = []
-            msg = None
-            for obj in self.getObjects():
-                if Draft.getType(obj) == "Wall":
-                    if obj.Base and (len(obj.Base.Shape.Edges) != 1):
-                        self.culprits[test].append(obj)
-                elif Draft.getType(obj) == "Structure":
-                    if obj.Base and ( (len(obj.Base.Shape.Wires) != 1) or (not obj.Base.Shape.Wires[0].isClosed()) ):
-                        self.culprits[test].append(obj)
-            if self.culprits[test]:
-                msg = self.getToolTip(test)
-                msg += translate("BIM","The following BIM objects are not standard cases:")+"\n\n"
-                for o in self.culprits[test]:
-                    msg += o.Label + "\n"
-            if msg:
-                self.failed(test)
-            else:
-                self.passed(test)
-            self.results[test] = msg
-            QtGui.QApplication.restoreOverrideCursor()
+        self.runTest("testStandardCases")
 
 
     def testTinyLines(self):
 
         "tests for objects with tiny lines (< 0.8mm)"
 
-        from PySide import QtCore,QtGui
-        test = "testTinyLines"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = []
-            msg = None
-            minl = 0.79376 # min 1/32"
-            edges = []
-            objs = []
-            for obj in self.getObjects():
-                if obj.isDerivedFrom("Part::Feature"):
-                    if obj.Shape:
-                        for e in obj.Shape.Edges:
-                            if e.Length <= minl:
-                                edges.append(e)
-                                if not obj in objs:
-                                    objs.append(obj)
-            if edges:
-                result = FreeCAD.ActiveDocument.addObject("Part::Feature","TinyLinesResult")
-                result.Shape = Part.makeCompound(edges)
-                result.ViewObject.LineWidth = 5
-                self.culprits[test] = [result]
-                msg = self.getToolTip(test)
-                msg += translate("BIM","The objects below have lines smaller than 1/32 inch or 0.79 mm, which is the smallest line size that Revit accepts. These objects will be discarded when imported into Revit:")+"\n\n"
-                for obj in objs:
-                    msg += obj.Label +"\n"
-                msg += "\n"+translate("BIM","An additional object, called \"TinyLinesResult\" has been added to this model, and selected. It contains all the tiny lines found, so you can inspect them and fix the needed objects. Be sure to delete the TinyLinesResult object when you are done!")+"\n\n"
-                msg += translate("BIM","Tip: The results are best viewed in Wireframe mode (menu Views -> Draw Style -> Wireframe)")
-            if msg:
-                self.failed(test)
-            else:
-                self.passed(test)
-            self.results[test] = msg
-            QtGui.QApplication.restoreOverrideCursor()
+        self.runTest("testTinyLines")
 
 
     def testRectangleProfileDef(self):
 
         "tests for RectangleProfileDef disable"
 
-        test = "testRectangleProfileDef"
-        if getattr(self.form,test).text() == "Failed":
-            self.show(test)
-        else:
-            self.reset(test)
-            self.results[test] = None
-            self.culprits[test] = None
-            msg = None
-            if FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Arch").GetBool("DisableIfcRectangleProfileDef",False):
-                self.passed(test)
-            else:
-                msg = self.getToolTip(test)
-                self.failed(test)
-            self.results[test] = msg
+        self.runTest("testRectangleProfileDef")
+
 
     def testCustom(self,test):
-        
+
         "performs a custom test"
 
         if test in self.customTests:
-            if getattr(self.form,test).text() == "Failed":
+            if self.isFailed(test):
                 self.show(test)
             else:
-                self.reset(test)
-                self.results[test] = None            
-                result = self.customTests[test]()
-                if result == True:
-                    self.passed(test)
-                else:
-                    self.failed(test)
-                    self.results[test] = result
-                
+                self.startRun([test])
+
+
+    def runForeground(self,test):
+
+        "runs a custom test, which might read any object or use the GUI, on the GUI thread"
+
+        from PySide import QtCore,QtGui
+        QtGui.QApplication.setOverrideCursor(QtCore.Qt.WaitCursor)
+        self.apply(self.customTests[test].run(self.snapshot,self.cache,self.form.checkProfile.isChecked()))
+        QtGui.QApplication.restoreOverrideCursor()
+
+
+    def showTiming(self,result):
+
+        "adds the timing of a custom test to its button tooltip, and prints its profile if it has passed"
+
+        plugin = self.customTests[result.test]
+        if result.skipped:
+            timing = translate("BIM","Skipped, nothing this test looks at has changed since the last run")
+        else:
+            timing = translate("BIM","Ran in")+" "+"%.3f" % result.duration+"s"
+        button = getattr(self.form,result.test)
+        button.setToolTip(button.toolTip()+"\n"+timing)
+        if result.profile and result.passed:
+            FreeCAD.Console.PrintMessage(plugin.name+": "+timing+"\n"+result.profile+"\n")
+
+
+
+class ReportView:
+
+
+    "a file-like object that writes to the report view"
+
+    def write(self,text):
+
+        FreeCAD.Console.PrintMessage(text)
+
+
+if FreeCAD.GuiUp:
+
+    from PySide import QtCore,QtGui
+
+    class PreflightResultsModel(QtCore.QAbstractListModel):
+
+        """a list model showing one page of the culprits of a PreflightResult,
+        optionally filtered. Only the rows on screen are ever turned into text"""
+
+        def __init__(self):
+
+            QtCore.QAbstractListModel.__init__(self)
+            self.result = None
+            self.filtered = [] # the culprits matching the filter
+            self.page = 0
+
+        def setResult(self,result):
+
+            self.beginResetModel()
+            self.result = result
+            self.filtered = list(result.culprits) if result else []
+            self.page = 0
+            self.endResetModel()
+
+        def setFilter(self,text):
+
+            "only keeps the culprits whose label, name or note contains the given text"
+
+            self.beginResetModel()
+            culprits = self.result.culprits if self.result else []
+            text = text.lower()
+            if text:
+                self.filtered = [o for o in culprits if (text in o.Label.lower()) or (text in o.Name.lower()) or (text in self.result.notes.get(o.Name,"").lower())]
+            else:
+                self.filtered = list(culprits)
+            self.page = 0
+            self.endResetModel()
+
+        def pages(self):
+
+            return max(1,(len(self.filtered)+PAGESIZE-1)//PAGESIZE)
+
+        def setPage(self,page):
+
+            self.beginResetModel()
+            self.page = max(0,min(page,self.pages()-1))
+            self.endResetModel()
+
+        def rowCount(self,parent=QtCore.QModelIndex()):
+
+            if parent.isValid():
+                return 0
+            return max(0,min(PAGESIZE,len(self.filtered)-self.page*PAGESIZE))
+
+        def getObject(self,index):
+
+            "returns the culprit at the given index of the current page"
+
+            return self.filtered[self.page*PAGESIZE+index.row()]
+
+        def data(self,index,role=QtCore.Qt.DisplayRole):
+
+            if not index.isValid():
+                return None
+            if role == QtCore.Qt.DisplayRole:
+                return self.result.getLine(self.getObject(index))
+            elif role == QtCore.Qt.ToolTipRole:
+                return self.getObject(index).Name
+            return None
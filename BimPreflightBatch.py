@@ -0,0 +1,197 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2017 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""Headless batch preflight. Runs the preflight tests on many FCStd files,
+each one in its own FreeCADCmd process, and writes JSON and/or JUnit reports.
+
+Usage: python BimPreflightBatch.py [options] file1.FCStd file2.FCStd ...
+
+This script doesn't need FreeCAD itself, it only drives FreeCADCmd workers.
+FreeCADCmd treats its command line arguments as files to open, so the worker
+gets its job through the BIM_PREFLIGHT_* environment variables instead."""
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+
+
+WORKER_FILE = "BIM_PREFLIGHT_FILE" # the file to check
+WORKER_OUTPUT = "BIM_PREFLIGHT_OUTPUT" # the json file to write the results to
+WORKER_TESTS = "BIM_PREFLIGHT_TESTS" # comma-separated tests to run, all if empty
+WORKER_PARALLEL = "BIM_PREFLIGHT_PARALLEL" # "1" to check geometry on a process pool
+
+
+def runFile(filename,tests=None,parallel=False):
+
+    "runs the preflight tests on the given file, inside FreeCAD, and returns a json-serializable dict"
+
+    import FreeCAD
+    import BimPreflightEngine
+    if not tests:
+        tests = BimPreflightEngine.TESTS
+    report = {"file":filename,"objects":0,"snapshot":0.0,"duration":0.0,"results":[],"error":None}
+    t = time.time()
+    doc = FreeCAD.openDocument(filename)
+    try:
+        snapshot = BimPreflightEngine.PreflightSnapshot(BimPreflightEngine.getObjects(doc.Objects),parallel=parallel)
+        report["objects"] = len(snapshot)
+        report["snapshot"] = snapshot.duration
+        for result in BimPreflightEngine.runTests(snapshot,tests):
+            report["results"].append(result.toDict())
+    finally:
+        FreeCAD.closeDocument(doc.Name)
+    report["duration"] = time.time() - t
+    return report
+
+
+def worker():
+
+    "the FreeCADCmd side: runs one file described by the environment and writes its report"
+
+    filename = os.environ[WORKER_FILE]
+    output = os.environ[WORKER_OUTPUT]
+    tests = [t for t in os.environ.get(WORKER_TESTS,"").split(",") if t]
+    parallel = os.environ.get(WORKER_PARALLEL,"") == "1"
+    try:
+        report = runFile(filename,tests,parallel)
+    except Exception as e:
+        report = {"file":filename,"results":[],"error":repr(e)}
+    with open(output,"w") as f:
+        json.dump(report,f)
+
+
+def runProcess(filename,freecadcmd,tests,timeout,parallel=False):
+
+    "runs one FreeCADCmd worker on the given file and returns its report"
+
+    import subprocess
+    import tempfile
+    fd,output = tempfile.mkstemp(suffix=".json")
+    os.close(fd)
+    env = dict(os.environ)
+    env[WORKER_FILE] = os.path.abspath(filename)
+    env[WORKER_OUTPUT] = output
+    env[WORKER_TESTS] = ",".join(tests or [])
+    env[WORKER_PARALLEL] = "1" if parallel else ""
+    t = time.time()
+    report = {"file":filename,"results":[],"error":None}
+    try:
+        proc = subprocess.run([freecadcmd,os.path.abspath(__file__)],env=env,timeout=timeout,
+                              stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+        if os.path.getsize(output):
+            with open(output) as f:
+                report = json.load(f)
+        else:
+            report["error"] = "FreeCADCmd exited with code "+str(proc.returncode)+": "+proc.stdout.decode("utf8","replace")[-2000:]
+    except subprocess.TimeoutExpired:
+        report["error"] = "Timeout after "+str(timeout)+"s"
+    except (OSError,ValueError) as e:
+        report["error"] = repr(e)
+    finally:
+        os.remove(output)
+    report["file"] = filename
+    report["wall"] = time.time() - t
+    return report
+
+
+def writeJUnit(reports,path):
+
+    "writes the given reports as a JUnit XML file, one testsuite per file"
+
+    import xml.etree.ElementTree as ET
+    root = ET.Element("testsuites")
+    for report in reports:
+        results = report.get("results",[])
+        suite = ET.SubElement(root,"testsuite",name=report["file"],
+                              tests=str(len(results)),
+                              failures=str(len([r for r in results if not r["passed"]])),
+                              errors="1" if report.get("error") else "0",
+                              time="%.3f" % report.get("duration",0.0))
+        if report.get("error"):
+            case = ET.SubElement(suite,"testcase",classname="BimPreflight",name="open")
+            ET.SubElement(case,"error",message=report["error"])
+        for r in results:
+            case = ET.SubElement(suite,"testcase",classname="BimPreflight",name=r["test"],time="%.3f" % r["duration"])
+            if not r["passed"]:
+                failure = ET.SubElement(case,"failure",message=str(len(r["culprits"]))+" culprits")
+                failure.text = r["message"] + "\n" + "\n".join([c["name"]+" ("+c["label"]+")"+(" "+c["note"] if "note" in c else "") for c in r["culprits"]])
+                if r.get("footer"):
+                    failure.text += "\n" + r["footer"]
+    ET.ElementTree(root).write(path,encoding="utf-8",xml_declaration=True)
+
+
+def main(argv=None):
+
+    "the command line entry point: fans the given files out to FreeCADCmd workers"
+
+    import argparse
+    from concurrent.futures import ThreadPoolExecutor
+    parser = argparse.ArgumentParser(description="Runs BIM preflight tests on FCStd files")
+    parser.add_argument("files",nargs="+",help="the FCStd files to check")
+    parser.add_argument("-j","--jobs",type=int,default=os.cpu_count() or 1,help="number of FreeCADCmd processes to run in parallel")
+    parser.add_argument("--freecadcmd",default=os.environ.get("FREECADCMD","FreeCADCmd"),help="path to the FreeCADCmd executable")
+    parser.add_argument("--tests",default="",help="comma-separated list of tests to run (default: all)")
+    parser.add_argument("--parallel",action="store_true",help="also check the geometry of each file on a process pool (useful with few, large files)")
+    parser.add_argument("--timeout",type=float,default=None,help="max seconds per file")
+    parser.add_argument("--json",help="path of the JSON report to write")
+    parser.add_argument("--junit",help="path of the JUnit XML report to write")
+    args = parser.parse_args(argv)
+    tests = [t for t in args.tests.split(",") if t]
+
+    t = time.time()
+    with ThreadPoolExecutor(max_workers=max(1,args.jobs)) as pool:
+        # each thread only waits on its own FreeCADCmd process
+        reports = list(pool.map(lambda f: runProcess(f,args.freecadcmd,tests,args.timeout,args.parallel),args.files))
+    failed = 0
+    errors = 0
+    for report in reports:
+        if report.get("error"):
+            errors += 1
+            print(report["file"],"ERROR",report["error"])
+            continue
+        bad = [r["test"] for r in report["results"] if not r["passed"]]
+        if bad:
+            failed += 1
+        print(report["file"],"FAILED "+",".join(bad) if bad else "PASSED","(%.2fs)" % report.get("duration",0.0))
+    summary = {"files":len(reports),"failed":failed,"errors":errors,"duration":time.time()-t}
+    print(summary["files"],"files,",failed,"failed,",errors,"errors in","%.2f" % summary["duration"],"s")
+    if args.json:
+        with open(args.json,"w") as f:
+            json.dump({"summary":summary,"reports":reports},f,indent=1)
+    if args.junit:
+        writeJUnit(reports,args.junit)
+    if errors:
+        return 2
+    if failed:
+        return 1
+    return 0
+
+
+if os.environ.get(WORKER_FILE):
+    # we are running inside a FreeCADCmd worker
+    sys.path.insert(0,os.path.dirname(os.path.abspath(__file__)))
+    worker()
+elif __name__ == "__main__":
+    sys.exit(main())
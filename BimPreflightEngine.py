@@ -0,0 +1,1433 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2017 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""The preflight engine: builds a classified snapshot of the objects to
+check, so the preflight tests don't need to rescan the document"""
+
+import os
+import time
+import FreeCAD
+import BimProcessPool
+from BimTranslateUtils import *
+
+
+# spatial structure categories
+
+SITE = "Site"
+BUILDING = "Building"
+STOREY = "Building Storey"
+STRUCTURE = [BUILDING,STOREY,SITE]
+
+
+class PreflightObject:
+
+
+    """a classified view of a document object, collected once per preflight run.
+    The tests only read these attributes, never the object itself, so they
+    can run on a worker thread once the snapshot has been prefetched"""
+
+    def __init__(self,obj):
+
+        import Draft
+        props = obj.PropertiesList
+        self.obj = obj
+        self.name = obj.Name
+        self.docname = obj.Document.Name
+        self.label = obj.Label
+        self.type = Draft.getType(obj)
+        self.properties = set(props)
+        self.hasIfcType = "IfcType" in self.properties
+        self.hasIfcRole = "IfcRole" in self.properties
+        self.ifctype = obj.IfcType if self.hasIfcType else None
+        self.ifcrole = obj.IfcRole if self.hasIfcRole else None
+        self.parents = obj.InList
+        self.isPartFeature = obj.isDerivedFrom("Part::Feature")
+        self.shape = obj.Shape if self.isPartFeature else None
+        self.ifcattributes = obj.IfcAttributes if "IfcAttributes" in self.properties else None
+        self.ifcproperties = obj.IfcProperties if "IfcProperties" in self.properties else None
+        self.material = obj.Material if "Material" in self.properties else None
+        self.standardcode = obj.StandardCode if "StandardCode" in self.properties else None
+        self.materialcode = None # None if the material has no StandardCode property
+        if self.material and ("StandardCode" in self.material.PropertiesList):
+            self.materialcode = self.material.StandardCode
+        self.baseshape = None # the shape of the Base of walls and structures
+        if (self.type in ["Wall","Structure"]) and ("Base" in self.properties) and obj.Base:
+            self.baseshape = getattr(obj.Base,"Shape",None)
+        self.proxy = getattr(obj,"Proxy",None)
+        self.fingerprint = None
+        self.values = {} # values computed from the document, see getValue()
+        self.copied = False # True once the shape is a copy, see copyShape()
+
+    def isIfc(self,value):
+
+        "returns True if the IfcRole or IfcType of this object is the given value"
+
+        return (self.ifcrole == value) or (self.ifctype == value)
+
+    def getFingerprint(self):
+
+        """returns a hash of the contents of this object that the preflight
+        tests look at: shape, IFC data, material and placement"""
+
+        if self.fingerprint is None:
+            obj = self.obj
+            f = [self.type,self.ifctype,self.ifcrole]
+            if self.shape is not None:
+                f.append(self.shape.hashCode())
+            for prop in ["IfcData","IfcProperties","IfcAttributes"]:
+                if prop in self.properties:
+                    f.append(str(sorted(getattr(obj,prop).items())))
+            if self.material:
+                f.append(self.material.Name)
+            if "Placement" in self.properties:
+                f.append(str(obj.Placement))
+            if "Base" in self.properties:
+                base = obj.Base
+                if base and hasattr(base,"Shape"):
+                    f.append(base.Shape.hashCode())
+            self.fingerprint = hash(tuple(f))
+        return self.fingerprint
+
+    def getValue(self,key,func):
+
+        """returns func(self), computed only once. Tests get the values they
+        read from the document through this, so they can be prefetched"""
+
+        if not key in self.values:
+            self.values[key] = func(self)
+        return self.values[key]
+
+    def copyShape(self):
+
+        """replaces the shape by a deep copy, geometry included, that shares
+        nothing with the document. The fingerprint must be computed first"""
+
+        if (self.shape is not None) and (not self.copied):
+            if not self.shape.isNull():
+                self.shape = self.shape.copy()
+            self.copied = True
+
+    def getInputs(self,needs):
+
+        """returns a hash of the parts of this object named in needs, as
+        declared by a custom test: shape, ifc, material, placement or parents"""
+
+        obj = self.obj
+        f = [self.type,self.ifctype,self.ifcrole]
+        for need in needs:
+            if need == "shape":
+                if self.shape is not None:
+                    f.append(self.shape.hashCode())
+            elif need == "ifc":
+                for prop in ["IfcData","IfcProperties","IfcAttributes"]:
+                    if prop in self.properties:
+                        f.append(str(sorted(getattr(obj,prop).items())))
+            elif need == "material":
+                if self.material:
+                    f.append(self.material.Name)
+            elif need == "placement":
+                if "Placement" in self.properties:
+                    f.append(str(obj.Placement))
+            elif need == "parents":
+                f.append(tuple(sorted([p.Name for p in self.parents])))
+            else:
+                f.append(self.getFingerprint())
+        return hash(tuple(f))
+
+
+class PreflightSnapshot:
+
+
+    """A snapshot of the objects to be checked by preflight. It is built once
+    per run and shared by all tests, instead of each test scanning the
+    document again"""
+
+    def __init__(self,objs,cache=None,parallel=False,read=True):
+
+        self.cache = cache # an optional PreflightCache, to reuse results of unchanged objects
+        self.parallel = parallel # if True, geometry checks run on a process pool
+        self.progress = None # an optional PreflightProgress, updated while tests iterate
+        self.objs = list(objs) # the objects to check, read into items by read()
+        self.count = 0 # number of objects read so far
+        self.items = []
+        self.categories = {} # object Name: category, for any object, including parents
+        self.containment = ContainmentIndex(self)
+        self.tests = [] # the tests prefetched while reading objects, see prefetch()
+        self.duration = 0.0
+        if read:
+            self.read()
+
+    def read(self,count=None):
+
+        """reads the next count objects (all if None) from the document, with
+        what the prefetched tests need from it. This must run on the GUI
+        thread. Returns True once all the objects are read"""
+
+        t = time.time()
+        end = len(self.objs) if count is None else min(len(self.objs),self.count+count)
+        for obj in self.objs[self.count:end]:
+            try:
+                item = PreflightObject(obj)
+            except ReferenceError:
+                # deleted since the run started
+                continue
+            self.items.append(item)
+            self.categories[item.name] = self._categorize(item.type,item.ifcrole,item.ifctype)
+            self.readTests(item)
+        self.count = end
+        self.duration += time.time() - t
+        if self.count < len(self.objs):
+            return False
+        FreeCAD.Console.PrintLog("Preflight: snapshot of "+str(len(self.items))+" objects built in "+"%.3f" % self.duration+"s\n")
+        return True
+
+    def __len__(self):
+
+        return len(self.items)
+
+    def __iter__(self):
+
+        if self.progress is None:
+            return iter(self.items)
+        return self._iterate(self.progress)
+
+    def _iterate(self,progress):
+
+        for item in self.items:
+            if progress.cancelled:
+                raise PreflightCancelled()
+            progress.scanned += 1
+            yield item
+
+    def _categorize(self,typ,role,ifctype):
+
+        if (typ == SITE) or (role == SITE) or (ifctype == SITE):
+            return SITE
+        elif (typ == BUILDING) or (role == BUILDING) or (ifctype == BUILDING):
+            return BUILDING
+        elif (role == STOREY) or (ifctype == STOREY):
+            return STOREY
+        return None
+
+    def getCategory(self,obj):
+
+        "returns the spatial category (Site, Building, Building Storey or None) of any object"
+
+        if obj.Name in self.categories:
+            return self.categories[obj.Name]
+        import Draft
+        cat = self._categorize(Draft.getType(obj),getattr(obj,"IfcRole",None),getattr(obj,"IfcType",None))
+        self.categories[obj.Name] = cat
+        return cat
+
+    def isIfc(self,obj,value):
+
+        "returns True if the IfcRole or IfcType of any object is the given value"
+
+        return (getattr(obj,"IfcRole",None) == value) or (getattr(obj,"IfcType",None) == value)
+
+    def hasContainer(self,item,category):
+
+        """returns True if the given item is contained in an object of the given
+        category: directly in a Site or a Building, or under any Building Storey"""
+
+        def find(item):
+            if category == SITE:
+                return bool(self.containment.getSite(item.obj))
+            elif category == BUILDING:
+                return bool(self.containment.getBuilding(item.obj))
+            return bool(self.containment.getStorey(item.obj))
+
+        return item.getValue(category,find)
+
+    def prefetch(self,tests):
+
+        """sets the tests to prefetch: everything they read from the document is
+        then read with the objects, so they can run on a worker thread without
+        touching document objects while the document stays editable. The rest
+        of their preparation is done by prepare(), on the worker thread"""
+
+        self.tests = list(tests)
+        for item in self.items:
+            self.readTests(item)
+
+    def readTests(self,item):
+
+        "reads from the document what the prefetched tests need about the given item"
+
+        if self.cache is not None:
+            item.getFingerprint()
+        for test in self.tests:
+            if test in CONTAINERS:
+                self.hasContainer(item,CONTAINERS[test])
+            elif test in READS:
+                if not self.peek(test,item)[0]:
+                    if self.cache is not None:
+                        self.cache.misses += 1
+                    item.getValue(test,READS[test])
+
+    def prepare(self,progress=None):
+
+        """copies the shapes the prefetched geometry tests look at, and computes
+        the per-object checks that need no document access. This runs on the
+        worker thread once all the objects are read, and stops between objects
+        if the given PreflightProgress is cancelled"""
+
+        tests = [t for t in self.tests if (t in CHECKS) or (t in SHAPETESTS)]
+        if not tests:
+            return
+        for item in self.items:
+            if progress is not None:
+                if progress.cancelled:
+                    raise PreflightCancelled()
+                progress.scanned += 1
+            for test in tests:
+                if (test in SHAPETESTS) and not item.isPartFeature:
+                    continue
+                if self.peek(test,item)[0]:
+                    continue
+                if test in CHECKS:
+                    if self.cache is not None:
+                        self.cache.misses += 1
+                    item.getValue(test,CHECKS[test])
+                else:
+                    item.copyShape()
+
+    def peek(self,test,item):
+
+        """returns (found,value), the result of the given test for the given item
+        if it is prefetched or cached. Cached results are kept in the item, as the
+        cache might be invalidated while tests run"""
+
+        if test in item.values:
+            return True,item.values[test]
+        if self.cache is None:
+            return False,None
+        found,value = self.cache.peek(test,item)
+        if found:
+            self.cache.hits += 1
+            item.values[test] = value
+        return found,value
+
+    def check(self,test,item,func):
+
+        """returns func(item), the per-object result of the given test, reusing
+        the result of a previous run if the object hasn't changed since"""
+
+        if test in item.values:
+            return self.usePrefetched(test,item)
+        if self.cache is None:
+            return func(item)
+        return self.cache.get(test,item,func)
+
+    def usePrefetched(self,test,item):
+
+        "returns the prefetched result of the given test, storing it in the cache if needed"
+
+        value = item.values[test]
+        if (self.cache is not None) and not self.cache.peek(test,item)[0]:
+            self.cache.store(test,item,value)
+        return value
+
+    def checkMany(self,test,items,func,bulk=None):
+
+        """returns the list of per-object results of the given test for all the
+        given items. Results not found in the cache are computed by func(item),
+        or all at once by bulk(items) if given"""
+
+        values = [None] * len(items)
+        missing = []
+        for i,item in enumerate(items):
+            if test in item.values:
+                values[i] = self.usePrefetched(test,item)
+                continue
+            if self.cache is not None:
+                found,value = self.cache.lookup(test,item)
+                if found:
+                    values[i] = value
+                    continue
+            missing.append(i)
+        if missing:
+            if bulk:
+                computed = bulk([items[i] for i in missing])
+            else:
+                computed = [self._compute(func,items[i]) for i in missing]
+            for i,value in zip(missing,computed):
+                values[i] = value
+                if self.cache is not None:
+                    self.cache.store(test,items[i],value)
+        return values
+
+
+    def _compute(self,func,item):
+
+        if (self.progress is not None) and self.progress.cancelled:
+            raise PreflightCancelled()
+        return func(item)
+
+
+class PreflightCache:
+
+
+    """Stores per-object, per-test preflight results between runs. Each result
+    is kept with the fingerprint of the object it was computed from, and the
+    document observer drops the results of objects as soon as they change,
+    so a new run only recomputes what has been edited"""
+
+    def __init__(self):
+
+        self.entries = {} # (Document Name, object Name): {test: (fingerprint, result)}
+        self.plugins = {} # (Document Name, custom test name): (inputs hash, PreflightResult)
+        self.observer = None
+        self.hits = 0
+        self.misses = 0
+
+    def get(self,test,item,func):
+
+        "returns the cached result of func(item) for the given test, computing it if needed"
+
+        found,value = self.lookup(test,item)
+        if not found:
+            value = func(item)
+            self.store(test,item,value)
+        return value
+
+    def lookup(self,test,item):
+
+        "returns a (found,result) tuple for the given test and item"
+
+        found,value = self.peek(test,item)
+        if found:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return found,value
+
+    def peek(self,test,item):
+
+        "same as lookup, without counting hits and misses"
+
+        tests = self.entries.get((item.docname,item.name),{})
+        if (test in tests) and (tests[test][0] == item.getFingerprint()):
+            return True,tests[test][1]
+        return False,None
+
+    def store(self,test,item,value):
+
+        "stores the result of the given test for the given item"
+
+        tests = self.entries.setdefault((item.docname,item.name),{})
+        tests[test] = (item.getFingerprint(),value)
+
+    def invalidate(self,obj):
+
+        "discards all the cached results of the given object"
+
+        try:
+            self.entries.pop((obj.Document.Name,obj.Name),None)
+        except Exception:
+            # the object might be half-deleted already
+            pass
+
+    def clear(self):
+
+        self.entries = {}
+        self.plugins = {}
+
+    def observe(self):
+
+        "starts invalidating results when objects change"
+
+        if not self.observer:
+            self.observer = PreflightObserver(self)
+            FreeCAD.addDocumentObserver(self.observer)
+
+    def stop(self):
+
+        "stops observing the documents and clears the cache"
+
+        if self.observer:
+            FreeCAD.removeDocumentObserver(self.observer)
+            self.observer = None
+        self.clear()
+
+
+class PreflightObserver:
+
+
+    "a document observer that invalidates the cached results of changed objects"
+
+    def __init__(self,cache):
+
+        self.cache = cache
+
+    def slotChangedObject(self,obj,prop):
+
+        self.cache.invalidate(obj)
+
+    def slotDeletedObject(self,obj):
+
+        self.cache.invalidate(obj)
+
+    def slotDeletedDocument(self,doc):
+
+        # the keys are copied first, as a preflight worker thread might be adding results
+        for key in [k for k in list(self.cache.entries.keys()) if k[0] == doc.Name]:
+            self.cache.entries.pop(key,None)
+        for key in [k for k in list(self.cache.plugins.keys()) if k[0] == doc.Name]:
+            self.cache.plugins.pop(key,None)
+
+
+class PreflightCancelled(Exception):
+
+
+    "raised inside a test when its run has been cancelled"
+
+    pass
+
+
+class PreflightProgress:
+
+
+    """The progress of a preflight run. It is written by the thread running the
+    tests and read by the GUI, and carries the cancel request the other way"""
+
+    def __init__(self,tests=0):
+
+        self.tests = tests # number of tests to run
+        self.done = 0 # number of tests completed
+        self.scanned = 0 # number of objects looked at so far, by all tests
+        self.current = None # the test being run
+        self.cancelled = False
+
+    def cancel(self):
+
+        "asks the running tests to stop as soon as possible"
+
+        self.cancelled = True
+
+
+class ContainmentIndex:
+
+
+    """Resolves, for any object, the Site, Building and Building Storey that
+    contain it. Parents are resolved only once and memoized, so each query
+    costs O(1) once the parents of an object have been seen"""
+
+    def __init__(self,snapshot):
+
+        self.snapshot = snapshot
+        self.groups = {} # parent Name: set of Names of its Group contents
+        self.roles = {} # object Name: {IfcRole/IfcType value}
+        self.sites = {} # object Name: Site containing it directly, or None
+        self.buildings = {} # object Name: Building containing it directly, or None
+        self.storeys = {} # object Name: nearest Building Storey ancestor, or None
+        self.found = None # set of categories present in the snapshot
+
+    def inGroup(self,obj,parent):
+
+        "returns True if obj is in the Group of parent"
+
+        if not parent.Name in self.groups:
+            group = getattr(parent,"Group",None)
+            self.groups[parent.Name] = set([o.Name for o in group]) if group else set()
+        return obj.Name in self.groups[parent.Name]
+
+    def isIfc(self,obj,value):
+
+        "returns True if the IfcRole or IfcType of obj is the given value"
+
+        if not obj.Name in self.roles:
+            self.roles[obj.Name] = set([getattr(obj,"IfcRole",None),getattr(obj,"IfcType",None)])
+        return value in self.roles[obj.Name]
+
+    def getSite(self,obj):
+
+        "returns the Site that directly contains obj in its Group, or None"
+
+        if not obj.Name in self.sites:
+            self.sites[obj.Name] = None
+            for parent in obj.InList:
+                if (self.snapshot.getCategory(parent) == SITE) and self.inGroup(obj,parent):
+                    self.sites[obj.Name] = parent
+                    break
+        return self.sites[obj.Name]
+
+    def getBuilding(self,obj):
+
+        "returns the Building (by IFC type) that directly contains obj in its Group, or None"
+
+        if not obj.Name in self.buildings:
+            self.buildings[obj.Name] = None
+            for parent in obj.InList:
+                if self.isIfc(parent,BUILDING) and self.inGroup(obj,parent):
+                    self.buildings[obj.Name] = parent
+                    break
+        return self.buildings[obj.Name]
+
+    def getStorey(self,obj):
+
+        "returns the nearest Building Storey among the ancestors of obj, or None"
+
+        if obj.Name in self.storeys:
+            return self.storeys[obj.Name]
+        # resolve the unresolved ancestors iteratively, deepest first,
+        # so each object is visited once and deep trees don't recurse
+        stack = [obj]
+        while stack:
+            o = stack[-1]
+            parents = [p for p in o.InList if not p.Name in self.storeys]
+            if parents and not o.Name in self.storeys:
+                self.storeys[o.Name] = False # in progress, protects against cycles
+                stack.extend(parents)
+                continue
+            stack.pop()
+            if self.storeys.get(o.Name,None):
+                continue
+            storey = None
+            for p in o.InList:
+                if self.isIfc(p,STOREY):
+                    storey = p
+                    break
+            else:
+                for p in o.InList:
+                    if self.storeys.get(p.Name,None):
+                        storey = self.storeys[p.Name]
+                        break
+            self.storeys[o.Name] = storey
+        return self.storeys[obj.Name]
+
+    def hasCategory(self,category):
+
+        "returns True if the snapshot contains an object of the given category"
+
+        if self.found is None:
+            self.found = set([self.snapshot.categories.get(item.name) for item in self.snapshot])
+        return category in self.found
+
+
+# GUI-free preflight API. Each test function below takes a snapshot (or None
+# for tests that don't look at objects) and returns a PreflightResult. The
+# task panel and the batch runner (BimPreflightBatch.py) both use these.
+
+
+class PreflightResult:
+
+
+    "the result of a preflight test"
+
+    def __init__(self,test):
+
+        self.test = test
+        self.passed = True
+        self.message = "" # explanation, to be placed after the test description
+        self.footer = "" # advice, to be placed after the list of culprits
+        self.notes = {} # object Name: a short explanation of why this object is a culprit
+        self.culprits = [] # objects that made the test fail
+        self.duration = 0.0
+        self.skipped = False # True if the result was reused because nothing it looks at has changed
+        self.profile = "" # profiler statistics, for custom tests run with profiling
+
+    def fail(self,message=""):
+
+        self.passed = False
+        self.message += message
+
+    def toDict(self):
+
+        "returns this result as a json-serializable dict"
+
+        return {"test":self.test,
+                "passed":self.passed,
+                "duration":self.duration,
+                "message":self.message,
+                "skipped":self.skipped,
+                "footer":self.footer,
+                "culprits":[self.getCulprit(o) for o in self.culprits]}
+
+    def getCulprit(self,obj):
+
+        "returns a json-serializable dict describing the given culprit"
+
+        d = {"name":obj.Name,"label":obj.Label}
+        if obj.Name in self.notes:
+            d["note"] = self.notes[obj.Name]
+        return d
+
+    def getLine(self,obj):
+
+        "returns the line of text listing the given culprit"
+
+        if obj.Name in self.notes:
+            return obj.Label + " (" + self.notes[obj.Name] + ")"
+        return obj.Label
+
+    def write(self,stream,header=""):
+
+        """writes this result to the given text stream, one culprit per line,
+        without building the whole text in memory"""
+
+        stream.write(header + self.message)
+        for obj in self.culprits:
+            stream.write(self.getLine(obj) + "\n")
+        if self.footer:
+            stream.write(self.footer + "\n")
+        if self.profile:
+            stream.write("\n" + self.profile)
+
+
+def getObjects(objs):
+
+    "cleans the given list of objects of the types that preflight doesn't check"
+
+    import Draft
+    import Arch
+    objs = Draft.get_group_contents(objs,walls=True,addgroups=True)
+    objs = [obj for obj in objs if not obj.isDerivedFrom("Part::Part2DObject")]
+    objs = [obj for obj in objs if not obj.isDerivedFrom("App::Annotation")]
+    objs = [obj for obj in objs if (hasattr(obj,"Shape") and obj.Shape and not (obj.Shape.Edges and (not obj.Shape.Faces)))]
+    objs = Arch.pruneIncluded(objs)
+    objs = [obj for obj in objs if not obj.isDerivedFrom("App::DocumentObjectGroup")]
+    objs = [obj for obj in objs if Draft.getType(obj) not in ["DraftText","Material","MaterialContainer","WorkingPlaneProxy"]]
+    return objs
+
+
+def getPsetDefinitions():
+
+    "returns a {pset:[property,type,property,type...]} dict of common property sets"
+
+    import csv
+    psets = {}
+    psetspath = os.path.join(FreeCAD.getResourceDir(),"Mod","Arch","Presets","pset_definitions.csv")
+    if os.path.exists(psetspath):
+        with open(psetspath, "r") as csvfile:
+            reader = csv.reader(csvfile, delimiter=';')
+            for row in reader:
+                if "Common" in row[0]:
+                    psets[row[0]] = row[1:]
+    return psets
+
+
+def testIFC4(snapshot=None):
+
+    "tests for IFC4 support"
+
+    result = PreflightResult("testIFC4")
+    try:
+        import ifcopenshell
+    except ImportError:
+        result.fail(translate("BIM","ifcopenshell is not installed on your system or not available to FreeCAD. This library is responsible for IFC support in FreeCAD, and therefore IFC support is currently disabled. Check https://www.freecadweb.org/wiki/Extra_python_modules#IfcOpenShell to obtain more information.")+" ")
+    else:
+        if hasattr(ifcopenshell,"schema_identifier") and ifcopenshell.schema_identifier.startswith("IFC4"):
+            pass
+        elif hasattr(ifcopenshell, "version") and (float(ifcopenshell.version[:3]) >= 0.6):
+            pass
+        else:
+            result.fail(translate("BIM","The version of ifcopenshell installed on your system will produce files with this schema version:")+"\n\n")
+            if hasattr(ifcopenshell,"schema_identifier"):
+                result.message += ifcopenshell.schema_identifier + "\n\n"
+            else:
+                result.message += "Unable to retrieve schemas information from ifcopenshell\n\n"
+    return result
+
+
+def testHierarchy(snapshot):
+
+    "tests for project hierarchy support"
+
+    result = PreflightResult("testHierarchy")
+    containment = snapshot.containment
+    sites = containment.hasCategory(SITE)
+    buildings = containment.hasCategory(BUILDING)
+    storeys = containment.hasCategory(STOREY)
+    if (not sites) or (not buildings)  or (not storeys):
+        result.fail(translate("BIM","The following types were not found in the project:")+"\n")
+        if not sites:
+            result.message += "\nSite"
+        if not buildings:
+            result.message += "\nBuilding"
+        if not storeys:
+            result.message += "\nBuilding Storey"
+    return result
+
+
+def testSites(snapshot):
+
+    "tests for Sites support"
+
+    result = PreflightResult("testSites")
+    for item in snapshot:
+        if snapshot.categories.get(item.name) == BUILDING:
+            if not snapshot.hasContainer(item,SITE):
+                result.culprits.append(item.obj)
+    if result.culprits:
+        result.fail(translate("BIM","The following Building objects have been found to not be included in any Site. You can resolve the situation by creating a Site object, if none is present in your model, and drag and drop the Building objects into it in the tree view:")+"\n\n")
+    return result
+
+
+def testBuildings(snapshot):
+
+    "tests for Buildings support"
+
+    result = PreflightResult("testBuildings")
+    for item in snapshot:
+        if item.isIfc(STOREY):
+            if not snapshot.hasContainer(item,BUILDING):
+                result.culprits.append(item.obj)
+    if result.culprits:
+        result.fail(translate("BIM","The following Building Storey (BuildingParts with their IFC role set as \"Building Storey\") objects have been found to not be included in any Building. You can resolve the situation by creating a Building object, if none is present in your model, and drag and drop the Building Storey objects into it in the tree view:")+"\n\n")
+    return result
+
+
+def testStoreys(snapshot):
+
+    "tests for Building Storey support"
+
+    result = PreflightResult("testStoreys")
+    for item in snapshot:
+        if (item.hasIfcRole and (not item.ifcrole in STRUCTURE)) or (item.hasIfcType and (not item.ifctype in STRUCTURE)):
+            # just check if any of the ancestors is a Building Storey for now. Don't check any further...
+            if not snapshot.hasContainer(item,STOREY):
+                result.culprits.append(item.obj)
+    if result.culprits:
+        result.fail(translate("BIM","The following BIM objects have been found to not be included in any Building Storey (BuildingParts with their IFC role set as \"Building Storey\"). You can resolve the situation by creating a Building Storey object, if none is present in your model, and drag and drop these objects into it in the tree view:")+"\n\n")
+    return result
+
+
+def testUndefined(snapshot):
+
+    "tests for undefined BIM objects"
+
+    result = PreflightResult("testUndefined")
+    undefined = []
+    notbim = []
+    for item in snapshot:
+        if item.hasIfcType:
+            if (item.ifctype == "Undefined"):
+                result.culprits.append(item.obj)
+                undefined.append(item.name)
+        elif item.hasIfcRole:
+            if (item.ifcrole == "Undefined"):
+                result.culprits.append(item.obj)
+                undefined.append(item.name)
+        else:
+            result.culprits.append(item.obj)
+            notbim.append(item.name)
+    if undefined:
+        result.fail(translate("BIM","The following BIM objects have the \"Undefined\" type:")+"\n\n")
+        for name in undefined:
+            result.notes[name] = translate("BIM","Undefined type")
+    if notbim:
+        result.fail(translate("BIM","The following objects are not BIM objects:")+"\n\n")
+        result.footer += translate("BIM","You can turn these objects into BIM objects by using the Utils -> Make Component tool.")
+        for name in notbim:
+            result.notes[name] = translate("BIM","Not a BIM object")
+    return result
+
+
+def testSolid(snapshot):
+
+    "tests for invalid/non-solid BIM objects"
+
+    def check(item):
+        return (not item.shape.isNull()) and ((not item.shape.isValid()) or (not item.shape.Solids))
+
+    result = PreflightResult("testSolid")
+    items = [item for item in snapshot if item.isPartFeature]
+    bulk = None
+    if snapshot.parallel and (len(items) >= PARALLEL_MIN):
+        bulk = lambda items: validateShapes([item.shape for item in items])
+    for item,bad in zip(items,snapshot.checkMany(result.test,items,check,bulk)):
+        if bad:
+            result.culprits.append(item.obj)
+    if result.culprits:
+        result.fail(translate("BIM","The following BIM objects have an invalid or non-solid geometry:")+"\n\n")
+    return result
+
+
+def testQuantities(snapshot):
+
+    "tests for explicit quantities export"
+
+    result = PreflightResult("testQuantities")
+    for item in snapshot:
+        if (item.ifcattributes is not None) and (item.type != "BuildingPart"):
+            for prop in ["Length","Width","Height"]:
+                if prop in item.properties:
+                    if (not "Export"+prop in item.ifcattributes) or (item.ifcattributes["Export"+prop] == "False"):
+                        result.culprits.append(item.obj)
+                        break
+    if result.culprits:
+        result.fail(translate("BIM","The objects below have Length, Width or Height properties, but these properties won't be explicitly exported to IFC. This is not necessarily an issue, unless you specifically want these quantities to be exported:")+"\n\n")
+        result.footer += "\n"+translate("BIM","To enable exporting of these quantities, use the IFC quantities manager tool located under menu Manage -> Manage IFC Quantities...")
+    return result
+
+
+def testCommonPsets(snapshot):
+
+    "tests for common property sets"
+
+    result = PreflightResult("testCommonPsets")
+    psets = [p[5:-6] for p in getPsetDefinitions().keys()]
+    psets = [''.join(map(lambda x: x if x.islower() else " "+x, p)) for p in psets]
+    psets = [pset.strip() for pset in psets]
+    for item in snapshot:
+        ok = True
+        if isinstance(item.ifcproperties,dict):
+            r = None
+            if item.hasIfcType:
+                r = item.ifctype
+            if item.hasIfcRole:
+                r = item.ifcrole
+            if r and (r in psets):
+                ok = False
+                if "Pset_"+r.replace(" ","")+"Common" in ','.join(item.ifcproperties.values()):
+                    ok = True
+        if not ok:
+            result.culprits.append(item.obj)
+    if result.culprits:
+        result.fail(translate("BIM","The objects below have a defined IFC type but do not have the associated common property set:")+"\n\n")
+        result.footer += "\n"+translate("BIM","To add common property sets to these objects, use the IFC properties manager tool located under menu Manage -> Manage IFC Properties...")
+    return result
+
+
+def testPsets(snapshot):
+
+    "tests for property sets integrity"
+
+    def check(item):
+        ok = True
+        ifcproperties = item.ifcproperties
+        r = None
+        if item.hasIfcType:
+            r = item.ifctype
+        elif item.hasIfcRole:
+            r = item.ifcrole
+        if r and (r != "Undefined"):
+            found = None
+            for pset in psets.keys():
+                for val in ifcproperties.values():
+                    if pset in val:
+                        found = pset
+                        break
+            if found:
+                for i in range(int(len(psets[found])/2)):
+                    p = psets[found][i*2]
+                    t = psets[found][i*2+1]
+                    if p in ifcproperties:
+                        if (not found in ifcproperties[p]) or (not t in ifcproperties[p]):
+                            ok = False
+                    else:
+                        ok = False
+        return ok
+
+    result = PreflightResult("testPsets")
+    psets = getPsetDefinitions()
+    for item in snapshot:
+        if isinstance(item.ifcproperties,dict):
+            if not snapshot.check(result.test,item,check):
+                result.culprits.append(item.obj)
+    if result.culprits:
+        result.fail(translate("BIM","The objects below have a common property set but that property set doesn't contain all the needed properties:")+"\n\n")
+        result.footer += "\n"+translate("BIM","Verify which properties a certain property set must contain on http://www.buildingsmart-tech.org/ifc/IFC4/Add2/html/annex/annex-b/alphabeticalorder_psets.htm")+"\n\n"
+        result.footer += translate("BIM","To fix the property sets of these objects, use the IFC properties manager tool located under menu Manage -> Manage IFC Properties...")
+    return result
+
+
+def testMaterials(snapshot):
+
+    "tests for materials in BIM objects"
+
+    result = PreflightResult("testMaterials")
+    for item in snapshot:
+        if "Material" in item.properties:
+            if item.material is None:
+                result.culprits.append(item.obj)
+    if result.culprits:
+        result.fail(translate("BIM","The following BIM objects have no material attributed:")+"\n\n")
+    return result
+
+
+def testStandards(snapshot):
+
+    "tests for standards in BIM objects"
+
+    result = PreflightResult("testStandards")
+    for item in snapshot:
+        if "StandardCode" in item.properties:
+            if not item.standardcode:
+                result.culprits.append(item.obj)
+        if item.materialcode is not None:
+            if not item.materialcode:
+                result.culprits.append(item.material)
+    if result.culprits:
+        result.fail(translate("BIM","The following BIM objects have no defined standard code:")+"\n\n")
+    return result
+
+
+def checkExtrusion(item):
+
+    "returns True if the object of the given item can be exported as an extrusion"
+
+    obj = item.obj
+    if item.proxy is not None:
+        if (item.ifcattributes is not None) and ("FlagForceBrep" in item.ifcattributes.keys()) and (item.ifcattributes["FlagForceBrep"] == "True"):
+            return False
+        elif hasattr(item.proxy,"getExtrusionData") and not item.proxy.getExtrusionData(obj):
+            return False
+        elif item.type == "BuildingPart":
+            pass
+    elif obj.isDerivedFrom("Part::Extrusion"):
+        pass
+    elif obj.isDerivedFrom("App::DocumentObjectGroup"):
+        pass
+    elif obj.isDerivedFrom("App::MaterialObject"):
+        pass
+    else:
+        return False
+    return True
+
+
+def testExtrusions(snapshot):
+
+    "tests is all objects are extrusions"
+
+    result = PreflightResult("testExtrusions")
+    for item in snapshot:
+        if not snapshot.check(result.test,item,lambda i: i.getValue(result.test,checkExtrusion)):
+            result.culprits.append(item.obj)
+    if result.culprits:
+        result.fail(translate("BIM","The following BIM objects are not extrusions:")+"\n\n")
+    return result
+
+
+def checkStandardCase(item):
+
+    "returns True if the object of the given item is a wall or structure standard case"
+
+    shape = item.baseshape
+    if shape is None:
+        return True
+    if item.type == "Wall":
+        if len(shape.Edges) != 1:
+            return False
+    elif item.type == "Structure":
+        if (len(shape.Wires) != 1) or (not shape.Wires[0].isClosed()):
+            return False
+    return True
+
+
+def testStandardCases(snapshot):
+
+    "tests for structs and wall standard cases"
+
+    result = PreflightResult("testStandardCases")
+    for item in snapshot:
+        if item.type in ["Wall","Structure"]:
+            if not snapshot.check(result.test,item,lambda i: i.getValue(result.test,checkStandardCase)):
+                result.culprits.append(item.obj)
+    if result.culprits:
+        result.fail(translate("BIM","The following BIM objects are not standard cases:")+"\n\n")
+    return result
+
+
+def testTinyLines(snapshot):
+
+    """tests for objects with tiny lines (< 0.8mm). The tiny edges found
+    are stored in the edges attribute of the result"""
+
+    def check(item):
+        return [e for e in item.shape.Edges if e.Length <= minl]
+
+    result = PreflightResult("testTinyLines")
+    result.edges = []
+    minl = 0.79376 # min 1/32"
+    items = [item for item in snapshot if item.isPartFeature and item.shape]
+    bulk = None
+    if snapshot.parallel and (len(items) >= PARALLEL_MIN):
+        bulk = lambda items: findShortEdges([item.shape for item in items],minl)
+    for item,edges in zip(items,snapshot.checkMany(result.test,items,check,bulk)):
+        if edges:
+            result.edges.extend(edges)
+            result.culprits.append(item.obj)
+    if result.edges:
+        result.fail(translate("BIM","The objects below have lines smaller than 1/32 inch or 0.79 mm, which is the smallest line size that Revit accepts. These objects will be discarded when imported into Revit:")+"\n\n")
+    return result
+
+
+def testRectangleProfileDef(snapshot=None):
+
+    "tests for RectangleProfileDef disable"
+
+    result = PreflightResult("testRectangleProfileDef")
+    if not FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/Arch").GetBool("DisableIfcRectangleProfileDef",False):
+        result.fail()
+    return result
+
+
+# Parallel geometry checks. Shapes are sent to a pool of processes, see
+# BimProcessPool, as BREP strings, which gives the same results as checking
+# them here, just faster on models with many shapes. The pool worker
+# functions must stay at module level so they can be pickled.
+
+PARALLEL_MIN = BimProcessPool.MIN_ITEMS # below this number of shapes, the serial path is faster
+
+
+def isParallel():
+
+    "returns True if the user prefers geometry checks to run in parallel"
+
+    return FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetBool("PreflightParallel",False)
+
+
+def validateBreps(breps):
+
+    "pool worker: returns, for each BREP string, True if it is invalid or not solid"
+
+    return [(not s.isValid()) or (not s.Solids) for s in BimProcessPool.readBreps(breps)]
+
+
+def measureBreps(breps):
+
+    "pool worker: returns, for each BREP string, a numpy array of the length of its edges"
+
+    import numpy
+    lengths = []
+    for shape in BimProcessPool.readBreps(breps):
+        edges = shape.Edges
+        lengths.append(numpy.fromiter((e.Length for e in edges),dtype=float,count=len(edges)))
+    return lengths
+
+
+def validateShapes(shapes):
+
+    "returns, for each given shape, True if it is invalid or not solid. Null shapes are valid"
+
+    results = [False] * len(shapes)
+    indices = [i for i,s in enumerate(shapes) if not s.isNull()]
+    bad = BimProcessPool.runPool(validateBreps,[shapes[i].exportBrepToString() for i in indices])
+    if bad is None:
+        bad = [(not shapes[i].isValid()) or (not shapes[i].Solids) for i in indices]
+    for i,b in zip(indices,bad):
+        results[i] = b
+    return results
+
+
+def findShortEdges(shapes,length):
+
+    "returns, for each given shape, the list of its edges that are not longer than length"
+
+    import numpy
+    lengths = BimProcessPool.runPool(measureBreps,[s.exportBrepToString() for s in shapes])
+    if lengths is None:
+        lengths = [numpy.fromiter((e.Length for e in s.Edges),dtype=float) for s in shapes]
+    # threshold all the edges of all the shapes at once, then find which shape owns each hit
+    counts = numpy.array([len(l) for l in lengths],dtype=int)
+    offsets = numpy.concatenate(([0],numpy.cumsum(counts)))
+    hits = numpy.nonzero(numpy.concatenate(lengths + [numpy.zeros(0)]) <= length)[0]
+    owners = numpy.searchsorted(offsets,hits,side="right") - 1
+    results = [[] for s in shapes]
+    edges = {}
+    for hit,owner in zip(hits.tolist(),owners.tolist()):
+        if not owner in edges:
+            edges[owner] = shapes[owner].Edges
+        results[owner].append(edges[owner][hit - int(offsets[owner])])
+    return results
+
+
+# all the standard tests, in the order they are run
+
+TESTS = ["testIFC4",
+         "testHierarchy",
+         "testSites",
+         "testBuildings",
+         "testStoreys",
+         "testUndefined",
+         "testSolid",
+         "testQuantities",
+         "testCommonPsets",
+         "testPsets",
+         "testMaterials",
+         "testStandards",
+         "testExtrusions",
+         "testStandardCases",
+         "testTinyLines",
+         "testRectangleProfileDef",
+        ]
+
+# the tests that don't look at document objects, and need no snapshot
+
+NOSNAPSHOT = ["testIFC4","testRectangleProfileDef"]
+
+# what a PreflightSnapshot prefetches for each test. While reading objects,
+# on the GUI thread: the container category resolved for each object, or the
+# per-object check that calls object code. Then in prepare(), on the worker
+# thread: the per-object check computed from the snapshot, or the shape copied
+
+CONTAINERS = {"testSites":SITE,"testBuildings":BUILDING,"testStoreys":STOREY}
+READS = {"testExtrusions":checkExtrusion}
+CHECKS = {"testStandardCases":checkStandardCase}
+SHAPETESTS = ["testSolid","testTinyLines"]
+
+
+def runTest(test,snapshot=None):
+
+    "runs the given test by name on the given snapshot, and returns a timed PreflightResult"
+
+    t = time.time()
+    result = globals()[test](snapshot)
+    result.duration = time.time() - t
+    return result
+
+
+def runTests(snapshot,tests):
+
+    "runs the given tests by name on the given snapshot, and returns a list of PreflightResults"
+
+    return [runTest(test,snapshot) for test in tests]
+
+
+# custom tests
+
+# Custom tests are python modules placed in the BIM/Preflight folder of the
+# user's FreeCAD data folder. Each function of such a module is a test, which
+# takes no argument and returns True if passed, or a failure message. Tests
+# that need to look at objects can be declared with the preflightTest
+# decorator, and are then run on the shared snapshot:
+#
+#     import BimPreflightEngine
+#
+#     @BimPreflightEngine.preflightTest(types=["Wall"],needs=["ifc"],budget=5)
+#     def testWallCodes(snapshot,items):
+#         "Do all walls have a company code?"
+#         bad = [i.obj for i in items if not "Code" in (i.ifcproperties or {})]
+#         if bad:
+#             return bad
+#         return True
+#
+# types: the Draft types, IFC types or IFC roles of the objects to check, all if None
+# needs: the data the test looks at, among NEEDS. The test is skipped, and its
+#        previous result reused, if these haven't changed on any of its objects.
+#        If None, the test always runs.
+# budget: a time limit in seconds. Iterating over items past that time stops the test.
+# profile: if True, the test always runs under the profiler
+
+NEEDS = ["shape","ifc","material","placement","parents","all"]
+
+
+def preflightTest(types=None,needs=None,budget=None,profile=False):
+
+    "decorator that declares the objects and data a custom preflight test works on"
+
+    def declare(func):
+        func.preflight = {"types":types,"needs":needs,"budget":budget,"profile":profile}
+        return func
+    return declare
+
+
+class PreflightTimeout(Exception):
+
+
+    "raised when a custom test runs past its time budget"
+
+    pass
+
+
+class PreflightItems(list):
+
+
+    """the objects given to a custom test. Iterating over them raises
+    PreflightTimeout once the time budget of the test is spent"""
+
+    def __init__(self,items,budget=None,progress=None):
+
+        list.__init__(self,items)
+        self.budget = budget
+        self.progress = progress
+        self.start = time.time()
+
+    def __iter__(self):
+
+        for item in list.__iter__(self):
+            if self.expired():
+                raise PreflightTimeout()
+            if (self.progress is not None) and self.progress.cancelled:
+                raise PreflightCancelled()
+            yield item
+
+    def expired(self):
+
+        "returns True if the time budget is spent"
+
+        return bool(self.budget) and (time.time() - self.start > self.budget)
+
+
+class PreflightPlugin:
+
+
+    "a custom preflight test, wrapping a function of a custom module"
+
+    def __init__(self,func,module):
+
+        spec = getattr(func,"preflight",None)
+        self.func = func
+        self.module = module
+        self.name = "Custom_"+module+"_"+func.__name__
+        self.description = func.__doc__ or "Undefined"
+        self.legacy = spec is None # old-style tests take no argument and get no snapshot
+        spec = spec or {}
+        self.types = spec.get("types",None)
+        self.needs = spec.get("needs",None)
+        self.budget = spec.get("budget",None)
+        self.profile = spec.get("profile",False)
+
+    def getItems(self,snapshot):
+
+        "returns the snapshot items of the declared types"
+
+        if not self.types:
+            return list(snapshot)
+        return [i for i in snapshot if (i.type in self.types) or (i.ifctype in self.types) or (i.ifcrole in self.types)]
+
+    def getInputs(self,items):
+
+        "returns a hash of everything this test declared to look at, or None if it can't be skipped"
+
+        if self.legacy or (self.needs is None):
+            return None
+        return hash(tuple([(i.name,i.getInputs(self.needs)) for i in items]))
+
+    def run(self,snapshot=None,cache=None,profile=False):
+
+        """runs this test and returns a PreflightResult. If a cache is given and
+        none of the declared inputs changed, the previous result is returned"""
+
+        t = time.time()
+        items = []
+        inputs = None
+        key = None
+        if not self.legacy:
+            items = self.getItems(snapshot)
+            inputs = self.getInputs(items)
+            key = (items[0].docname if items else "",self.name)
+        if (cache is not None) and (inputs is not None) and (key in cache.plugins):
+            previous = cache.plugins[key]
+            if previous[0] == inputs:
+                result = previous[1]
+                result.skipped = True
+                result.duration = time.time() - t
+                return result
+        result = PreflightResult(self.name)
+        if self.legacy:
+            args = []
+        else:
+            args = [snapshot,PreflightItems(items,self.budget,snapshot.progress)]
+        profiler = None
+        if profile or self.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+        try:
+            if profiler:
+                value = profiler.runcall(self.func,*args)
+            else:
+                value = self.func(*args)
+        except PreflightCancelled:
+            raise
+        except PreflightTimeout:
+            value = translate("BIM","This test was stopped because it took longer than its time budget of")+" "+str(self.budget)+"s"
+        except Exception as e:
+            value = translate("BIM","This test raised an error:")+" "+repr(e)
+        result.duration = time.time() - t
+        self.setResult(result,value)
+        if profiler:
+            result.profile = getProfile(profiler)
+        if (cache is not None) and (inputs is not None):
+            cache.plugins[key] = (inputs,result)
+        return result
+
+    def setResult(self,result,value):
+
+        """fills the result from what the test function returned: True if passed,
+        or a message, a list of culprit objects, a (message,culprits) tuple
+        or a PreflightResult"""
+
+        if value is True:
+            return
+        if isinstance(value,PreflightResult):
+            result.passed = value.passed
+            result.message = value.message
+            result.culprits = value.culprits
+        elif isinstance(value,tuple):
+            result.fail(str(value[0]))
+            result.culprits = list(value[1])
+        elif isinstance(value,list):
+            result.fail()
+            result.culprits = value
+        else:
+            result.fail(str(value))
+
+
+def getProfile(profiler,count=15):
+
+    "returns the profiler statistics of the slowest functions as a string"
+
+    import io
+    import pstats
+    stream = io.StringIO()
+    stats = pstats.Stats(profiler,stream=stream)
+    stats.sort_stats("cumulative").print_stats(count)
+    return stream.getvalue()
+
+
+def loadPlugins(path=None):
+
+    """returns a list of (module name, [PreflightPlugin]) found in the given
+    folder, by default the BIM/Preflight folder of the user data folder. In
+    modules that use the preflightTest decorator, only decorated functions
+    are tests, the others are considered helpers"""
+
+    import sys
+    import importlib
+    import inspect
+    if not path:
+        path = os.path.join(FreeCAD.getUserAppDataDir(),"BIM","Preflight")
+    plugins = []
+    if not os.path.exists(path):
+        return plugins
+    modules = [m[:-3] for m in sorted(os.listdir(path)) if m.endswith(".py")]
+    if modules and not path in sys.path:
+        sys.path.append(path)
+    for module in modules:
+        mod = importlib.import_module(module)
+        if not "Preflight" in mod.__file__:
+            # prevent from using other modules with same name
+            FreeCAD.Console.PrintLog("Preflight: loaded wrong module - skipping: "+module+" "+str(mod)+"\n")
+            continue
+        FreeCAD.Console.PrintLog("Preflight: found custom module: "+module+" "+str(mod)+"\n")
+        functions = [o[1] for o in inspect.getmembers(mod) if inspect.isfunction(o[1])]
+        if [f for f in functions if hasattr(f,"preflight")]:
+            functions = [f for f in functions if hasattr(f,"preflight")]
+        if functions:
+            plugins.append((module,[PreflightPlugin(f,module) for f in functions]))
+            for f in functions:
+                FreeCAD.Console.PrintLog("Preflight: found custom test: "+f.__name__+"\n")
+    return plugins
@@ -0,0 +1,137 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""Process pools for geometry work, used by preflight and diff. Shapes are
+sent to the pool as BREP strings, and the pool worker functions must stay at
+module level so they can be pickled.
+
+Pool processes are always started with the "spawn" method, on all platforms:
+forking the FreeCAD GUI process, which runs Qt and other threads, can
+deadlock on Linux, and on Windows and macOS, where spawn is the default,
+multiprocessing would launch sys.executable, which inside FreeCAD is FreeCAD
+itself. The processes run a plain python interpreter instead, found by
+getPythonExecutable, which imports FreeCAD as a module from the same library
+path as this process. If no such interpreter is found, or the pool fails,
+runPool returns None and callers compute serially."""
+
+import os
+
+
+MIN_ITEMS = 64 # below this number of shapes, the serial path is faster
+
+
+def getPythonExecutable():
+
+    """returns the path of a python interpreter of the same version as this
+    one, able to import the FreeCAD libraries, or None. It can be set in the
+    ProcessPoolPython preference, otherwise the python bundled with FreeCAD,
+    then one of the system, are used"""
+
+    import sys
+    import shutil
+    import FreeCAD
+    path = FreeCAD.ParamGet("User parameter:BaseApp/Preferences/Mod/BIM").GetString("ProcessPoolPython","")
+    if path:
+        return path if os.path.isfile(path) else None
+    if os.path.basename(sys.executable).lower().startswith("python"):
+        # we are not running inside the FreeCAD executable
+        return sys.executable
+    if sys.platform == "win32":
+        names = ["python.exe"]
+    else:
+        names = ["python"+str(sys.version_info[0])+"."+str(sys.version_info[1]),"python"+str(sys.version_info[0]),"python"]
+    folders = [os.path.dirname(sys.executable),os.path.join(FreeCAD.getHomePath(),"bin"),FreeCAD.getHomePath()]
+    for folder in folders:
+        for name in names:
+            path = os.path.join(folder,name)
+            if os.path.isfile(path):
+                return path
+    if sys.platform != "win32":
+        # only a system python of the exact same version can load the FreeCAD libraries
+        path = shutil.which(names[0])
+        if path:
+            return path
+    return None
+
+
+def initWorker(paths):
+
+    "sets up the python path of a pool process and initializes FreeCAD, so it can import Part"
+
+    import sys
+    for path in paths:
+        if not path in sys.path:
+            sys.path.append(path)
+    import FreeCAD
+    import Part
+
+
+def readBreps(breps):
+
+    "returns a list of shapes from a list of BREP strings"
+
+    import Part
+    shapes = []
+    for brep in breps:
+        shape = Part.Shape()
+        shape.importBrepFromString(brep)
+        shapes.append(shape)
+    return shapes
+
+
+def runPool(func,data):
+
+    """runs func on chunks of data on a pool of processes and returns the
+    concatenated results, or None if a pool cannot be used here"""
+
+    import sys
+    import multiprocessing
+    import FreeCAD
+    from concurrent.futures import ProcessPoolExecutor
+    python = getPythonExecutable()
+    if not python:
+        FreeCAD.Console.PrintWarning("BIM: no python interpreter found to run a process pool, computing serially\n")
+        return None
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(python)
+    workers = multiprocessing.cpu_count()
+    size = max(1,int(len(data)/(workers*4))+1)
+    chunks = [data[i:i+size] for i in range(0,len(data),size)]
+    paths = list(sys.path)+[os.path.join(FreeCAD.getHomePath(),"lib")]
+    # spawned processes run the main script again if it has a path, for ex.
+    # BimPreflightBatch or BimDiffBatch running inside FreeCADCmd
+    main = sys.modules.get("__main__")
+    mainfile = getattr(main,"__file__",None)
+    if mainfile:
+        del main.__file__
+    results = []
+    try:
+        with ProcessPoolExecutor(max_workers=workers,mp_context=context,initializer=initWorker,initargs=(paths,)) as pool:
+            for r in pool.map(func,chunks):
+                results.extend(r)
+    except Exception as e:
+        FreeCAD.Console.PrintWarning("BIM: unable to run a process pool, computing serially: "+str(e)+"\n")
+        return None
+    finally:
+        if mainfile:
+            main.__file__ = mainfile
+    return results
@@ -425,6 +425,11 @@ static char * IFC_xpm[] = {
             self.BimSelectObserver = BimSelect.Setup()
             FreeCADGui.addDocumentObserver(self.BimSelectObserver)
 
+    def setupDiffSnapshots(self):
+
+        import BimDiffEngine
+        BimDiffEngine.observe()
+
     def Activated(self):
 
         if hasattr(FreeCADGui,"draftToolBar"):
@@ -471,6 +476,7 @@ static char * IFC_xpm[] = {
                 w.show()
 
         self.setupMultipleObjectSelection()
+        self.setupDiffSnapshots()
 
         Log("BIM workbench activated\n")
 
@@ -0,0 +1,323 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2017 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""Preflight benchmark suite. Generates synthetic BIM projects of configurable
+size and defects, then times each preflight test and a full run (what
+testAll does: one snapshot, then all the tests), and reports throughput and
+peak memory. The tests are run through the preflight engine, which is what
+the preflight task panel runs too, minus the buttons.
+
+Run it with python, with the FreeCAD lib folder in PYTHONPATH:
+
+    python benchmarkPreflight.py --objects 1000,10000,100000 --json results.json
+
+or with FreeCADCmd, which doesn't pass command line arguments to scripts, by
+placing them in the BIM_BENCHMARK_ARGS environment variable:
+
+    BIM_BENCHMARK_ARGS="--objects 10000" FreeCADCmd benchmarkPreflight.py
+
+Use --baseline with the json file of a previous release to fail (exit code 1)
+when a test became slower than the given tolerance. Use --containment to also
+compare the Sites/Buildings/Storeys checks done by walking the parents of
+each object against the same checks done through the containment index."""
+
+from __future__ import print_function
+
+import os,sys,time,json,shlex
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import FreeCAD
+import BimPreflightEngine
+
+
+class ProjectSpec:
+
+
+    "describes a synthetic project"
+
+    def __init__(self,objects=1000,sites=1,buildings=2,storeys=10,windows=0.3,
+                 broken=0.05,nomaterial=0.1,tiny=0.02):
+
+        self.objects = objects # approximate total number of objects
+        self.sites = sites
+        self.buildings = buildings # per site
+        self.storeys = storeys # per building
+        self.windows = windows # fraction of elements that are windows, the rest are walls
+        self.broken = broken # fraction of elements placed outside any storey
+        self.nomaterial = nomaterial # fraction of elements without material
+        self.tiny = tiny # fraction of elements with a tiny (< 0.8mm) edge
+
+
+def makeProject(spec):
+
+    """creates a document following the given ProjectSpec. Containers are real
+    Arch objects, elements are lightweight Part features carrying the same
+    properties as Arch objects, so very large projects can be generated fast"""
+
+    import Arch
+    import Part
+    doc = FreeCAD.newDocument("PreflightBenchmark")
+    materials = [Arch.makeMaterial("Material"+str(i)) for i in range(5)]
+    storeys = []
+    for s in range(spec.sites):
+        buildings = []
+        for b in range(spec.buildings):
+            bstoreys = []
+            for l in range(spec.storeys):
+                storey = Arch.makeBuildingPart()
+                storey.IfcType = "Building Storey"
+                bstoreys.append(storey)
+            building = Arch.makeBuildingPart(bstoreys)
+            building.IfcType = "Building"
+            buildings.append(building)
+            storeys.extend(bstoreys)
+        Arch.makeSite(buildings)
+    count = max(0,spec.objects - len(doc.Objects))
+    box = Part.makeBox(1000,200,3000)
+    tinybox = Part.makeBox(1000,0.5,3000)
+    contents = {}
+    for i in range(count):
+        # spread defects evenly with a stride instead of randomly, so runs are reproducible
+        iswindow = (i % 100) < spec.windows * 100
+        obj = doc.addObject("Part::FeaturePython","Window" if iswindow else "Wall")
+        obj.addProperty("App::PropertyString","IfcType","IFC","")
+        obj.addProperty("App::PropertyMap","IfcProperties","IFC","")
+        obj.addProperty("App::PropertyMap","IfcAttributes","IFC","")
+        obj.addProperty("App::PropertyLink","Material","Component","")
+        obj.addProperty("App::PropertyString","StandardCode","Component","")
+        obj.IfcType = "Window" if iswindow else "Wall"
+        obj.Shape = tinybox if (i % 1000) < spec.tiny * 1000 else box
+        if (i % 997) >= spec.nomaterial * 997:
+            obj.Material = materials[i % len(materials)]
+        if storeys and ((i % 991) >= spec.broken * 991):
+            contents.setdefault(i % len(storeys),[]).append(obj)
+    for i,objs in contents.items():
+        storeys[i].Group = objs
+    doc.recompute()
+    return doc
+
+
+def peakMemory():
+
+    "returns the peak resident memory of this process in MB, or 0 if unknown"
+
+    try:
+        import resource
+    except ImportError:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == "darwin":
+        return peak / (1024.0 * 1024.0) # bytes
+    return peak / 1024.0 # kilobytes
+
+
+def naive(objs):
+
+    "runs the Sites/Buildings/Storeys checks the old way, walking parents and groups"
+
+    culprits = []
+    for obj in objs:
+        ifctype = getattr(obj,"IfcType",None)
+        if ifctype == "Building":
+            if not [p for p in obj.InList if getattr(p,"IfcType",None) == "Site" and obj in p.Group]:
+                culprits.append(obj)
+        elif ifctype == "Building Storey":
+            if not [p for p in obj.InList if getattr(p,"IfcType",None) == "Building" and obj in p.Group]:
+                culprits.append(obj)
+        elif ifctype not in BimPreflightEngine.STRUCTURE:
+            for parent in obj.InListRecursive:
+                if getattr(parent,"IfcType",None) == "Building Storey":
+                    break
+            else:
+                culprits.append(obj)
+    return culprits
+
+
+def indexed(snapshot):
+
+    "runs the Sites/Buildings/Storeys checks through the containment index"
+
+    culprits = []
+    for item in snapshot:
+        if item.ifctype == "Building":
+            if not snapshot.hasContainer(item,BimPreflightEngine.SITE):
+                culprits.append(item.obj)
+        elif item.ifctype == "Building Storey":
+            if not snapshot.hasContainer(item,BimPreflightEngine.BUILDING):
+                culprits.append(item.obj)
+        elif item.ifctype not in BimPreflightEngine.STRUCTURE:
+            if not snapshot.hasContainer(item,BimPreflightEngine.STOREY):
+                culprits.append(item.obj)
+    return culprits
+
+
+def compareContainment(objs):
+
+    "times the naive and the indexed containment checks on the given objects, returns a dict"
+
+    t = time.time()
+    c1 = naive(objs)
+    t1 = time.time() - t
+    t = time.time()
+    snapshot = BimPreflightEngine.PreflightSnapshot(objs)
+    t2 = time.time() - t
+    t = time.time()
+    c2 = indexed(snapshot)
+    t3 = time.time() - t
+    return {"naive":t1,"snapshot":t2,"indexed":t3,"speedup":t1/max(t3,1e-9),
+            "naive_culprits":len(c1),"indexed_culprits":len(c2)}
+
+
+def runOnce(objs,tests,parallel=False):
+
+    "takes a snapshot of the given objects and runs the given tests on it, returns (durations,culprits) dicts"
+
+    t = time.time()
+    snapshot = BimPreflightEngine.PreflightSnapshot(objs,parallel=parallel)
+    durations = {"snapshot":snapshot.duration}
+    culprits = {}
+    for result in BimPreflightEngine.runTests(snapshot,tests):
+        durations[result.test] = result.duration
+        culprits[result.test] = len(result.culprits)
+    durations["testAll"] = time.time() - t
+    return durations,culprits
+
+
+def run(spec,tests=None,parallel=False,repeat=1,containment=False):
+
+    "generates a project and benchmarks the given tests on it. Returns a json-serializable dict"
+
+    import tracemalloc
+    if not tests:
+        tests = BimPreflightEngine.TESTS
+    t = time.time()
+    doc = makeProject(spec)
+    report = {"objects":len(doc.Objects),"generation":time.time()-t,"parallel":parallel,"tests":{}}
+    try:
+        objs = BimPreflightEngine.getObjects(doc.Objects)
+        report["checked"] = len(objs)
+        best = {}
+        for r in range(repeat):
+            durations,culprits = runOnce(objs,tests,parallel)
+            for k,v in durations.items():
+                best[k] = min(best.get(k,v),v)
+        # tracemalloc slows down every allocation, so memory is measured in a separate, untimed run
+        tracemalloc.start()
+        try:
+            runOnce(objs,tests,parallel)
+            report["python_peak_mb"] = tracemalloc.get_traced_memory()[1] / (1024.0 * 1024.0)
+        finally:
+            tracemalloc.stop()
+        if containment:
+            report["containment"] = compareContainment(objs)
+        for k,v in best.items():
+            report["tests"][k] = {"duration":v,
+                                  "throughput":report["checked"] / v if v else None,
+                                  "culprits":culprits.get(k)}
+        report["peak_mb"] = peakMemory()
+    finally:
+        FreeCAD.closeDocument(doc.Name)
+    return report
+
+
+def printReport(report):
+
+    print("Project:",report["objects"],"objects,",report["checked"],"checked, generated in","%.2f" % report["generation"],"s")
+    print("  %-26s %10s %14s %9s" % ("test","time (s)","objects/s","culprits"))
+    for k,v in report["tests"].items():
+        throughput = "%14.0f" % v["throughput"] if v["throughput"] else "%14s" % "-"
+        print("  %-26s %10.4f %s %9s" % (k,v["duration"],throughput,"" if v["culprits"] is None else v["culprits"]))
+    print("  peak memory:","%.1f" % report["peak_mb"],"MB (python allocations:","%.1f" % report["python_peak_mb"],"MB)")
+    if "containment" in report:
+        c = report["containment"]
+        print("  containment checks:")
+        print("    walking parents:   ","%.3f" % c["naive"],"s,",c["naive_culprits"],"culprits")
+        print("    snapshot:          ","%.3f" % c["snapshot"],"s")
+        print("    containment index: ","%.3f" % c["indexed"],"s,",c["indexed_culprits"],"culprits")
+        print("    speed-up (checks only):","%.1f" % c["speedup"],"x")
+
+
+def compare(reports,baseline,tolerance):
+
+    "returns a list of regressions of reports against the baseline reports, matched by project size"
+
+    regressions = []
+    old = dict([(b["objects"],b) for b in baseline])
+    for report in reports:
+        if not report["objects"] in old:
+            continue
+        for k,v in report["tests"].items():
+            before = old[report["objects"]]["tests"].get(k)
+            # ignore sub-millisecond tests, their timings are mostly noise
+            if before and (v["duration"] > 0.001) and (v["duration"] > before["duration"] * (1 + tolerance)):
+                regressions.append((report["objects"],k,before["duration"],v["duration"]))
+    return regressions
+
+
+def main(argv=None):
+
+    import argparse
+    parser = argparse.ArgumentParser(description="Benchmarks the BIM preflight tests on synthetic projects")
+    parser.add_argument("--objects",default="1000,10000",help="comma-separated project sizes (1000 to 100000)")
+    parser.add_argument("--sites",type=int,default=1)
+    parser.add_argument("--buildings",type=int,default=2,help="buildings per site")
+    parser.add_argument("--storeys",type=int,default=10,help="storeys per building")
+    parser.add_argument("--windows",type=float,default=0.3,help="fraction of elements that are windows")
+    parser.add_argument("--broken",type=float,default=0.05,help="fraction of elements outside any storey")
+    parser.add_argument("--nomaterial",type=float,default=0.1,help="fraction of elements without material")
+    parser.add_argument("--tiny",type=float,default=0.02,help="fraction of elements with tiny edges")
+    parser.add_argument("--tests",default="",help="comma-separated tests to run (default: all)")
+    parser.add_argument("--parallel",action="store_true",help="use the parallel geometry checks")
+    parser.add_argument("--repeat",type=int,default=1,help="runs per project, the best time is kept")
+    parser.add_argument("--containment",action="store_true",help="also compare the parent walk against the containment index")
+    parser.add_argument("--json",help="path of a json file to write the results to")
+    parser.add_argument("--baseline",help="json results of a previous run to compare against")
+    parser.add_argument("--tolerance",type=float,default=0.2,help="allowed slowdown against the baseline (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    tests = [t for t in args.tests.split(",") if t]
+    reports = []
+    for size in [int(s) for s in args.objects.split(",") if s]:
+        spec = ProjectSpec(size,args.sites,args.buildings,args.storeys,args.windows,
+                           args.broken,args.nomaterial,args.tiny)
+        report = run(spec,tests,args.parallel,max(1,args.repeat),args.containment)
+        printReport(report)
+        reports.append(report)
+    if args.json:
+        with open(args.json,"w") as f:
+            json.dump(reports,f,indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(reports,json.load(f),args.tolerance)
+        for size,test,before,after in regressions:
+            print("REGRESSION:",test,"on",size,"objects:","%.4f" % before,"s ->","%.4f" % after,"s")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+
+    if os.environ.get("BIM_BENCHMARK_ARGS"):
+        sys.exit(main(shlex.split(os.environ["BIM_BENCHMARK_ARGS"])))
+    sys.exit(main())
@@ -0,0 +1,56 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2019 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+"""This script checks that the IFC explorer can select, in its tree, the
+walls of an IFC file, which is what link navigation, reference jumps and
+search results do. Run it from the FreeCAD python console, as it needs the GUI
+and the BIM workbench modules:
+
+    exec(open("/path/to/checkIfcExplorer.py").read())
+    check("/path/to/file.ifc")"""
+
+from __future__ import print_function
+
+
+def check(filename,ifctype="IfcWall"):
+
+    "returns the ids of the entities of the given type that the explorer can't select"
+
+    import ifcopenshell
+    import BimIfcExplorer
+    explorer = BimIfcExplorer.BIM_IfcExplorer()
+    explorer.Activated()
+    ifc = ifcopenshell.open(filename)
+    explorer.setFile(filename,ifc)
+    failed = []
+    entities = ifc.by_type(ifctype)
+    for entity in entities:
+        if not explorer.selectEntity(entity.id()):
+            failed.append(entity.id())
+            continue
+        index = explorer.tree.currentIndex()
+        if (not index.isValid()) or (explorer.model.data(index,BimIfcExplorer.QtCore.Qt.UserRole) != entity.id()):
+            failed.append(entity.id())
+    print(len(entities)-len(failed),"of",len(entities),ifctype,"selected in the tree")
+    if failed:
+        print("Not selected:",", ".join(["#"+str(i) for i in failed]))
+    return failed
@@ -0,0 +1,90 @@
+#***************************************************************************
+#*                                                                         *
+#*   Copyright (c) 2017 Yorik van Havre <yorik@uncreated.net>              *
+#*                                                                         *
+#*   This program is free software; you can redistribute it and/or modify  *
+#*   it under the terms of the GNU Lesser General Public License (LGPL)    *
+#*   as published by the Free Software Foundation; either version 2 of     *
+#*   the License, or (at your option) any later version.                   *
+#*   for detail see the LICENCE text file.                                 *
+#*                                                                         *
+#*   This program is distributed in the hope that it will be useful,       *
+#*   but WITHOUT ANY WARRANTY; without even the implied warranty of        *
+#*   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the         *
+#*   GNU Library General Public License for more details.                  *
+#*                                                                         *
+#*   You should have received a copy of the GNU Library General Public     *
+#*   License along with this program; if not, write to the Free Software   *
+#*   Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA  02111-1307  *
+#*   USA                                                                   *
+#*                                                                         *
+#***************************************************************************
+
+
+"""This script checks the searches of the library index, with each full-text
+search version the local SQLite supports: the FTS4 fallback is forced by
+creating the search table before the index is opened. Run it with python,
+with the FreeCAD lib folder in PYTHONPATH:
+
+    python checkLibraryIndex.py
+
+The exit code is 1 if a search didn't find what it should"""
+
+from __future__ import print_function
+
+import os,sys,shutil,sqlite3,tempfile
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import BimLibraryIndex
+
+
+ENTRIES = [("Doors/WoodenDoor.fcstd",100,0.0),("Windows/Metal_Window.ifc",200,0.0),("Furniture/Table.step",300,0.0)]
+
+SEARCHES = [("woo",["Doors/WoodenDoor.fcstd"]),
+            ("wooden door",["Doors/WoodenDoor.fcstd"]),
+            ("win met",["Windows/Metal_Window.ifc"]),
+            ("furn",["Furniture/Table.step"]),
+            ("chair",[])]
+
+
+def check(fts):
+
+    "returns the searches that failed with the given fts version, 4 or 5"
+
+    folder = tempfile.mkdtemp()
+    path = os.path.join(folder,"LibraryIndex.sqlite")
+    failed = []
+    try:
+        db = sqlite3.connect(path)
+        try:
+            db.execute("CREATE VIRTUAL TABLE search USING fts"+str(fts)+"(name,tags,path)")
+        except sqlite3.OperationalError:
+            print("FTS"+str(fts)+" is not available in this SQLite, skipped")
+            return failed
+        finally:
+            db.close()
+        index = BimLibraryIndex.LibraryIndex(path)
+        try:
+            if index.fts != fts:
+                failed.append(("index uses FTS"+str(index.fts),[]))
+                return failed
+            index.add("local",ENTRIES)
+            for text,expected in SEARCHES:
+                found = [row[0] for row in index.search(text,"local")]
+                if found != expected:
+                    failed.append((text,found))
+        finally:
+            index.close()
+    finally:
+        shutil.rmtree(folder,True)
+    print("FTS"+str(fts)+":",len(SEARCHES)-len(failed),"of",len(SEARCHES),"searches passed")
+    for text,found in failed:
+        print("  failed:",text,found)
+    return failed
+
+
+if __name__ == "__main__":
+
+    failed = check(5) + check(4)
+    sys.exit(1 if failed else 0)